@@ -2,8 +2,9 @@
 '''
     Basic sample loading credentials from file and sending data to endpoint
 '''
-import time
 import sys
+import signal
+import threading
 from model.json_device import JsonDevice
 
 
@@ -14,10 +15,16 @@ def main(argv):
     device = JsonDevice(CREDENTIALS_PATH)
     device.connect()
 
+    # kill -HUP reloads the json, reconnecting only if the credentials changed. It runs between cycles,
+    # request_reload() is called from a thread as it takes a lock the main thread may be holding
+    signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=device.request_reload).start())
+
+    # Each attribute is sampled and sent at its own interval from the json config
+    device.build_schedule()
     while True:
-        data_sent = device.send_device_states()
-        print(data_sent)
-        time.sleep(10)
+        data_sent = device.send_scheduled_states()
+        if data_sent is not None:
+            print(data_sent)
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+'''
+    Simulates a fleet of devices from a folder of device config jsons in one process
+
+    Every device keeps its own attribute schedule, send times are staggered across
+    the fleet and one loop hands due devices to a small thread pool.
+    Usage: iotc-fleet.py CONFIG_DIR [--workers 16] [--stagger 10] [--offline]
+'''
+import os
+import sys
+import time
+import heapq
+import argparse
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from model.json_device import JsonDevice
+from model.event_watcher import EventWatcher
+from model.enums import Enums as E
+from model.scheduler import IDLE_WAIT
+
+STATS_INTERVAL = 60
+
+
+def rss_bytes() -> int:
+    '''Resident set size of this process, 0 where /proc isn't available'''
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def offline_sdk():
+    '''The stand-in client from tools/fake_sdk.py, which is only in the source tree'''
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools"))
+    from fake_sdk import FakeIoTConnectSDK
+    return FakeIoTConnectSDK
+
+
+def load_fleet(config_dir: str, sdk_class=None) -> list:
+    '''Creates and connects a device per json in config_dir, printing the memory each one took'''
+    paths = sorted(os.path.join(config_dir, name) for name in os.listdir(config_dir) if name.endswith(".json"))
+    if not paths:
+        raise ValueError("No device jsons in " + config_dir)
+
+    # one thread and inotify instance for every device's attribute events
+    event_watcher = EventWatcher()
+    devices = []
+    device_bytes = []
+    rss_before = rss_bytes()
+    tracemalloc.start()
+    for path in paths:
+        before = tracemalloc.get_traced_memory()[0]
+        device = JsonDevice(path, event_watcher)
+        device.connect(sdk_class)
+        if sdk_class is not None:
+            # nothing answers GetAttributes offline, send every attribute as a string
+            device.SdkClient.inject_attributes([{E.MetadataKeys.name: a.name, E.MetadataKeys.data_type: E.SendDataTypes.STRING} for a in device.attributes])
+        device_bytes.append(tracemalloc.get_traced_memory()[0] - before)
+        devices.append(device)
+    tracemalloc.stop()
+    rss_per_device = (rss_bytes() - rss_before) / len(devices)
+
+    print("Loaded", len(devices), "devices")
+    print("Python heap per device: min {:.1f} KiB, avg {:.1f} KiB, max {:.1f} KiB".format(
+        min(device_bytes) / 1024, sum(device_bytes) / len(device_bytes) / 1024, max(device_bytes) / 1024))
+    print("RSS per device: {:.1f} KiB (includes tracing overhead)".format(rss_per_device / 1024))
+    return devices
+
+
+def run_fleet(devices: list, workers: int, stagger: float):
+    '''Sends every device's scheduled states forever, device i starts i * stagger / len(devices) seconds in'''
+    now = time.monotonic()
+    heap = []
+    # devices with nothing scheduled, checked every IDLE_WAIT seconds till a reload gives them attributes
+    idle = set()
+    # keys that fell due while the device was still sending, sent with its next due keys
+    held = {}
+
+    def schedule(i):
+        due = devices[i].scheduler.next_due()
+        if due is None:
+            idle.add(i)
+        else:
+            heapq.heappush(heap, (due, i))
+
+    for i, device in enumerate(devices):
+        device.build_schedule(now + i * stagger / len(devices))
+        schedule(i)
+
+    busy = set()
+    sends = 0
+    overruns = 0
+    next_stats = now + STATS_INTERVAL
+    next_idle_check = now + IDLE_WAIT
+
+    def send(i, due_keys, event_names):
+        try:
+            devices[i].send_due_states(due_keys, event_names)
+        except Exception as exception:
+            print("Device", devices[i].unique_id, "raised", repr(exception))
+        finally:
+            busy.discard(i)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fleet") as pool:
+        while True:
+            now = time.monotonic()
+            if idle and now >= next_idle_check:
+                for i in list(idle):
+                    if devices[i].scheduler.next_due() is not None:
+                        idle.discard(i)
+                        schedule(i)
+            if now >= next_idle_check:
+                next_idle_check = now + IDLE_WAIT
+
+            wake = heap[0][0] if heap else next_idle_check
+            if idle:
+                wake = min(wake, next_idle_check)
+            if wake > now:
+                time.sleep(wake - now)
+                continue
+
+            due, i = heapq.heappop(heap)
+            device = devices[i]
+            # the cloud's data frequency or backpressure may have changed its report intervals
+            device.apply_send_rate()
+            due_keys = device.scheduler.pop_due()
+            if i in busy:
+                # the previous send of this device is still running, keep its keys for the next one rather than pile up
+                overruns += 1
+                pending = held.setdefault(i, [])
+                pending.extend(key for key in due_keys if key not in pending)
+            else:
+                if (pending := held.pop(i, None)) is not None:
+                    due_keys = pending + [key for key in due_keys if key not in pending]
+                busy.add(i)
+                sends += 1
+                # changed files are sent with the device's next due attributes, not as they change
+                pool.submit(send, i, due_keys, device.take_events())
+            schedule(i)
+
+            if time.monotonic() >= next_stats:
+                print("Fleet: {} scheduled sends, {} delayed while the device was still sending".format(sends, overruns))
+                next_stats += STATS_INTERVAL
+
+
+def main(argv):
+    '''Main function'''
+    parser = argparse.ArgumentParser(description="Simulate many devices from a folder of device jsons")
+    parser.add_argument("config_dir", help="folder of device config jsons, one device each")
+    parser.add_argument("--workers", type=int, default=16, help="threads sampling and sending device states")
+    parser.add_argument("--stagger", type=float, default=10, help="seconds over which device start times are spread")
+    parser.add_argument("--offline", action="store_true", help="use tools/fake_sdk.py instead of connecting to the cloud")
+    args = parser.parse_args(argv[1:])
+
+    sdk_class = offline_sdk() if args.offline else None
+    devices = load_fleet(args.config_dir, sdk_class)
+    run_fleet(devices, args.workers, args.stagger)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,89 @@
+'''
+    Change driven reporting
+
+    Remembers the last value sent for every field of every device and drops fields
+    that haven't changed. Numbers may be given an absolute or percent deadband,
+    everything else is compared exactly. With both, a value counts as changed once it
+    is outside either band, so the tighter one decides. A field is always sent again once it has
+    been silent for max_silence seconds, so the cloud still sees the full state.
+'''
+import time
+
+
+class ChangeStats:
+    def __init__(self):
+        # last cycle
+        self.sent_fields = 0
+        self.suppressed_fields = 0
+        # since startup
+        self.total_sent_fields = 0
+        self.total_suppressed_fields = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class ChangeFilter:
+    def __init__(self, max_silence: float, deadbands: dict = None, clock=time.monotonic):
+        self.max_silence = max_silence
+        # field name -> (absolute, percent), either may be None
+        self.deadbands = deadbands if deadbands is not None else {}
+        self.clock = clock
+        # unique_id -> {field name: (value, monotonic time sent)}
+        self.last_sent: dict = {}
+        self.stats = ChangeStats()
+
+    def set_deadband(self, name: str, absolute: float = None, percent: float = None):
+        if absolute is None and percent is None:
+            self.deadbands.pop(name, None)
+        else:
+            self.deadbands[name] = (absolute, percent)
+
+    def is_changed(self, name: str, old, new) -> bool:
+        if type(old) is bool or type(new) is bool or not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+            return old != new
+
+        deadband = self.deadbands.get(name)
+        if deadband is None:
+            return old != new
+        absolute, percent = deadband
+        delta = abs(new - old)
+        if absolute is not None and delta > absolute:
+            return True
+        if percent is not None and delta > abs(old) * percent / 100:
+            return True
+        return False
+
+    def filter(self, unique_id: str, data: dict) -> dict:
+        '''Returns the fields of data that should be sent and records them as sent'''
+        now = self.clock()
+        last = self.last_sent.setdefault(unique_id, {})
+        to_send = {}
+        for name, value in data.items():
+            previous = last.get(name)
+            if previous is not None:
+                old, sent_at = previous
+                if now - sent_at < self.max_silence and not self.is_changed(name, old, value):
+                    self.stats.suppressed_fields += 1
+                    self.stats.total_suppressed_fields += 1
+                    continue
+            to_send[name] = value
+            last[name] = (value, now)
+        self.stats.sent_fields += len(to_send)
+        self.stats.total_sent_fields += len(to_send)
+        return to_send
+
+    def start_cycle(self):
+        '''Resets the last cycle counters'''
+        self.stats.sent_fields = 0
+        self.stats.suppressed_fields = 0
+
+    def filter_entries(self, entries: list) -> list:
+        '''Filters uniqueId/time/data entries in place, dropping entries left with no data'''
+        filtered = []
+        for entry in entries:
+            data = self.filter(entry["uniqueId"], entry["data"])
+            if data:
+                entry["data"] = data
+                filtered.append(entry)
+        return filtered
@@ -0,0 +1,122 @@
+'''
+    Gateway children
+
+    ChildRegistry keeps a gateway's children indexed by uniqueId, in the order they
+    were added. ChildCollector reads the children's states on a bounded thread pool
+    so one child with slow I/O can't hold up the others: a child that hasn't
+    answered by the deadline is reported stale and left out of that cycle.
+'''
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class ChildRegistry:
+    '''uniqueId -> child, iterates like the list it replaces'''
+    def __init__(self, children=None):
+        self.entries: dict = {}
+        if children is not None:
+            for child in children:
+                self.add(child)
+
+    def add(self, child):
+        if child.unique_id in self.entries:
+            raise ValueError("Duplicate child uniqueId " + str(child.unique_id))
+        self.entries[child.unique_id] = child
+
+    def remove(self, unique_id):
+        '''Returns the removed child, None if there was none'''
+        return self.entries.pop(unique_id, None)
+
+    def get(self, unique_id):
+        return self.entries.get(unique_id)
+
+    def __contains__(self, unique_id):
+        return unique_id in self.entries
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class CollectStats:
+    def __init__(self):
+        self.cycles = 0
+        self.collected = 0
+        # uniqueId -> cycles missed in a row, cleared when the child answers in time
+        self.stale: dict = {}
+        self.stale_total = 0
+        self.last_cycle_ms = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "cycles": self.cycles,
+            "collected": self.collected,
+            "stale_total": self.stale_total,
+            "stale_now": len(self.stale),
+            "last_cycle_ms": self.last_cycle_ms,
+        }
+
+
+class ChildCollector:
+    def __init__(self, workers: int = 4, deadline: float = 1.0):
+        '''deadline is seconds from the start of a cycle, shared by all children of that cycle'''
+        if workers < 1 or deadline <= 0:
+            raise ValueError("workers must be at least 1 and deadline positive")
+        self.deadline = deadline
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="child-state")
+        # uniqueId -> future of a read that overran its deadline and hasn't finished yet
+        self.late: dict = {}
+        self.stats = CollectStats()
+
+    def collect(self, children, timestamp: str) -> list:
+        '''get_d2c_data(timestamp) of every child that answers in time, in registry order'''
+        start = time.monotonic()
+        futures = []
+        stale = []
+        for child in children:
+            late = self.late.get(child.unique_id)
+            if late is not None:
+                if not late.done():
+                    # the previous read is still running, don't read the child twice at once
+                    stale.append(child.unique_id)
+                    continue
+                del self.late[child.unique_id]
+            futures.append((child, self.pool.submit(child.get_d2c_data, timestamp)))
+
+        if futures:
+            wait([future for _, future in futures], timeout=self.deadline)
+
+        data_array = []
+        for child, future in futures:
+            if not future.done():
+                # not started yet can still be called off, a running read is left to finish
+                if not future.cancel():
+                    self.late[child.unique_id] = future
+                stale.append(child.unique_id)
+                continue
+            try:
+                data_array.append(future.result())
+            except Exception as exception:
+                print("Child", child.unique_id, "state failed:", repr(exception))
+                continue
+            if self.stats.stale.pop(child.unique_id, None) is not None:
+                print("Child", child.unique_id, "is answering in time again")
+
+        self._report_stale(stale)
+        self.stats.cycles += 1
+        self.stats.collected += len(data_array)
+        self.stats.last_cycle_ms = (time.monotonic() - start) * 1000
+        return data_array
+
+    def _report_stale(self, stale: list):
+        for unique_id in stale:
+            missed = self.stats.stale.get(unique_id, 0) + 1
+            self.stats.stale[unique_id] = missed
+            self.stats.stale_total += 1
+            if missed == 1:
+                print("Child", unique_id, "missed the", "{:g}s".format(self.deadline), "deadline, its state is stale")
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
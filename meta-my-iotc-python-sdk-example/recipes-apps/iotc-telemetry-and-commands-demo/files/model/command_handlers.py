@@ -0,0 +1,65 @@
+'''
+    In-process command handlers
+
+    Handlers are plain python callables taking the command's arguments and returning
+    (success, message). They are registered either by a plugin module in the commands
+    folder, imported once at startup, or declared in the device json as built in types.
+    Commands with a handler run without forking a shell, scripts remain the fallback.
+'''
+import os
+import importlib.util
+
+# Module in the commands folder that is imported instead of executed
+PLUGIN_FILE_NAME = "iotc_handlers.py"
+
+
+class HandlerTypes:
+    write_file = "write_file"
+
+
+class HandlerRegistry:
+    def __init__(self):
+        self.handlers: dict = {}
+
+    def add(self, name: str, handler):
+        '''Registers handler(args: list) -> (success: bool, message: str) as command name'''
+        self.handlers[name] = handler
+
+    def get(self, name: str):
+        return self.handlers.get(name)
+
+    def __contains__(self, name):
+        return name in self.handlers
+
+
+def load_plugin(path: str, registry: HandlerRegistry):
+    '''Imports the plugin module at path and lets it register its handlers'''
+    spec = importlib.util.spec_from_file_location("iotc_handlers", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if not hasattr(module, "register"):
+        raise AttributeError(path + " must define register(registry)")
+    module.register(registry)
+
+
+def write_file_handler(path: str, values: list = None):
+    '''Handler writing its single argument to path, optionally restricted to values'''
+    def handler(args: list):
+        if len(args) != 1:
+            return False, "Usage: <value>"
+        value = args[0]
+        if values is not None and value not in values:
+            return False, "Error: Input must be one of " + ", ".join(values)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+        try:
+            os.write(fd, value.encode("utf-8"))
+        finally:
+            os.close(fd)
+        return True, "Value '" + value + "' written to '" + path + "' successfully."
+    return handler
+
+
+def make_handler(handler_type: str, path: str, values: list = None):
+    if handler_type == HandlerTypes.write_file:
+        return write_file_handler(path, values)
+    raise ValueError("Unknown command handler type: " + str(handler_type))
@@ -0,0 +1,125 @@
+'''
+    Size capped command output
+
+    A script's stdout and stderr are read as it runs instead of being buffered whole.
+    Each stream keeps its first and last max_bytes / 2 bytes, anything between is
+    counted and dropped, so a command holds at most 2 * max_bytes of output however
+    much the script prints, and the ack shows how it started and how it ended.
+'''
+import os
+import time
+import selectors
+import subprocess
+
+READ_SIZE = 4096
+OMITTED = "\n... {} bytes omitted ...\n"
+
+
+class OutputExcerpt:
+    def __init__(self, max_bytes: int):
+        if max_bytes < 2:
+            raise ValueError("max_bytes must be at least 2")
+        self.head_size = max_bytes // 2
+        self.tail_size = max_bytes - self.head_size
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, data: bytes):
+        self.total += len(data)
+        if len(self.head) < self.head_size:
+            room = self.head_size - len(self.head)
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            if len(self.tail) > self.tail_size:
+                del self.tail[:len(self.tail) - self.tail_size]
+
+    @property
+    def omitted(self) -> int:
+        return self.total - len(self.head) - len(self.tail)
+
+    def tail_text(self) -> str:
+        '''The latest output, for progress acks'''
+        latest = self.tail if self.tail else self.head
+        return bytes(latest).decode("utf-8", errors="replace")
+
+    def text(self) -> str:
+        head = bytes(self.head).decode("utf-8", errors="replace")
+        if not self.tail:
+            return head
+        tail = bytes(self.tail).decode("utf-8", errors="replace")
+        if self.omitted:
+            return head + OMITTED.format(self.omitted) + tail
+        return head + tail
+
+
+def excerpt_text(text: str, max_bytes: int) -> str:
+    '''text cut down to max_bytes of UTF-8 the same way, for messages already in memory'''
+    data = text.encode("utf-8")
+    if len(data) <= max_bytes:
+        return text
+    excerpt = OutputExcerpt(max_bytes)
+    excerpt.write(data)
+    return excerpt.text()
+
+
+class CommandResult:
+    def __init__(self, returncode, stdout: OutputExcerpt, stderr: OutputExcerpt, timed_out: bool):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+
+
+def run_command(command: list, timeout: float, max_output: int, progress_interval: float = None, on_progress=None) -> CommandResult:
+    '''
+        Runs command, killing it after timeout seconds. Every progress_interval seconds while it
+        runs, on_progress(elapsed seconds, stdout excerpt) is called from this thread.
+    '''
+    stdout = OutputExcerpt(max_output)
+    stderr = OutputExcerpt(max_output)
+    start = time.monotonic()
+    deadline = start + timeout
+    next_progress = start + progress_interval if progress_interval and on_progress is not None else None
+
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    timed_out = False
+    finished = False
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(process.stdout, selectors.EVENT_READ, stdout)
+            selector.register(process.stderr, selectors.EVENT_READ, stderr)
+            while selector.get_map():
+                now = time.monotonic()
+                if now >= deadline:
+                    timed_out = True
+                    break
+                if next_progress is not None and now >= next_progress:
+                    on_progress(now - start, stdout)
+                    next_progress += progress_interval
+                    continue
+                wake = deadline if next_progress is None else min(deadline, next_progress)
+                for key, _ in selector.select(wake - now):
+                    data = os.read(key.fd, READ_SIZE)
+                    if data:
+                        key.data.write(data)
+                    else:
+                        selector.unregister(key.fileobj)
+
+        try:
+            if not timed_out:
+                # output closed, the script may still be finishing
+                process.wait(max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            timed_out = True
+        finished = not timed_out
+    finally:
+        # also when on_progress or a read raised, so the script isn't left running with its pipes open
+        if not finished:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+    return CommandResult(None if timed_out else process.returncode, stdout, stderr, timed_out)
@@ -0,0 +1,88 @@
+'''
+    Bounded worker pool for cloud commands
+
+    Keeps command execution out of the SDK's MQTT callback. Jobs share a key (the
+    script name) and at most max_concurrent jobs of one key run at a time, further
+    jobs of that key wait without holding a worker so unrelated keys keep running.
+'''
+import threading
+import queue
+from collections import deque
+
+
+class CommandPool:
+    def __init__(self, workers: int = 2, queue_depth: int = 16):
+        if workers < 1 or queue_depth < 1:
+            raise ValueError("workers and queue_depth must be at least 1")
+        self.queue_depth = queue_depth
+        self.jobs = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        # jobs accepted but not started yet, bounded by queue_depth
+        self.pending = 0
+        self.running: dict = {}
+        self.waiting: dict = {}
+        self.rejected = 0
+        # started on the first submit, devices that never get a command don't hold threads
+        self.workers = workers
+        self.threads = []
+
+    def _start_workers(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name="command-worker-" + str(i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, key, fn, max_concurrent: int = 1) -> bool:
+        '''Queues fn() to run on a worker, returns False without queueing if the pool is full'''
+        with self.lock:
+            if self.pending >= self.queue_depth:
+                self.rejected += 1
+                return False
+            self.pending += 1
+            if not self.threads:
+                self._start_workers()
+        self.jobs.put((key, fn, max_concurrent))
+        return True
+
+    def shutdown(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+
+    def _start(self, job) -> bool:
+        '''Claims a slot for job's key, or parks the job until one is released'''
+        key, _, max_concurrent = job
+        with self.lock:
+            if self.running.get(key, 0) >= max_concurrent:
+                self.waiting.setdefault(key, deque()).append(job)
+                return False
+            self.running[key] = self.running.get(key, 0) + 1
+            self.pending -= 1
+            return True
+
+    def _finish(self, key):
+        '''Releases key's slot, handing it straight to the next waiting job of that key'''
+        with self.lock:
+            waiting = self.waiting.get(key)
+            if waiting:
+                self.pending -= 1
+                return waiting.popleft()
+            self.waiting.pop(key, None)
+            self.running[key] -= 1
+            if self.running[key] == 0:
+                del self.running[key]
+            return None
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            if not self._start(job):
+                continue
+            while job is not None:
+                key, fn, _ = job
+                try:
+                    fn()
+                except Exception as exception:
+                    print("Command", key, "raised", repr(exception))
+                job = self._finish(key)
@@ -0,0 +1,137 @@
+'''
+    Indexed registry of the scripts in the commands folder
+
+    The folder is listed once, after that an inotify watcher updates single entries
+    as scripts are added, replaced, chmod'ed or removed. Each entry caches the script's
+    absolute path and whether it is executable so dispatching a command touches no files.
+'''
+import os
+import time
+import threading
+from model import inotify
+from model.command_handlers import PLUGIN_FILE_NAME
+
+WATCH_MASK = (inotify.IN_CLOSE_WRITE | inotify.IN_CREATE | inotify.IN_ATTRIB | inotify.IN_MOVED_TO
+    | inotify.IN_MOVED_FROM | inotify.IN_DELETE | inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF)
+ADDED_MASK = inotify.IN_CLOSE_WRITE | inotify.IN_CREATE | inotify.IN_ATTRIB | inotify.IN_MOVED_TO
+REMOVED_MASK = inotify.IN_MOVED_FROM | inotify.IN_DELETE
+GONE_MASK = inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF | inotify.IN_IGNORED
+# seconds to wait before reading again after a read error
+READ_RETRY = 1.0
+
+
+class ScriptEntry:
+    def __init__(self, path: str, executable: bool):
+        self.path = path
+        self.executable = executable
+
+
+class CommandRegistry:
+    def __init__(self, folder: str):
+        self.folder = os.path.abspath(folder)
+        self.entries: dict = {}
+        self.watcher = None
+        self.wd = None
+        self.closing = False
+        self.scan()
+
+    def _make_entry(self, name: str):
+        '''Returns a ScriptEntry for name or None if it isn't a runnable file'''
+        if name == PLUGIN_FILE_NAME:
+            return None
+        path = os.path.join(self.folder, name)
+        if not os.path.isfile(path):
+            return None
+        return ScriptEntry(path, os.access(path, os.X_OK))
+
+    def scan(self):
+        entries = {}
+        for name in os.listdir(self.folder):
+            if (entry := self._make_entry(name)) is not None:
+                entries[name] = entry
+        self.entries = entries
+
+    def refresh(self, name: str):
+        '''Re-checks a single script'''
+        entry = self._make_entry(name)
+        if entry is None:
+            self.entries.pop(name, None)
+        else:
+            self.entries[name] = entry
+
+    def get(self, name: str):
+        return self.entries.get(name)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def watch(self) -> bool:
+        '''Starts following changes to the folder, returns False if inotify isn't available'''
+        try:
+            self.watcher = inotify.Inotify()
+            self.wd = self.watcher.add_watch(self.folder, WATCH_MASK)
+        except (OSError, AttributeError) as exception:
+            print("Not watching", self.folder, "for new commands:", exception)
+            self.watcher = None
+            return False
+
+        # catch anything that changed between the listing and the watch
+        self.scan()
+        thread = threading.Thread(target=self._watch_loop, name="command-registry", daemon=True)
+        thread.start()
+        return True
+
+    def _rescan(self):
+        '''Lists the folder again after events were lost'''
+        try:
+            self.scan()
+        except OSError as exception:
+            # a removed folder also raises IN_DELETE_SELF, which ends the watch
+            print("Can't list commands folder", self.folder, exception)
+
+    def _watch_loop(self):
+        while True:
+            try:
+                events = self.watcher.read_events()
+            except OSError as exception:
+                if self.closing:
+                    return
+                print("Reading command folder events failed, listing", self.folder, "again:", exception)
+                time.sleep(READ_RETRY)
+                self._rescan()
+                continue
+            for _, mask, name in events:
+                if mask & inotify.IN_Q_OVERFLOW:
+                    # the kernel's queue was full and events were dropped
+                    print("Command folder events were lost, listing", self.folder, "again")
+                    self._rescan()
+                    continue
+                if mask & GONE_MASK:
+                    if not self.closing:
+                        print("Commands folder", self.folder, "was removed, no longer watching it")
+                        self.entries = {}
+                    self.watcher.close()
+                    return
+                if mask & inotify.IN_ISDIR:
+                    continue
+                if mask & REMOVED_MASK:
+                    self.entries.pop(name, None)
+                elif mask & ADDED_MASK:
+                    self.refresh(name)
+
+    def close(self):
+        '''Stops watching, the watch thread exits on the IN_IGNORED event this causes'''
+        if self.watcher is None or self.closing:
+            return
+        self.closing = True
+        try:
+            self.watcher.rm_watch(self.wd)
+        except OSError:
+            # the folder is already gone, the thread has seen it too
+            pass
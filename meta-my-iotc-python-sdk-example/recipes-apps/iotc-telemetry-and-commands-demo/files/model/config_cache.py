@@ -0,0 +1,156 @@
+'''
+    Compiled config cache
+
+    The parsed and validated config is saved as json next to the config json. On the
+    next start it is loaded with a single read as long as the json is unchanged and none
+    of the folders holding a referenced path has changed, otherwise the json is parsed
+    and validated in full and the cache rewritten.
+
+    The cache holds the device key, so it is only readable by its owner, and it is plain
+    data: loading it never runs code. It is tied to a hash of the parser's source, so a
+    changed parser never reads a config cached by an older one.
+'''
+import os
+import json
+import hashlib
+from enum import Enum
+import model.json_parser
+from model.json_parser import ToSDK, parse_json_for_config, get_referenced_paths
+
+CACHE_SUFFIX = ".cache"
+CACHE_MODE = 0o600
+
+_parser_hash = None
+
+
+def _get_parser_hash() -> str:
+    '''Hash of json_parser.py, which decides the parsed config format'''
+    global _parser_hash
+    if _parser_hash is None:
+        _parser_hash = _hash_file(model.json_parser.__file__)
+    return _parser_hash
+
+
+# ToSDK enum members are written as "@Class.member" keys, a string key starting with @ gets a second one
+_ENUM_KEYS = {"@" + cls.__name__ + "." + member.name: member
+              for cls in vars(ToSDK).values() if isinstance(cls, type) and issubclass(cls, Enum) for member in cls}
+
+
+def _encode_key(key):
+    if isinstance(key, Enum):
+        return "@" + type(key).__name__ + "." + key.name
+    if key.startswith("@"):
+        return "@" + key
+    return key
+
+
+def _encode(value):
+    if isinstance(value, dict):
+        return {_encode_key(key): _encode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode_object(pairs: list) -> dict:
+    return {(key[1:] if key[1:2] == "@" else _ENUM_KEYS[key]) if key[:1] == "@" else key: value for key, value in pairs}
+
+
+def _dir_mtimes(paths: list) -> dict:
+    '''
+        Modification time of the folder holding each path. Creating, removing or
+        renaming anything in a folder changes its mtime, so one stat per folder
+        tells us whether any referenced path could have appeared or gone.
+    '''
+    mtimes = {}
+    for path in paths:
+        folder = os.path.dirname(os.path.abspath(path))
+        if folder not in mtimes:
+            mtimes[folder] = os.stat(folder).st_mtime_ns
+    return mtimes
+
+
+def _dirs_unchanged(mtimes: dict) -> bool:
+    try:
+        for folder, mtime in mtimes.items():
+            if os.stat(folder).st_mtime_ns != mtime:
+                return False
+    except OSError:
+        return False
+    return True
+
+
+def _read_cache(cache_path: str):
+    try:
+        with open(cache_path, "rb") as f:
+            body, _, dirs = f.read().partition(b"\n")
+        cache = json.loads(body, object_pairs_hook=_decode_object)
+        if not isinstance(cache, dict) or cache.get("parser") != _get_parser_hash():
+            return None
+        if not dirs:
+            # written but the folder mtimes never appended
+            return None
+        cache["dirs"] = json.loads(dirs)
+        cache["key"] = tuple(cache["key"])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as exception:
+        print("Ignoring unreadable config cache", cache_path, exception)
+        return None
+    return cache
+
+
+def _write_cache(cache_path: str, cache: dict, referenced_paths: list):
+    '''
+        Writes the cache to a temporary file and renames it over the old one. The rename
+        changes the mtime of its folder, which may hold referenced paths too, so the folder
+        mtimes are taken after it and appended as a second line. Appending doesn't touch
+        the folder. A cache cut short before that line is complete is ignored.
+    '''
+    temp_path = cache_path + ".tmp"
+    try:
+        # owner only, it holds the device key
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, CACHE_MODE)
+        with open(fd, "wb") as f:
+            os.fchmod(fd, CACHE_MODE)
+            f.write(json.dumps(_encode({key: value for key, value in cache.items() if key != "dirs"}), separators=(',', ':')).encode("utf-8"))
+        os.replace(temp_path, cache_path)
+        cache["dirs"] = _dir_mtimes(referenced_paths)
+        with open(cache_path, "ab") as f:
+            f.write(b"\n" + json.dumps(cache["dirs"], separators=(',', ':')).encode("utf-8"))
+    except OSError as exception:
+        # e.g. a read only rootfs, just parse the json every time
+        print("Could not write config cache", cache_path, exception)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _hash_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_config(path_to_json: str) -> dict:
+    '''Same result as parse_json_for_config, from the cache when it is still valid'''
+    cache_path = path_to_json + CACHE_SUFFIX
+    st = os.stat(path_to_json)
+    key = (st.st_mtime_ns, st.st_size)
+
+    cache = _read_cache(cache_path)
+    if cache is not None and _dirs_unchanged(cache["dirs"]):
+        if cache["key"] == key:
+            return cache["config"]
+        # touched or copied but maybe not edited, the hash decides
+        if cache["hash"] == _hash_file(path_to_json):
+            cache["key"] = key
+            _write_cache(cache_path, cache, get_referenced_paths(cache["config"]))
+            return cache["config"]
+
+    config = parse_json_for_config(path_to_json)
+    _write_cache(cache_path, {
+        "parser": _get_parser_hash(),
+        "key": key,
+        "hash": _hash_file(path_to_json),
+        "config": config
+    }, get_referenced_paths(config))
+    return config
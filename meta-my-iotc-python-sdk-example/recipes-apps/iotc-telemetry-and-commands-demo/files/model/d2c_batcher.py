@@ -0,0 +1,65 @@
+'''
+    Groups the uniqueId/time/data entries of a gateway and its children into as few
+    SendData calls as the payload size and entry count limits allow
+'''
+import json
+
+
+class BatchStats:
+    def __init__(self):
+        self.batches_sent = 0
+        self.entries_sent = 0
+        self.bytes_sent = 0
+        # a cycle that needed more than one batch counts one split per extra batch
+        self.size_splits = 0
+        self.count_splits = 0
+        # single entries larger than max_payload_bytes, sent on their own
+        self.oversized_entries = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class D2CBatcher:
+    def __init__(self, max_payload_bytes: int = 131072, max_entries: int = 250):
+        if max_payload_bytes < 1 or max_entries < 1:
+            raise ValueError("max_payload_bytes and max_entries must be at least 1")
+        self.max_payload_bytes = max_payload_bytes
+        self.max_entries = max_entries
+        self.stats = BatchStats()
+
+    @staticmethod
+    def entry_size(entry: dict) -> int:
+        return len(json.dumps(entry, separators=(',', ':')).encode("utf-8"))
+
+    def split(self, entries: list) -> list:
+        '''Returns a list of batches, each a list of entries, recording sizes in self.stats'''
+        batches = []
+        batch = []
+        # payload is a json array: brackets plus a comma between entries
+        batch_bytes = 2
+        for entry in entries:
+            size = self.entry_size(entry)
+            if size + 2 > self.max_payload_bytes:
+                self.stats.oversized_entries += 1
+
+            if batch and len(batch) >= self.max_entries:
+                self.stats.count_splits += 1
+                batches.append((batch, batch_bytes))
+                batch, batch_bytes = [], 2
+            elif batch and batch_bytes + 1 + size > self.max_payload_bytes:
+                self.stats.size_splits += 1
+                batches.append((batch, batch_bytes))
+                batch, batch_bytes = [], 2
+
+            batch_bytes += size + (1 if batch else 0)
+            batch.append(entry)
+
+        if batch:
+            batches.append((batch, batch_bytes))
+
+        for batch, batch_bytes in batches:
+            self.stats.batches_sent += 1
+            self.stats.entries_sent += len(batch)
+            self.stats.bytes_sent += batch_bytes
+        return [batch for batch, _ in batches]
@@ -1,9 +1,17 @@
 import json
-from datetime import datetime
-
-from iotconnect import IoTConnectSDK
+import time
+import threading
 
 from model.enums import Enums as E
+from model.d2c_batcher import D2CBatcher
+from model.change_filter import ChangeFilter
+from model.payload import timestamps
+from model.child_registry import ChildRegistry, ChildCollector
+from model.spool import Spool, SpoolReplayer
+from model.metrics import DeviceMetrics, MetricsExporter, DEFAULT_BUCKETS, device_path
+from model.send_rate import SendRate
+from model.command_output import run_command
+from model.twin_shadow import TwinShadow, ReportedBatcher
 
 
 def print_msg(title, msg):
@@ -21,6 +29,11 @@ class GenericDevice:
         self.name = unique_id
         self.tag = tag
 
+    def set_unique_id(self, unique_id):
+        if self.name == self.unique_id:
+            self.name = unique_id
+        self.unique_id = unique_id
+
     def for_iotconnect_upload(self):
         export_dict = {
             "name": self.name,
@@ -30,22 +43,18 @@ class GenericDevice:
         }
         return export_dict
 
-    def get_d2c_data(self):
-        data_obj = [{
-            "uniqueId": self.unique_id,
-            "time": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000Z"),
-            "data": self.get_state()
-        }]
-        return data_obj
+    def get_d2c_data(self, timestamp: str = None):
+        return self.generate_d2c_data(self.get_state(), timestamp)
     
         
-    def generate_d2c_data(self, data):
-        data_obj = [{
+    def generate_d2c_data(self, data, timestamp: str = None):
+        if timestamp is None:
+            timestamp = timestamps.now()
+        return [{
             "uniqueId": self.unique_id,
-            "time": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "time": timestamp,
             "data": data
         }]
-        return data_obj
 
     def get_state(self) -> dict:
         raise NotImplementedError()
@@ -55,6 +64,26 @@ class ConnectedDevice(GenericDevice):
     needs_exit:bool = False
     in_ota:bool = False
     attribute_metadata: list = None
+    batcher: D2CBatcher = None
+    change_filter: ChangeFilter = None
+    spool: Spool = None
+    spool_replayer: SpoolReplayer = None
+    spool_batcher: D2CBatcher = None
+    metrics: DeviceMetrics = None
+    metrics_exporter: MetricsExporter = None
+    send_rate: SendRate = None
+    # model.ota.OtaDownloader, imported by enable_ota as urllib is slow to import
+    ota_downloader = None
+    # run with the downloaded files as arguments, see ota_install
+    ota_install_command: str = None
+    ota_install_timeout: float = 600
+    twin: TwinShadow = None
+    reported_batcher: ReportedBatcher = None
+    # last connection status from the SDK's INIT_CONNECT, None till it reports one
+    connected: bool = None
+
+    # key of the seconds in a DATA_FRQ command
+    DATA_FREQUENCY_KEY = "df"
 
     def __init__(self, company_id, unique_id, environment, sdk_id, sdk_options=None):
         super().__init__(unique_id)
@@ -63,9 +92,64 @@ class ConnectedDevice(GenericDevice):
         self.sdk_id = sdk_id
         self.SdkClient = None
         self.SdkOptions = sdk_options
-
-    def connect(self):
-        self.SdkClient = IoTConnectSDK(
+        self.sdk_class = None
+        # follows the cloud's DATA_FRQ, see enable_adaptive_rate for backpressure
+        self.send_rate = SendRate()
+
+    def enable_batching(self, max_payload_bytes: int, max_entries: int):
+        '''Send the device's and all children's data in as few SendData calls as the limits allow'''
+        self.batcher = D2CBatcher(max_payload_bytes, max_entries)
+
+    def enable_change_reporting(self, max_silence: float, deadbands: dict = None):
+        '''Only send fields that changed, or haven't been sent for max_silence seconds'''
+        self.change_filter = ChangeFilter(max_silence, deadbands)
+
+    def enable_spool(self, path: str, max_bytes: int, replay_rate: float, replay_batch: int):
+        '''Keep messages that can't be sent in a ring file at path, and replay them once online'''
+        self.spool = Spool(path, max_bytes)
+        self.spool_replayer = SpoolReplayer(self.spool, replay_rate, replay_batch)
+        # replays are merged into as few messages as these limits allow when batching is off
+        self.spool_batcher = D2CBatcher()
+
+    def enable_metrics(self, textfile: str = None, socket_path: str = None, interval: float = 15, buckets=None):
+        '''Time the hot paths and export them in Prometheus format, see model.metrics. The uniqueId is added to both paths'''
+        self.metrics = DeviceMetrics(self.unique_id, buckets if buckets is not None else DEFAULT_BUCKETS)
+        if self.spool is not None:
+            self.metrics.registry.gauge("iotc_spool_fill_ratio", "Used fraction of the spool", self.spool.fill_level)
+            self.metrics.registry.gauge("iotc_spool_dropped_total", "Spooled messages dropped to make room", lambda: self.spool.dropped, "counter")
+        self.metrics_exporter = MetricsExporter(self.metrics.registry, device_path(textfile, self.unique_id), device_path(socket_path, self.unique_id), interval)
+        self.metrics_exporter.start()
+
+    def enable_adaptive_rate(self, latency_threshold: float = None, queue_threshold: int = None, max_backoff: float = 8.0,
+                             recover_step: float = 0.25, check_interval: float = 10.0):
+        '''Report less often while SendData is slower than latency_threshold seconds or more than queue_threshold messages are spooled'''
+        data_frequency = self.send_rate.data_frequency
+        self.send_rate = SendRate(latency_threshold, queue_threshold, max_backoff, recover_step, check_interval)
+        self.send_rate.data_frequency = data_frequency
+        self.send_rate_changed()
+
+    def enable_ota(self, download_dir: str, chunk_size: int = 65536, retries: int = 5, timeout: float = 30,
+                   progress_interval: float = 10, install_command: str = None, install_timeout: float = 600):
+        '''Download firmware commands' files to download_dir, then run install_command on them if set'''
+        from model.ota import OtaDownloader
+        self.ota_downloader = OtaDownloader(download_dir, chunk_size, retries, timeout=timeout, progress_interval=progress_interval)
+        self.ota_install_command = install_command
+        self.ota_install_timeout = install_timeout
+
+    def enable_twin(self, cache_path: str = None, flush_interval: float = 1.0):
+        '''Keep a local shadow of the device twin, saved to cache_path, and batch reported property updates'''
+        self.twin = TwinShadow(cache_path)
+        self.reported_batcher = ReportedBatcher(self.publish_reported, flush_interval, self.twin.set_reported)
+
+    def connect(self, sdk_class=None):
+        '''sdk_class replaces IoTConnectSDK, e.g. with the offline stand-in in tools/fake_sdk.py'''
+        self.sdk_class = sdk_class
+        if sdk_class is None:
+            # Imported here so the model can be loaded without pulling in the SDK and paho-mqtt
+            from iotconnect import IoTConnectSDK as sdk_class
+            E.check_sdk_snapshot()
+
+        self.SdkClient = sdk_class(
             uniqueId=self.unique_id,
             sId=self.sdk_id,
             #cpid=self.company_id,
@@ -75,6 +159,22 @@ class ConnectedDevice(GenericDevice):
         
         self.bind_callbacks()
         self.SdkClient.GetAttributes(self.get_attribute_metadata_from_cloud)
+        if self.twin is not None:
+            # the cached shadow is used until the answer arrives in twin_change_cb
+            self.request_twin()
+
+    def reconnect(self):
+        '''Drops the SDK client and connects again with the current credentials and sdk options'''
+        if self.SdkClient is not None and hasattr(self.SdkClient, "Dispose"):
+            try:
+                self.SdkClient.Dispose()
+            except Exception as exception:
+                print("Dispose of the old SDK client failed:", exception)
+        self.SdkClient = None
+        self.connected = None
+        # the new identity may have a different template
+        self.attribute_metadata = None
+        self.connect(self.sdk_class)
 
     def get_attribute_metadata_from_cloud(self, msg):
         self.attribute_metadata = []
@@ -84,18 +184,88 @@ class ConnectedDevice(GenericDevice):
 
 
     def ota_cb(self,msg):
-        raise NotImplementedError()
+        if self.ota_downloader is None:
+            raise NotImplementedError()
+        # called from the SDK's MQTT thread, downloads take minutes
+        if self.in_ota:
+            self.send_ota_ack(msg, E.Values.OtaStat.FAILED, "Another update is in progress")
+            return
+        self.in_ota = True
+        threading.Thread(target=self.run_ota, args=(msg,), name="ota", daemon=True).start()
+
+    def run_ota(self, msg):
+        '''Downloads every file of a firmware command, acking progress, then installs them'''
+        from model.ota import OtaError
+        try:
+            urls = E.get_value(msg, E.Keys.ota_urls)
+            if not urls:
+                self.send_ota_ack(msg, E.Values.OtaStat.FAILED, "Firmware command has no urls")
+                return
+            paths = []
+            for entry in urls:
+                url = entry[E.Keys.ota_url]
+                file_name = entry.get(E.Keys.ota_file_name) or url.rsplit("/", 1)[-1].split("?", 1)[0]
+                def progress(done, total):
+                    of_total = f" of {total}" if total is not None else ""
+                    self.send_ota_ack(msg, E.Values.OtaStat.DL_IN_PROGRESS, f"{file_name}: {done}{of_total} bytes")
+
+                self.send_ota_ack(msg, E.Values.OtaStat.DL_IN_PROGRESS, f"Downloading {file_name}")
+                try:
+                    path, digest = self.ota_downloader.download(url, file_name, entry.get(E.Keys.ota_hash), progress)
+                except OtaError as exception:
+                    self.send_ota_ack(msg, E.Values.OtaStat.DL_FAILED, str(exception))
+                    return
+                self.send_ota_ack(msg, E.Values.OtaStat.DL_DONE, f"{file_name} {self.ota_downloader.hash_algorithm} {digest}")
+                paths.append(path)
+
+            success, message = self.ota_install(paths)
+            self.send_ota_ack(msg, E.Values.OtaStat.SUCCESS if success else E.Values.OtaStat.FAILED, message)
+        except Exception as exception:
+            self.send_ota_ack(msg, E.Values.OtaStat.FAILED, f"Update failed: {exception!r}")
+        finally:
+            self.in_ota = False
+
+    def ota_install(self, paths: list):
+        '''Overrideable - installs the downloaded files, returns (success, message)'''
+        if self.ota_install_command is None:
+            return True, "Downloaded " + ", ".join(paths)
+        result = run_command([self.ota_install_command] + paths, self.ota_install_timeout, 4096)
+        if result.timed_out:
+            return False, f"Install timed out after {self.ota_install_timeout:g}s and was killed"
+        output = result.stdout if result.returncode == 0 else result.stderr
+        return result.returncode == 0, output.text()
 
     def module_cb(self,msg):
         raise NotImplementedError()
 
     def twin_change_cb(self,msg):
-        raise NotImplementedError()
+        if self.twin is None:
+            raise NotImplementedError()
+        if not self.twin.apply(msg):
+            print("Twin update missed, asking for the whole twin")
+            self.request_twin()
+
+    def request_twin(self):
+        '''Asks the cloud for the whole twin, it arrives in twin_change_cb'''
+        if hasattr(self.SdkClient, "GetAllTwins"):
+            self.SdkClient.GetAllTwins()
+
+    def update_reported(self, name: str, value):
+        '''Queues a reported property, updates within the flush interval go out together'''
+        self.reported_batcher.update(name, value)
+
+    def publish_reported(self, name: str, value):
+        if self.SdkClient is None:
+            raise ConnectionError("no client")
+        self.SdkClient.UpdateTwin(name, value)
 
     def attribute_change_cb(self,msg):
         self.SdkClient.GetAttributes(self.get_attribute_metadata_from_cloud)
 
     def device_change_cb(self,msg):
+        if E.get_value(msg, E.Keys.command_type) == E.Values.Commands.DATA_FRQ:
+            self.data_frequency_cb(msg)
+            return
         raise NotImplementedError()
 
     def rule_change_cb(self,msg):
@@ -105,8 +275,31 @@ class ConnectedDevice(GenericDevice):
         raise NotImplementedError()
 
     def init_cb(self, msg):
-        if E.get_value(msg, E.Keys.command_type) is E.Values.Commands.INIT_CONNECT:
-            print("connection status is " + msg["command"])
+        if E.get_value(msg, E.Keys.command_type) == E.Values.Commands.INIT_CONNECT:
+            print("connection status is", msg["command"])
+            self.connected = self.parse_connection_status(msg["command"])
+        elif E.get_value(msg, E.Keys.command_type) == E.Values.Commands.DATA_FRQ:
+            self.data_frequency_cb(msg)
+
+    @staticmethod
+    def parse_connection_status(status) -> bool:
+        '''INIT_CONNECT's command, True/False or a "connected"/"disconnected" string depending on the SDK version'''
+        if isinstance(status, str):
+            return status.strip().lower() in ("connected", "true", "1")
+        return bool(status)
+
+    def is_online(self) -> bool:
+        '''There is a client and the SDK hasn't reported the connection down'''
+        return self.SdkClient is not None and self.connected is not False
+
+    def data_frequency_cb(self, msg):
+        '''DATA_FRQ, the shortest time in seconds between messages the cloud accepts from this device'''
+        if self.send_rate.set_data_frequency(E.get_value(msg, self.DATA_FREQUENCY_KEY)):
+            self.send_rate_changed()
+
+    def send_rate_changed(self):
+        '''Overrideable - called when self.send_rate.interval() changed, to reschedule sends'''
+        pass
         
     def bind_callbacks(self):
         self.SdkClient.onOTACommand(self.ota_cb)
@@ -118,25 +311,111 @@ class ConnectedDevice(GenericDevice):
         self.SdkClient.onDeviceCommand(self.device_cb)
 
     def send_device_states(self):
+        if self.metrics is not None:
+            build_start = time.perf_counter()
+        # one timestamp for the whole cycle, children report the same time as their gateway
+        timestamp = timestamps.now()
 
-        # Don't send anything till we get our cloud attributes
+        # Don't send anything till we get our cloud attributes, keep it for later if spooling
         if self.attribute_metadata is None:
+            if self.spool is not None:
+                self.spool_states(timestamp)
             return
+        self.replay_spool()
 
-        data_array = [self.get_d2c_data()]
-        if self.children is not None:
-            for child in self.children:
-                data_array.append(child.get_d2c_data())
+        data_array = [self.get_d2c_data(timestamp)]
+        data_array.extend(self.get_children_d2c_data(timestamp))
+
+        if self.change_filter is not None:
+            self.change_filter.start_cycle()
+            data_array = [filtered for data in data_array if (filtered := self.change_filter.filter_entries(data))]
 
+        if self.batcher is not None:
+            # every get_d2c_data() is a list of uniqueId/time/data entries, merge them before splitting
+            entries = [entry for data in data_array for entry in data]
+            data_array = self.batcher.split(entries)
+
+        if self.metrics is not None:
+            self.metrics.payload_build.observe(time.perf_counter() - build_start)
         for data in data_array:
             self.send_d2c(data)
         return data_array
 
+    def get_children_d2c_data(self, timestamp: str) -> list:
+        if self.children is None:
+            return []
+        return [child.get_d2c_data(timestamp) for child in self.children]
+
     def send_d2c(self, data):
-        if self.SdkClient is not None:
+        if self.SdkClient is None:
+            if self.spool is not None:
+                self.spool.append(data)
+            else:
+                print("no client")
+            return
+        if self.spool is not None and not self.is_online():
+            # the SDK doesn't raise while the link is down, it would just lose the message
+            self.spool.append(data)
+            if self.send_rate.check(len(self.spool)):
+                self.send_rate_changed()
+            return
+
+        self.replay_spool()
+        try:
+            self.send_data(data)
+        except Exception as exception:
+            if self.spool is None:
+                raise
+            print("SendData failed, spooling the message:", exception)
+            self.spool.append(data)
+        finally:
+            if self.send_rate.check(len(self.spool) if self.spool is not None else 0):
+                self.send_rate_changed()
+
+    def spool_states(self, timestamp: str):
+        '''Spools this cycle's data, called while there is no cloud metadata to send it with'''
+        self.spool.append(self.get_d2c_data(timestamp))
+        for data in self.get_children_d2c_data(timestamp):
+            self.spool.append(data)
+
+    def replay_spool(self):
+        '''Sends the oldest spooled messages, as many as the replay rate allows, once online'''
+        if self.spool is None or not len(self.spool) or not self.is_online() or self.attribute_metadata is None:
+            return
+        try:
+            self.spool_replayer.replay(self.send_spooled)
+        except Exception as exception:
+            # left in the spool, in order, for the next attempt
+            print("Spool replay failed:", exception)
+
+    def send_spooled(self, records: list):
+        '''Sends replayed (flags, message) records merged into as few messages as the batch limits allow'''
+        entries = [entry for flags, message in records for entry in self.prepare_spooled(flags, message)]
+        batcher = self.batcher if self.batcher is not None else self.spool_batcher
+        for data in batcher.split(entries):
+            self.send_data(data)
+
+    def send_data(self, data):
+        '''SdkClient.SendData, timed when metrics or the adaptive rate are enabled'''
+        if self.metrics is None and not self.send_rate.adaptive:
             self.SdkClient.SendData(data)
-        else:
-            print("no client")
+            return
+        start = time.perf_counter()
+        try:
+            self.SdkClient.SendData(data)
+        except Exception:
+            if self.metrics is not None:
+                self.metrics.send_errors.inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if self.metrics is not None:
+                self.metrics.send_data.observe(elapsed)
+            self.send_rate.observe_latency(elapsed)
+
+    def prepare_spooled(self, flags: int, message: list) -> list:
+        '''Overrideable - turns a spooled message back into one ready for SendData'''
+        return message
 
     def send_ack(self, msg, status: E.Values.AckStat, message):
         # check if ack exists in message
@@ -147,12 +426,48 @@ class ConnectedDevice(GenericDevice):
         id_to_send = E.get_value(msg, E.Keys.id)
         self.SdkClient.sendAckCmd(msg[E.Keys.ack], status, message, id_to_send)
 
+    def send_ota_ack(self, msg, status: E.Values.OtaStat, message):
+        '''Firmware command progress, through the SDK's OTA ack where it has one'''
+        if not hasattr(self.SdkClient, "sendOTAAckCmd"):
+            self.send_ack(msg, status, message)
+            return
+        if E.get_value(msg, E.Keys.ack) is None:
+            print("Ack not requested, returning")
+            return
+        self.SdkClient.sendOTAAckCmd(msg[E.Keys.ack], status, message)
+
 
 class Gateway(ConnectedDevice):
-    children = []
+    children: ChildRegistry = None
+    child_collector: ChildCollector = None
+
+    def __init__(self, company_id, unique_id, environment, sdk_id, sdk_options=None):
+        super().__init__(company_id, unique_id, environment, sdk_id, sdk_options)
+        # per instance, so gateways in one process don't share children
+        self.children = ChildRegistry()
+
+    def add_child(self, child):
+        self.children.add(child)
+
+    def remove_child(self, unique_id):
+        return self.children.remove(unique_id)
+
+    def get_command_target(self, msg):
+        '''The child a cloud command is addressed to, the gateway itself if it isn't for a child'''
+        child = self.children.get(E.get_value(msg, E.Keys.id))
+        return child if child is not None else self
+
+    def enable_parallel_children(self, workers: int, deadline: float):
+        '''Read children's states concurrently, children slower than deadline seconds are left out as stale'''
+        self.child_collector = ChildCollector(workers, deadline)
+
+    def get_children_d2c_data(self, timestamp: str) -> list:
+        if self.child_collector is None:
+            return super().get_children_d2c_data(timestamp)
+        return self.child_collector.collect(self.children, timestamp)
 
     def show_children(self):
-        if self.children.count:
+        if self.children:
             print("children")
             for child in self.children:
                 print(child.unique_id)
@@ -0,0 +1,112 @@
+'''
+    Edge aggregation windows
+
+    Samples are kept in a fixed size ring of doubles per attribute, so memory use
+    doesn't depend on how long the window is or how long the device runs. At report
+    time the window is summarised with C level passes over the buffer (min, max, sum)
+    instead of a python loop per sample.
+
+    Each statistic is sent as its own numeric attribute, <name>_<stat> (e.g. level_min),
+    as the cloud template's numeric attributes don't accept an object. Reporting starts a
+    new window, so consecutive reports never count a sample twice.
+'''
+import math
+from array import array
+
+
+class EdgeStats:
+    '''Statistics available per window, in IoTConnect edge order'''
+    min = "min"
+    max = "max"
+    sum = "sum"
+    avg = "avg"
+    count = "count"
+    lv = "lv"
+
+    ALL = [min, max, sum, avg, count, lv]
+
+
+def stat_attribute_name(name: str, stat: str) -> str:
+    '''Template attribute a statistic of attribute name is sent as'''
+    return name + "_" + stat
+
+
+class RingBuffer:
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.buffer = array('d', bytes(8 * capacity))
+        self.view = memoryview(self.buffer)
+        self.count = 0
+        self.next_index = 0
+
+    def append(self, value: float):
+        self.buffer[self.next_index] = value
+        self.next_index = (self.next_index + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def values(self) -> memoryview:
+        '''The stored samples, unordered'''
+        if self.count == self.capacity:
+            return self.view
+        return self.view[:self.count]
+
+    def last(self):
+        if self.count == 0:
+            return None
+        return self.buffer[self.next_index - 1]
+
+    def clear(self):
+        self.count = 0
+        self.next_index = 0
+
+
+class WindowAggregator:
+    def __init__(self, window: float, sample_interval: float, stats: list = None):
+        self.stats = stats if stats is not None else [EdgeStats.min, EdgeStats.max, EdgeStats.avg, EdgeStats.count]
+        for stat in self.stats:
+            if stat not in EdgeStats.ALL:
+                raise ValueError("Unknown edge statistic: " + str(stat))
+        # enough slots for every sample in the window
+        self.samples = RingBuffer(max(1, math.ceil(window / sample_interval)))
+
+    def add(self, value):
+        # Unreadable samples are left out of the window
+        if value is None or isinstance(value, bool) or not isinstance(value, (int, float)):
+            return
+        self.samples.append(value)
+
+    def attribute_names(self, name: str) -> list:
+        return [stat_attribute_name(name, stat) for stat in self.stats]
+
+    def take_summary(self):
+        '''summary() of the samples since the last call, then starts a new window'''
+        summary = self.summary()
+        self.samples.clear()
+        return summary
+
+    def summary(self):
+        '''Statistics over the current window, None if it holds no samples'''
+        values = self.samples.values()
+        count = len(values)
+        if count == 0:
+            return None
+
+        summary = {}
+        total = None
+        for stat in self.stats:
+            if stat == EdgeStats.min:
+                summary[stat] = min(values)
+            elif stat == EdgeStats.max:
+                summary[stat] = max(values)
+            elif stat in (EdgeStats.sum, EdgeStats.avg):
+                if total is None:
+                    total = math.fsum(values)
+                summary[stat] = total if stat == EdgeStats.sum else total / count
+            elif stat == EdgeStats.count:
+                summary[stat] = count
+            elif stat == EdgeStats.lv:
+                summary[stat] = self.samples.last()
+        return summary
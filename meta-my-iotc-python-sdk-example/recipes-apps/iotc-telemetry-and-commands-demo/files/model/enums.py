@@ -1,9 +1,74 @@
 '''
     Converts SDK's dictionary types for readability
+
+    The tables are a snapshot of the SDK's so that the model can be imported, e.g. to
+    validate a config, without loading the SDK and paho-mqtt. Enums.check_sdk_snapshot()
+    compares them with the installed SDK once it is imported on connect().
 '''
 from typing import Union # to use Union[str, None] type hint
-from iotconnect.IoTConnectSDK import MSGTYPE,ErorCode,CMDTYPE,OPTION
-from iotconnect.common.data_evaluation import DATATYPE
+
+# Snapshot of iotconnect.IoTConnectSDK (iotc-python-sdk 2.1)
+MSGTYPE = {
+    "RPT": 0,
+    "FLT": 1,
+    "RPTEDGE": 2,
+    "RMEdge": 3,
+    "LOG": 4,
+    "ACK": 5,
+    "OTA": 6,
+    "FIRMWARE": 11
+}
+ErorCode = {
+    "OK": 0,
+    "DEV_NOT_REG": 1,
+    "AUTO_REG": 2,
+    "DEV_NOT_FOUND": 3,
+    "DEV_INACTIVE": 4,
+    "OBJ_MOVED": 5,
+    "CPID_NOT_FOUND": 6
+}
+CMDTYPE = {
+    "DCOMM": 0,
+    "FIRMWARE": 1,
+    "MODULE": 2,
+    "U_ATTRIBUTE": 101,
+    "U_SETTING": 102,
+    "U_RULE": 103,
+    "U_DEVICE": 104,
+    "DATA_FRQ": 105,
+    "U_barred": 106,
+    "D_Disabled": 107,
+    "D_Released": 108,
+    "STOP": 109,
+    "Start_Hr_beat": 110,
+    "Stop_Hr_beat": 111,
+    "is_connect": 116,
+    "SYNC": "sync",
+    "RESETPWD": "resetpwd",
+    "UCART": "updatecrt"
+}
+OPTION = {
+    "attribute": "att",
+    "setting": "set",
+    "protocol": "p",
+    "device": "d",
+    "sdkConfig": "sc",
+    "rule": "r"
+}
+# Snapshot of iotconnect.common.data_evaluation
+DATATYPE = {
+    "INT": 1,
+    "LONG": 2,
+    "FLOAT": 3,
+    "STRING": 4,
+    "Time": 5,
+    "Date": 6,
+    "DateTime": 7,
+    "BIT": 8,
+    "Boolean": 9,
+    "LatLong": 10,
+    "OBJECT": 11
+}
 
 class Enums:
     class Keys:
@@ -13,6 +78,12 @@ class Enums:
         device_command = 'cmd'
         data = 'd'
         data_type = 'dt'
+        # firmware command, a list of {url, fileName} objects
+        ota_urls = 'urls'
+        ota_url = 'url'
+        ota_file_name = 'fileName'
+        # not sent by the platform, an expected digest a custom sender may add to a url object
+        ota_hash = 'hash'
 
     class Values:
         # 2.1 enums
@@ -86,6 +157,8 @@ class Enums:
     class ReadTypes:
         ascii = "ascii"
         binary = "binary"
+        record = "record"
+        system = "system"
 
     class SendDataTypes:
         INT = DATATYPE["INT"]
@@ -101,6 +174,27 @@ class Enums:
         OBJECT = DATATYPE["OBJECT"]
 
 
+    @classmethod
+    def check_sdk_snapshot(cls) -> bool:
+        '''Warns about any value that differs between the snapshot above and the installed SDK'''
+        from iotconnect.IoTConnectSDK import MSGTYPE as SDK_MSGTYPE, ErorCode as SDK_ErorCode, CMDTYPE as SDK_CMDTYPE, OPTION as SDK_OPTION
+        from iotconnect.common.data_evaluation import DATATYPE as SDK_DATATYPE
+
+        matches = True
+        tables = [
+            ("MSGTYPE", MSGTYPE, SDK_MSGTYPE),
+            ("ErorCode", ErorCode, SDK_ErorCode),
+            ("CMDTYPE", CMDTYPE, SDK_CMDTYPE),
+            ("OPTION", OPTION, SDK_OPTION),
+            ("DATATYPE", DATATYPE, SDK_DATATYPE),
+        ]
+        for table_name, snapshot, sdk_table in tables:
+            for key, value in snapshot.items():
+                if sdk_table.get(key) != value:
+                    print("WARNING: model/enums.py", table_name, key, "is", value, "but the SDK uses", sdk_table.get(key))
+                    matches = False
+        return matches
+
     @classmethod
     def get_value(cls,msg, key) -> Union[str, None]:
         if (key in msg):
@@ -0,0 +1,252 @@
+'''
+    Event driven attribute updates
+
+    Attributes with "events" are reported as soon as their source changes instead of
+    waiting for the next poll. sysfs attributes are watched with poll() for the
+    POLLPRI/POLLERR a driver raises through sysfs_notify(), other files with inotify
+    IN_CLOSE_WRITE/IN_MOVED_TO on their folder. Events of one attribute are coalesced:
+    it fires debounce seconds after the first event, and at most once per min_interval.
+    Attributes keep being polled on their schedule, which covers sysfs attributes whose
+    driver never notifies and files on filesystems without inotify.
+
+    One watcher can serve several devices, e.g. the whole of iotc-fleet.py: each watched
+    key has its own callback, so keys only need to be unique across them.
+'''
+import os
+import time
+import select
+import threading
+from model import inotify
+
+SYSFS_PREFIX = "/sys/"
+SYSFS_EVENTS = select.POLLPRI | select.POLLERR
+FILE_EVENTS = inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO
+READ_SIZE = 4096
+
+
+class EventWatcher:
+    def __init__(self, on_event=None, clock=time.monotonic):
+        '''on_event(keys) is called from the watcher thread with the keys that fired, unless add() was given another'''
+        self.on_event = on_event
+        self.clock = clock
+        self.lock = threading.Lock()
+        # key -> callback it fires
+        self.callbacks: dict = {}
+        self.poller = select.poll()
+        # sysfs: fd -> attribute name, attribute name -> fd
+        self.sysfs_fds: dict = {}
+        self.sysfs_names: dict = {}
+        # files: folder -> wd, wd -> {file name: set of attribute names}, attribute name -> (folder, file name)
+        self.inotify = None
+        self.folder_wds: dict = {}
+        self.wd_files: dict = {}
+        self.file_names: dict = {}
+        # attribute name -> (debounce, min_interval)
+        self.settings: dict = {}
+        # attribute name -> monotonic time it fires
+        self.pending: dict = {}
+        self.last_fired: dict = {}
+        # written to wake the thread when registrations change
+        self.wake_r, self.wake_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        self.poller.register(self.wake_r, select.POLLIN)
+        self.thread = None
+        self.running = False
+        self.closed = False
+        self.events = 0
+        self.fired = 0
+
+    def add(self, name, path: str, debounce: float, min_interval: float, on_event=None) -> bool:
+        '''Watches path for key name, returns False if it can't raise events and is only polled'''
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("EventWatcher was stopped")
+            self.settings[name] = (debounce, min_interval)
+            self.callbacks[name] = on_event if on_event is not None else self.on_event
+            try:
+                if path.startswith(SYSFS_PREFIX):
+                    self._add_sysfs(name, path)
+                else:
+                    self._add_file(name, path)
+            except OSError as exception:
+                print("Attribute", name, "can't be watched for events, it is only polled:", exception)
+                self.settings.pop(name, None)
+                self.callbacks.pop(name, None)
+                return False
+        self._wake()
+        return True
+
+    def _add_sysfs(self, name, path):
+        fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        # a sysfs attribute has to be read once before poll() reports changes to it
+        os.pread(fd, READ_SIZE, 0)
+        self.sysfs_fds[fd] = name
+        self.sysfs_names[name] = fd
+        self.poller.register(fd, SYSFS_EVENTS)
+
+    def _add_file(self, name, path):
+        if self.inotify is None:
+            self.inotify = inotify.Inotify(inotify.IN_NONBLOCK | inotify.IN_CLOEXEC)
+            self.poller.register(self.inotify.fileno(), select.POLLIN)
+        # the folder rather than the file, so replacing the file by rename is seen too
+        folder, file_name = os.path.split(os.path.abspath(path))
+        wd = self.folder_wds.get(folder)
+        if wd is None:
+            wd = self.inotify.add_watch(folder, FILE_EVENTS)
+            self.folder_wds[folder] = wd
+            self.wd_files[wd] = {}
+        self.wd_files[wd].setdefault(file_name, set()).add(name)
+        self.file_names[name] = (folder, file_name)
+
+    def remove(self, name):
+        with self.lock:
+            if self.closed:
+                return
+            if name in self.sysfs_names:
+                self._drop_sysfs(name)
+            self.settings.pop(name, None)
+            self.callbacks.pop(name, None)
+            self.pending.pop(name, None)
+            self.last_fired.pop(name, None)
+            if (location := self.file_names.pop(name, None)) is not None:
+                folder, file_name = location
+                wd = self.folder_wds[folder]
+                names = self.wd_files[wd][file_name]
+                names.discard(name)
+                if not names:
+                    del self.wd_files[wd][file_name]
+                if not self.wd_files[wd]:
+                    del self.wd_files[wd]
+                    del self.folder_wds[folder]
+                    try:
+                        self.inotify.rm_watch(wd)
+                    except OSError:
+                        # folder already gone
+                        pass
+        self._wake()
+
+    def _drop_sysfs(self, name):
+        '''Stops watching the sysfs attribute of key name, called with the lock held'''
+        self.settings.pop(name, None)
+        self.callbacks.pop(name, None)
+        self.pending.pop(name, None)
+        self.last_fired.pop(name, None)
+        fd = self.sysfs_names.pop(name)
+        del self.sysfs_fds[fd]
+        self.poller.unregister(fd)
+        os.close(fd)
+
+    def __len__(self):
+        return len(self.settings)
+
+    def _wake(self):
+        try:
+            os.write(self.wake_w, b"x")
+        except BlockingIOError:
+            # already awake
+            pass
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self._loop, name="attribute-events", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        '''Ends the thread and closes every descriptor, the watcher can't be used again'''
+        with self.lock:
+            if self.closed:
+                return
+            self.running = False
+        if self.thread is not None:
+            self._wake()
+            if self.thread is not threading.current_thread():
+                self.thread.join()
+        else:
+            self._close()
+
+    def _close(self):
+        with self.lock:
+            self.closed = True
+            for fd in self.sysfs_fds:
+                os.close(fd)
+            self.sysfs_fds.clear()
+            self.sysfs_names.clear()
+            if self.inotify is not None:
+                self.inotify.close()
+                self.inotify = None
+            self.folder_wds.clear()
+            self.wd_files.clear()
+            self.file_names.clear()
+            self.settings.clear()
+            self.callbacks.clear()
+            self.pending.clear()
+            os.close(self.wake_r)
+            os.close(self.wake_w)
+
+    def _changed(self, name, now):
+        '''Schedules name to fire, events before it fires are merged into the same update'''
+        if name in self.pending or name not in self.settings:
+            return
+        self.events += 1
+        debounce, min_interval = self.settings[name]
+        due = now + debounce
+        if (last := self.last_fired.get(name)) is not None:
+            due = max(due, last + min_interval)
+        self.pending[name] = due
+
+    def _loop(self):
+        try:
+            self._watch()
+        finally:
+            self._close()
+
+    def _watch(self):
+        while self.running:
+            with self.lock:
+                timeout = None
+                if self.pending:
+                    timeout = max(0, (min(self.pending.values()) - self.clock()) * 1000)
+            ready = self.poller.poll(timeout)
+
+            now = self.clock()
+            fired = []
+            with self.lock:
+                for fd, _ in ready:
+                    if fd == self.wake_r:
+                        try:
+                            os.read(self.wake_r, READ_SIZE)
+                        except BlockingIOError:
+                            pass
+                    elif self.inotify is not None and fd == self.inotify.fileno():
+                        for wd, _, file_name in self.inotify.read_events():
+                            for name in self.wd_files.get(wd, {}).get(file_name, ()):
+                                self._changed(name, now)
+                    elif (name := self.sysfs_fds.get(fd)) is not None:
+                        try:
+                            # re-arms the notification
+                            os.pread(fd, READ_SIZE, 0)
+                        except OSError as exception:
+                            # e.g. ENODEV once the device is unbound, the other attributes keep their events
+                            print("Attribute", name, "can't be watched for events any more, it is only polled:", exception)
+                            self._drop_sysfs(name)
+                            continue
+                        self._changed(name, now)
+
+                for name, due in list(self.pending.items()):
+                    if due <= now:
+                        del self.pending[name]
+                        self.last_fired[name] = now
+                        fired.append(name)
+
+                # grouped per callback, i.e. per device
+                by_callback = {}
+                for name in fired:
+                    by_callback.setdefault(self.callbacks[name], []).append(name)
+
+            if fired:
+                self.fired += len(fired)
+                for callback, names in by_callback.items():
+                    try:
+                        callback(names)
+                    except Exception as exception:
+                        print("Attribute event handler raised", repr(exception))
@@ -0,0 +1,144 @@
+'''
+    Attribute file readers
+
+    OpenReader opens, reads and closes the file on every read (the original behaviour).
+    PersistentReader keeps descriptors open in an LRU bounded cache and re-reads them
+    with pread into reused buffers, reopening when a file has been replaced or removed.
+'''
+import os
+import errno
+from collections import OrderedDict
+
+# Files under these mounts are regenerated by the kernel on every read from
+# offset 0 and are never replaced, so the replacement check can be skipped
+PSEUDO_FS_PREFIXES = ("/sys/", "/proc/")
+
+# Errors that mean the cached descriptor no longer points at the file we want
+REOPEN_ERRNOS = (errno.ENOENT, errno.ESTALE, errno.ENODEV, errno.EBADF)
+
+DEFAULT_BUFFER_SIZE = 4096
+
+
+class ReaderModes:
+    open = "open"
+    persistent = "persistent"
+
+
+class OpenReader:
+    '''Opens the file on every read'''
+
+    def read(self, path, binary: bool = False):
+        if binary:
+            with open(path, "rb") as f:
+                return f.read()
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def forget(self, path):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Handle:
+    '''An open descriptor and the buffer it is read into'''
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        self.check_replaced = not path.startswith(PSEUDO_FS_PREFIXES)
+        self.buffer = bytearray(DEFAULT_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+
+    def is_replaced(self) -> bool:
+        # A file replaced by rename() or deleted keeps our inode alive with no links
+        return self.check_replaced and os.fstat(self.fd).st_nlink == 0
+
+    def read(self) -> bytes:
+        while True:
+            n = os.preadv(self.fd, [self.view], 0)
+            if n < len(self.buffer):
+                return bytes(self.view[:n])
+            # Buffer filled up, the file may be longer - grow and read again
+            self.view.release()
+            self.buffer = bytearray(len(self.buffer) * 2)
+            self.view = memoryview(self.buffer)
+
+    def close(self):
+        self.view.release()
+        os.close(self.fd)
+
+
+class PersistentReader:
+    '''Keeps up to max_open_files descriptors open, evicting the least recently used'''
+
+    def __init__(self, max_open_files: int = 64):
+        if max_open_files < 1:
+            raise ValueError("max_open_files must be at least 1")
+        self.max_open_files = max_open_files
+        self.handles: OrderedDict = OrderedDict()
+        self.opens = 0
+        self.evictions = 0
+        self.reopens = 0
+
+    def _get_handle(self, path) -> _Handle:
+        handle = self.handles.get(path)
+        if handle is not None:
+            self.handles.move_to_end(path)
+            return handle
+
+        while len(self.handles) >= self.max_open_files:
+            _, evicted = self.handles.popitem(last=False)
+            evicted.close()
+            self.evictions += 1
+
+        handle = _Handle(path)
+        self.opens += 1
+        self.handles[path] = handle
+        return handle
+
+    def _drop(self, path):
+        handle = self.handles.pop(path, None)
+        if handle is not None:
+            handle.close()
+
+    def _read_bytes(self, path) -> bytes:
+        handle = self._get_handle(path)
+        try:
+            if handle.is_replaced():
+                raise OSError(errno.ESTALE, "file replaced", path)
+            return handle.read()
+        except OSError as exception:
+            if exception.errno not in REOPEN_ERRNOS:
+                raise
+        # Stale descriptor, reopen once. A missing file raises FileNotFoundError here
+        self._drop(path)
+        self.reopens += 1
+        return self._get_handle(path).read()
+
+    def read(self, path, binary: bool = False):
+        try:
+            data = self._read_bytes(path)
+        except OSError:
+            self._drop(path)
+            raise
+        if binary:
+            return data
+        return data.decode("utf-8")
+
+    def forget(self, path):
+        '''Closes the descriptor of a path no attribute reads any more'''
+        self._drop(path)
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+
+
+def make_reader(mode: str = ReaderModes.open, max_open_files: int = 64):
+    if mode == ReaderModes.open:
+        return OpenReader()
+    if mode == ReaderModes.persistent:
+        return PersistentReader(max_open_files)
+    raise ValueError("Unknown attribute reader mode: " + str(mode))
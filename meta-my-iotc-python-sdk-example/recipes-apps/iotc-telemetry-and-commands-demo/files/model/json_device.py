@@ -2,11 +2,27 @@
 import os
 from typing import Union # to use Union[Enum, None] type hint
 from enum import Enum
-import subprocess
 import struct
+import time
+import base64
+import threading
 from model.device_model import ConnectedDevice
-from model.json_parser import parse_json_for_config, ToSDK
+from model.payload import timestamps
+from model.json_parser import ToSDK
+from model.config_cache import load_config
 from model.enums import Enums as E
+from model.file_reader import OpenReader, make_reader
+from model.read_plan import ReadPlan
+from model.scheduler import IntervalScheduler
+from model.edge_aggregator import WindowAggregator, EdgeStats, stat_attribute_name
+from model.record_source import RecordSource
+from model.system_sources import SystemAttr, SystemReader
+from model.command_pool import CommandPool
+from model.command_handlers import HandlerRegistry, PLUGIN_FILE_NAME, load_plugin, make_handler
+from model.command_registry import CommandRegistry
+from model.spool import SpoolFlags
+from model.event_watcher import EventWatcher
+from model.command_output import run_command, excerpt_text
 
 
 class DynAttr:
@@ -14,22 +30,28 @@ class DynAttr:
     name = None
     path = None
     read_type = None
+    reader = None
+    sample_interval = None
+    report_interval = None
 
-    def __init__(self, name, path,read_type):
+    def __init__(self, name, path,read_type, reader=None, sample_interval=None, report_interval=None):
         self.name = name
         self.path = path
         self.read_type = read_type
+        # reader is shared between all attributes of a device, see model.file_reader
+        self.reader = reader if reader is not None else OpenReader()
+        # seconds, used by JsonDevice.build_schedule
+        self.sample_interval = sample_interval
+        self.report_interval = report_interval
 
     def update_value(self):
         val = None
         try:
             if self.read_type == E.ReadTypes.ascii:
-                with open(self.path, "r", encoding="utf-8") as f:
-                    val = f.read()
+                val = self.reader.read(self.path)
 
             if self.read_type == E.ReadTypes.binary:
-                with open(self.path, "rb") as f:
-                    val = f.read()
+                val = self.reader.read(self.path, binary=True)
 
         except FileNotFoundError:
             print("File not found at", self.path)
@@ -40,67 +62,113 @@ class DynAttr:
         val = self.convert(val,to_type)
         return val
     
+    def get_converter(self, to_type):
+        '''Returns the conversion function for this attribute's read type and to_type, None if unsupported'''
+        return CONVERTERS.get((self.read_type, to_type))
+
+    def add_to_plan(self, plan: ReadPlan, converter):
+        plan.add(self.name, self.update_value, converter)
+
     def convert(self,val,to_type):
-        if self.read_type == E.ReadTypes.binary:
-            if to_type in [E.SendDataTypes.INT, E.SendDataTypes.LONG]:
-                return int.from_bytes(val, 'big')
-            
-            elif to_type in [E.SendDataTypes.FLOAT]:
-                return (struct.unpack('f', val)[0])
-            
-            elif to_type in [E.SendDataTypes.STRING]:
-                return val.decode("utf-8")
-            
-            elif to_type in [E.SendDataTypes.Boolean]:
-                return struct.unpack('?', val)[0]
-            
-            elif to_type in [E.SendDataTypes.BIT]:
-                if struct.unpack('?', val)[0]:
-                    return 1
-                return 0
-
-        if self.read_type == E.ReadTypes.ascii:
-            try:
-                if to_type in [E.SendDataTypes.INT, E.SendDataTypes.LONG]:
-                    return int(float(val))
-                
-                elif to_type in [E.SendDataTypes.FLOAT]:
-                    return float(val)
-                
-                elif to_type in [E.SendDataTypes.STRING]:
-                    return str(val)
-                
-                elif to_type in [E.SendDataTypes.BIT]:
-                    if self.convert(val, E.SendDataTypes.INT) != 0:
-                        return 1
-                    return 0
-                
-                elif to_type in [E.SendDataTypes.Boolean]:
-                    if type(val) == bool:
-                        return val
-                    
-                    elif type(val) == int:
-                        return val != 0
-                    
-                    elif type(val) == str:
-                        if val in ["False", "false", "0", ""]:
-                            return False
-                        return True
-                    
-            except Exception as exception:
-                print(exception)
+        converter = self.get_converter(to_type)
+        if converter is None:
+            return None
+        return converter(val)
+
+
+def _ascii_to_int(val):
+    return int(float(val))
+
+def _ascii_to_bit(val):
+    if _ascii_to_int(val) != 0:
+        return 1
+    return 0
+
+def _ascii_to_bool(val):
+    if type(val) == bool:
+        return val
+    
+    elif type(val) == int:
+        return val != 0
+    
+    elif type(val) == str:
+        if val in ["False", "false", "0", ""]:
+            return False
+        return True
+    return None
+
+def _ascii_safe(converter):
+    '''Ascii values come from free-form files, print conversion errors and send None instead'''
+    def convert(val):
+        try:
+            return converter(val)
+        except Exception as exception:
+            print(exception)
         return None
+    return convert
+
+def _binary_to_int(val):
+    return int.from_bytes(val, 'big')
+
+def _binary_to_float(val):
+    return struct.unpack('f', val)[0]
+
+def _binary_to_string(val):
+    return val.decode("utf-8")
+
+def _binary_to_bool(val):
+    return struct.unpack('?', val)[0]
+
+def _binary_to_bit(val):
+    if struct.unpack('?', val)[0]:
+        return 1
+    return 0
+
+
+# (read type, cloud data type) -> converter, looked up once per attribute when the read plan is compiled
+CONVERTERS: dict = {
+    (E.ReadTypes.binary, E.SendDataTypes.INT): _binary_to_int,
+    (E.ReadTypes.binary, E.SendDataTypes.LONG): _binary_to_int,
+    (E.ReadTypes.binary, E.SendDataTypes.FLOAT): _binary_to_float,
+    (E.ReadTypes.binary, E.SendDataTypes.STRING): _binary_to_string,
+    (E.ReadTypes.binary, E.SendDataTypes.Boolean): _binary_to_bool,
+    (E.ReadTypes.binary, E.SendDataTypes.BIT): _binary_to_bit,
+
+    (E.ReadTypes.ascii, E.SendDataTypes.INT): _ascii_safe(_ascii_to_int),
+    (E.ReadTypes.ascii, E.SendDataTypes.LONG): _ascii_safe(_ascii_to_int),
+    (E.ReadTypes.ascii, E.SendDataTypes.FLOAT): _ascii_safe(float),
+    (E.ReadTypes.ascii, E.SendDataTypes.STRING): _ascii_safe(str),
+    (E.ReadTypes.ascii, E.SendDataTypes.BIT): _ascii_safe(_ascii_to_bit),
+    (E.ReadTypes.ascii, E.SendDataTypes.Boolean): _ascii_safe(_ascii_to_bool),
+}
 
 
 class JsonDevice(ConnectedDevice):
-    attributes: DynAttr = []
+    attributes: list = None
     # attributes is a list of attributes brought in from json
     # the DynAttr class holds the metadata only, E.g. where the value is saved as a file - the attribute itself is set on the class
     # in the override of the super get_state()
     
-    parsed_json: dict = {}
+    parsed_json: dict = None
+    read_plan: ReadPlan = None
+    scheduler: IntervalScheduler = None
+    # latest converted value of each attribute, filled at its sample_interval
+    sampled_values: dict = None
+    # attribute name -> WindowAggregator for attributes reported as edge aggregates
+    aggregators: dict = None
     SCRIPTS_PATH:str = ""
-    scripts: list = []
+    scripts: CommandRegistry = None
+    system_reader: SystemReader = None
+    # watches the files of attributes with "events", None till the first one unless shared
+    event_watcher: EventWatcher = None
+    # made by this device, so stopped once none of its attributes are watched
+    owns_event_watcher: bool = True
+
+    NUMERIC_TYPES = [E.SendDataTypes.INT, E.SendDataTypes.LONG, E.SendDataTypes.FLOAT]
+
+    class ScheduleKinds:
+        SAMPLE = 0
+        REPORT = 1
 
     class DeviceCommands(Enum):
         EXEC = "exec"
@@ -112,13 +180,26 @@ class JsonDevice(ConnectedDevice):
                     return cls(command)
             return None
 
-    def __init__(self, conf_file):
-        parsed_json: dict = parse_json_for_config(conf_file)
+    def __init__(self, conf_file, event_watcher: EventWatcher = None):
+        '''event_watcher is shared by several devices, e.g. a fleet, instead of each starting its own'''
+        self.conf_file = conf_file
+        self.event_watcher = event_watcher
+        self.owns_event_watcher = event_watcher is None
+        # attribute names this device has on the event watcher
+        self.watched_names = set()
+        parsed_json: dict = load_config(conf_file)
+
+        reader_conf = parsed_json[ToSDK.Credentials.attribute_reader]
+        self.reader = make_reader(reader_conf[ToSDK.AttributeReader.mode], reader_conf[ToSDK.AttributeReader.max_open_files])
 
-        # Construct DynAttrs from json 
+        # Construct DynAttrs from json, per instance so several devices can share a process
+        # json attribute name -> (its parsed config, the DynAttrs or RecordFields made from it), see reload()
+        self.attribute_sources = {}
+        self.aggregators = {}
         for attr in parsed_json[ToSDK.Credentials.attributes]:
-            m_att = DynAttr(attr[ToSDK.Attributes.name],attr[ToSDK.Attributes.private_data],attr[ToSDK.Attributes.private_data_type])
-            self.attributes.append(m_att)
+            self.attribute_sources[attr[ToSDK.Attributes.name]] = (attr, self.make_attributes(attr))
+            self.make_aggregator(attr)
+        self.attributes = [attribute for _, made in self.attribute_sources.values() for attribute in made]
 
         super().__init__(
             parsed_json[ToSDK.Credentials.company_id],
@@ -129,10 +210,349 @@ class JsonDevice(ConnectedDevice):
         )
         # make accessible to any inheriting classes
         self.parsed_json = parsed_json
+        # set from a signal handler to run reload() between cycles, see request_reload
+        self.reload_requested = False
+        self.wake = threading.Event()
+        # attributes whose file changed since the last cycle, see push_events
+        self.event_names = set()
+        self.event_lock = threading.Lock()
+        for attr, made in self.attribute_sources.values():
+            self.watch_attributes(attr, made)
+
+        self.configure_change_reporting(parsed_json)
+
+        if (batch_conf := parsed_json[ToSDK.Credentials.batch_send]) is not None:
+            self.enable_batching(batch_conf[ToSDK.BatchSend.max_payload_bytes], batch_conf[ToSDK.BatchSend.max_entries])
+
+        if (spool_conf := parsed_json[ToSDK.Credentials.spool]) is not None:
+            self.enable_spool(spool_conf[ToSDK.Spool.path], spool_conf[ToSDK.Spool.max_bytes], spool_conf[ToSDK.Spool.replay_rate], spool_conf[ToSDK.Spool.replay_batch])
 
         self.SCRIPTS_PATH = self.parsed_json[ToSDK.Credentials.commands_list_path]
         self.get_all_scripts()
 
+        self.commands_conf = parsed_json[ToSDK.Credentials.commands]
+        self.command_pool = CommandPool(self.commands_conf[ToSDK.Commands.workers], self.commands_conf[ToSDK.Commands.queue_depth])
+        self.load_handlers()
+
+        self.send_rate_pending = False
+        self.configure_send_rate(parsed_json[ToSDK.Credentials.send_rate])
+
+        if (twin_conf := parsed_json[ToSDK.Credentials.twin]) is not None:
+            self.enable_twin(twin_conf[ToSDK.Twin.cache], twin_conf[ToSDK.Twin.flush_interval])
+
+        if (ota_conf := parsed_json[ToSDK.Credentials.ota]) is not None:
+            self.enable_ota(ota_conf[ToSDK.Ota.download_dir], ota_conf[ToSDK.Ota.chunk_size], ota_conf[ToSDK.Ota.retries], ota_conf[ToSDK.Ota.timeout],
+                ota_conf[ToSDK.Ota.progress_interval], ota_conf[ToSDK.Ota.install_command], ota_conf[ToSDK.Ota.install_timeout])
+
+        if (metrics_conf := parsed_json[ToSDK.Credentials.metrics]) is not None:
+            self.enable_metrics(metrics_conf[ToSDK.Metrics.textfile], metrics_conf[ToSDK.Metrics.socket], metrics_conf[ToSDK.Metrics.interval], metrics_conf[ToSDK.Metrics.buckets])
+            self.metrics.registry.gauge("iotc_command_queue_pending", "Commands accepted but not started", lambda: self.command_pool.pending)
+            self.metrics.registry.gauge("iotc_command_rejected_total", "Commands rejected because the queue was full", lambda: self.command_pool.rejected, "counter")
+            self.metrics.registry.gauge("iotc_report_interval_factor", "Report intervals are multiplied by this while backing off", lambda: self.send_rate.factor)
+
+    def make_attributes(self, attr: dict, reader=None) -> list:
+        '''The DynAttr, or a RecordField per field of a record, for one parsed json attribute, reading through reader or self.reader'''
+        if reader is None:
+            reader = self.reader
+        if attr[ToSDK.Attributes.private_data_type] == E.ReadTypes.record:
+            # every field of a record becomes an attribute, all decoded from one read
+            record = RecordSource(attr[ToSDK.Attributes.name], attr[ToSDK.Attributes.private_data], attr[ToSDK.Attributes.fields], reader, attr[ToSDK.Attributes.mmap])
+            return record.make_fields(attr[ToSDK.Attributes.sample_interval], attr[ToSDK.Attributes.report_interval])
+
+        if attr[ToSDK.Attributes.private_data_type] == E.ReadTypes.system:
+            if self.system_reader is None:
+                # its own descriptors, /proc and /sys files stay open whatever the attribute_reader mode
+                self.system_reader = SystemReader()
+            return [SystemAttr(attr[ToSDK.Attributes.name], attr[ToSDK.Attributes.private_data], self.system_reader,
+                attr[ToSDK.Attributes.sample_interval], attr[ToSDK.Attributes.report_interval])]
+
+        return [DynAttr(attr[ToSDK.Attributes.name],attr[ToSDK.Attributes.private_data],attr[ToSDK.Attributes.private_data_type], reader,
+            attr[ToSDK.Attributes.sample_interval], attr[ToSDK.Attributes.report_interval])]
+
+    def make_aggregator(self, attr: dict):
+        if (aggregate := attr[ToSDK.Attributes.aggregate]) is not None:
+            self.aggregators[attr[ToSDK.Attributes.name]] = WindowAggregator(aggregate[ToSDK.Aggregate.window], attr[ToSDK.Attributes.sample_interval], aggregate[ToSDK.Aggregate.stats])
+
+    def watch_attributes(self, attr: dict, attributes: list):
+        '''Reports attributes as soon as their file changes if attr asks for events, they are still polled too'''
+        if (events_conf := attr[ToSDK.Attributes.events]) is None:
+            return
+        if self.event_watcher is None:
+            self.event_watcher = EventWatcher()
+        self.event_watcher.start()
+        for attribute in attributes:
+            # keyed by device too, as devices sharing a watcher have the same attribute names
+            if self.event_watcher.add((self, attribute.name), attribute.path, events_conf[ToSDK.Events.debounce],
+                                      events_conf[ToSDK.Events.min_interval], self.push_watched):
+                self.watched_names.add(attribute.name)
+        self.stop_unused_watcher()
+
+    def stop_unused_watcher(self):
+        '''Stops this device's own event watcher, its thread and descriptors, once it watches nothing'''
+        if self.owns_event_watcher and self.event_watcher is not None and not self.watched_names:
+            self.event_watcher.stop()
+            self.event_watcher = None
+
+    def push_watched(self, keys: list):
+        self.push_events([name for _, name in keys])
+
+    def push_events(self, names: list):
+        '''Called from the event watcher thread, the attributes are sampled and sent by the next send_scheduled_states'''
+        with self.event_lock:
+            self.event_names.update(names)
+        self.wake.set()
+
+    def take_events(self) -> list:
+        with self.event_lock:
+            names = list(self.event_names)
+            self.event_names.clear()
+        return names
+
+    def configure_send_rate(self, rate_conf: dict):
+        if rate_conf is None:
+            # keeps the cloud's data frequency
+            self.enable_adaptive_rate()
+            return
+        self.enable_adaptive_rate(rate_conf[ToSDK.SendRate.latency_threshold], rate_conf[ToSDK.SendRate.queue_threshold],
+            rate_conf[ToSDK.SendRate.max_backoff], rate_conf[ToSDK.SendRate.recover_step], rate_conf[ToSDK.SendRate.check_interval])
+
+    def send_rate_changed(self):
+        '''Called from the SDK's thread for DATA_FRQ, so the schedule is only changed by apply_send_rate'''
+        self.send_rate_pending = True
+        if self.scheduler is not None:
+            self.wake.set()
+
+    def apply_send_rate(self):
+        '''Reschedules reports at self.send_rate's intervals if they changed, called between cycles'''
+        if not self.send_rate_pending or self.scheduler is None:
+            return
+        self.send_rate_pending = False
+        for attribute in self.attributes:
+            self.scheduler.set_interval((self.ScheduleKinds.REPORT, attribute.name), self.send_rate.interval(attribute.report_interval))
+
+    def configure_change_reporting(self, parsed_json: dict):
+        self.change_filter = None
+        if (change_conf := parsed_json[ToSDK.Credentials.report_on_change]) is not None:
+            deadbands = {}
+            for attr in parsed_json[ToSDK.Credentials.attributes]:
+                if attr[ToSDK.Attributes.deadband] is not None or attr[ToSDK.Attributes.deadband_percent] is not None:
+                    deadbands[attr[ToSDK.Attributes.name]] = (attr[ToSDK.Attributes.deadband], attr[ToSDK.Attributes.deadband_percent])
+            self.enable_change_reporting(change_conf[ToSDK.ReportOnChange.max_silence], deadbands)
+
+    # Hot reload
+
+    # changing any of these means a new connection to the cloud
+    CONNECTION_KEYS = [
+        ToSDK.Credentials.sdk_ver,
+        ToSDK.Credentials.company_id,
+        ToSDK.Credentials.unique_id,
+        ToSDK.Credentials.environment,
+        ToSDK.Credentials.sdk_id,
+        ToSDK.Credentials.sdk_options,
+        ToSDK.Credentials.iotc_server_cert,
+    ]
+    # only read at start
+    RESTART_KEYS = [
+        ToSDK.Credentials.spool,
+        ToSDK.Credentials.metrics,
+        ToSDK.Credentials.ota,
+        ToSDK.Credentials.twin,
+    ]
+
+    def request_reload(self):
+        '''Asks for reload() before the next send_scheduled_states cycle, waking it if it is waiting'''
+        self.reload_requested = True
+        self.wake.set()
+
+    def reload(self):
+        '''
+            Parses the device json again and applies what changed in place. Unchanged attributes
+            keep their objects, schedule and open files. The cloud connection is only remade if
+            the credentials or sdk options changed. Returns a dict describing the changes,
+            None if the json is invalid, in which case the running config is kept.
+        '''
+        try:
+            new = load_config(self.conf_file)
+        except Exception as exception:
+            print("Not reloading", self.conf_file, exception)
+            return None
+        old = self.parsed_json
+        changes = {}
+
+        reader = None
+        if new[ToSDK.Credentials.attribute_reader] != old[ToSDK.Credentials.attribute_reader]:
+            # every attribute holds the reader, rebuild them all with the new one
+            reader_conf = new[ToSDK.Credentials.attribute_reader]
+            reader = make_reader(reader_conf[ToSDK.AttributeReader.mode], reader_conf[ToSDK.AttributeReader.max_open_files])
+        # e.g. a thermal zone or net interface that doesn't exist here, nothing has been released yet
+        try:
+            built = self.build_attributes(new[ToSDK.Credentials.attributes], reader)
+        except Exception as exception:
+            if reader is not None:
+                reader.close()
+            print("Not reloading", self.conf_file, exception)
+            return None
+        if reader is not None:
+            for _, made in self.attribute_sources.values():
+                self.release_attributes(made)
+            self.attribute_sources = {}
+            self.reader.close()
+            self.reader = reader
+        changes.update(self.apply_attributes(*built))
+
+        if new[ToSDK.Credentials.report_on_change] != old[ToSDK.Credentials.report_on_change] or changes["attributes_changed"]:
+            self.configure_change_reporting(new)
+
+        if (batch_conf := new[ToSDK.Credentials.batch_send]) != old[ToSDK.Credentials.batch_send]:
+            self.batcher = None
+            if batch_conf is not None:
+                self.enable_batching(batch_conf[ToSDK.BatchSend.max_payload_bytes], batch_conf[ToSDK.BatchSend.max_entries])
+            changes["batch_send"] = True
+
+        changes["scripts"] = new[ToSDK.Credentials.commands_list_path] != old[ToSDK.Credentials.commands_list_path]
+        if changes["scripts"]:
+            self.scripts.close()
+            self.SCRIPTS_PATH = new[ToSDK.Credentials.commands_list_path]
+            self.get_all_scripts()
+
+        if (commands_conf := new[ToSDK.Credentials.commands]) != old[ToSDK.Credentials.commands]:
+            if (commands_conf[ToSDK.Commands.workers], commands_conf[ToSDK.Commands.queue_depth]) != (self.commands_conf[ToSDK.Commands.workers], self.commands_conf[ToSDK.Commands.queue_depth]):
+                # queued commands still run on the old pool's workers before they exit
+                self.command_pool.shutdown()
+                self.command_pool = CommandPool(commands_conf[ToSDK.Commands.workers], commands_conf[ToSDK.Commands.queue_depth])
+            changes["commands"] = True
+        self.commands_conf = commands_conf
+        if changes["scripts"] or changes.get("commands"):
+            self.load_handlers()
+
+        if (rate_conf := new[ToSDK.Credentials.send_rate]) != old[ToSDK.Credentials.send_rate]:
+            self.configure_send_rate(rate_conf)
+            changes["send_rate"] = True
+
+        for key in self.RESTART_KEYS:
+            if new[key] != old[key]:
+                print("Changes to", key.name, "apply after a restart")
+
+        self.parsed_json = new
+        changes["reconnect"] = any(new[key] != old[key] for key in self.CONNECTION_KEYS)
+        if changes["reconnect"]:
+            self.company_id = new[ToSDK.Credentials.company_id]
+            self.environment = new[ToSDK.Credentials.environment]
+            self.sdk_id = new[ToSDK.Credentials.sdk_id]
+            self.SdkOptions = new[ToSDK.Credentials.sdk_options]
+            self.set_unique_id(new[ToSDK.Credentials.unique_id])
+            self.reconnect()
+        elif changes["attributes_changed"] and self.attribute_metadata is not None:
+            # the metadata we have still holds, no GetAttributes round trip needed
+            self.compile_read_plan()
+
+        print("Reloaded", self.conf_file, changes)
+        return changes
+
+    def build_attributes(self, attr_confs: list, reader=None) -> tuple:
+        '''
+            Makes the attributes of attr_confs that were added or changed, the others keep their objects.
+            Nothing running is touched, so a bad attribute raises before any is replaced. With a new
+            reader every attribute is made again. Returns (sources, added, changed) for apply_attributes.
+        '''
+        sources = {}
+        added, changed = [], []
+        for attr in attr_confs:
+            name = attr[ToSDK.Attributes.name]
+            current = self.attribute_sources.get(name) if reader is None else None
+            if current is not None and current[0] == attr:
+                sources[name] = current
+                continue
+            (changed if current is not None else added).append(name)
+            sources[name] = (attr, self.make_attributes(attr, reader))
+        return sources, added, changed
+
+    def apply_attributes(self, sources: dict, added: list, changed: list) -> dict:
+        '''Replaces the running attributes with those from build_attributes, releasing the replaced and removed ones'''
+        for name in changed:
+            self.release_attributes(self.attribute_sources[name][1])
+        for name in added + changed:
+            self.watch_attributes(*sources[name])
+        removed = [name for name in self.attribute_sources if name not in sources]
+        for name in removed:
+            self.release_attributes(self.attribute_sources[name][1])
+        self.stop_unused_watcher()
+
+        for name in changed + removed:
+            self.aggregators.pop(name, None)
+        for name in added + changed:
+            self.make_aggregator(sources[name][0])
+
+        self.attribute_sources = sources
+        self.attributes = [attribute for _, made in sources.values() for attribute in made]
+        if self.scheduler is not None:
+            for name in added + changed:
+                for attribute in sources[name][1]:
+                    self.scheduler.add((self.ScheduleKinds.SAMPLE, attribute.name), attribute.sample_interval)
+                    self.scheduler.add((self.ScheduleKinds.REPORT, attribute.name), self.send_rate.interval(attribute.report_interval))
+
+        return {"added": added, "changed": changed, "removed": removed, "attributes_changed": bool(added or changed or removed)}
+
+    def release_attributes(self, attributes: list):
+        '''Unschedules attributes that are being replaced or removed and closes their files'''
+        for attribute in attributes:
+            if attribute.name in self.watched_names:
+                self.event_watcher.remove((self, attribute.name))
+                self.watched_names.discard(attribute.name)
+            if self.scheduler is not None:
+                self.scheduler.remove((self.ScheduleKinds.SAMPLE, attribute.name))
+                self.scheduler.remove((self.ScheduleKinds.REPORT, attribute.name))
+            if self.sampled_values is not None:
+                self.sampled_values.pop(attribute.name, None)
+            if attribute.read_type == E.ReadTypes.record:
+                attribute.record.close()
+                self.reader.forget(attribute.record.path)
+            else:
+                self.reader.forget(attribute.path)
+
+    def reconnect(self):
+        # the plan was built for the old template, nothing is read until the new one arrives
+        self.read_plan = None
+        super().reconnect()
+
+    def get_attribute_metadata_from_cloud(self, msg):
+        super().get_attribute_metadata_from_cloud(msg)
+        self.compile_read_plan()
+
+    def compile_read_plan(self):
+        '''Matches local attributes against cloud metadata once, so polling doesn't have to'''
+        metadata_by_name: dict = {}
+        for metadata in self.attribute_metadata:
+            metadata_by_name[metadata[E.MetadataKeys.name]] = metadata
+
+        plan = ReadPlan()
+        # DynAttr or RecordField
+        for attribute in self.attributes:
+            metadata = metadata_by_name.get(attribute.name)
+            if (aggregator := self.aggregators.get(attribute.name)) is not None:
+                stat_names = aggregator.attribute_names(attribute.name)
+                missing = [name for name in stat_names if name not in metadata_by_name
+                           or metadata_by_name[name][E.MetadataKeys.data_type] not in self.NUMERIC_TYPES]
+                if missing:
+                    print("Attribute", attribute.name, "is aggregated but", ", ".join(missing), "are not numeric attributes in the cloud template, it will not be sent")
+                    continue
+                if metadata is None:
+                    # samples are read like the statistics they feed, count is always an integer so it isn't used
+                    value_stats = [name for stat, name in zip(aggregator.stats, stat_names) if stat != EdgeStats.count]
+                    metadata = metadata_by_name[value_stats[0]] if value_stats else {E.MetadataKeys.data_type: E.SendDataTypes.FLOAT}
+            elif metadata is None:
+                print("Attribute", attribute.name, "has no metadata in the cloud template, it will not be sent")
+                continue
+
+            converter = attribute.get_converter(metadata[E.MetadataKeys.data_type])
+            if converter is None:
+                print("Attribute", attribute.name, "has unsupported data type", metadata[E.MetadataKeys.data_type], "for", attribute.read_type, "reads, it will not be sent")
+                continue
+
+            attribute.add_to_plan(plan, converter)
+        if self.metrics is not None:
+            plan.instrument(self.metrics.attribute_read, self.metrics.attribute_convert)
+        self.read_plan = plan
 
     def get_state(self):
         '''Do not override'''
@@ -143,16 +563,158 @@ class JsonDevice(ConnectedDevice):
     
     def get_attributes_state(self) -> dict:
         '''Gets all attributes specified from the JSON file'''
-        data_obj = {}
+        if self.read_plan is None:
+            return {}
+        return self.read_plan.execute()
+    
+    def build_schedule(self, start: float = None) -> IntervalScheduler:
+        '''Schedules every attribute's sampling and reporting from start (monotonic, default now), see send_scheduled_states'''
+        # waits on self.wake so request_reload() doesn't have to wait for the next deadline
+        self.scheduler = IntervalScheduler(sleep=self.wake.wait)
+        self.sampled_values = {}
         attribute: DynAttr
         for attribute in self.attributes:
-            for metadata in self.attribute_metadata:
-                if attribute.name == metadata[E.MetadataKeys.name]:
-                    data_obj[attribute.name] = attribute.get_value(metadata[E.MetadataKeys.data_type])
-                    break
+            self.scheduler.add((self.ScheduleKinds.SAMPLE, attribute.name), attribute.sample_interval, start)
+            self.scheduler.add((self.ScheduleKinds.REPORT, attribute.name), self.send_rate.interval(attribute.report_interval), start)
+        return self.scheduler
+
+    def send_scheduled_states(self):
+        '''
+            Waits for the next attributes to fall due, samples and sends only those.
+            Attributes reported at the same time are sent in a single message.
+            Attributes whose file changed are sent with them, or on their own as soon as the
+            change is seen.
+        '''
+        if self.reload_requested:
+            self.reload_requested = False
+            self.wake.clear()
+            self.reload()
+            if self.event_names:
+                # their wake was cleared above
+                self.wake.set()
+        if self.scheduler is None:
+            self.build_schedule()
+        self.apply_send_rate()
+        due_keys = self.scheduler.wait_due()
+        # set again by any event after this, so it isn't lost
+        self.wake.clear()
+        return self.send_due_states(due_keys, self.take_events())
+
+    def send_due_states(self, due_keys: list, event_names: list = None):
+        '''
+            Samples and sends the keys popped from self.scheduler, for callers driving many devices from one loop.
+            event_names are attributes whose file changed, sampled and sent now whatever their schedule.
+        '''
+        to_sample = []
+        to_report = []
+        for kind, name in due_keys:
+            if kind == self.ScheduleKinds.SAMPLE:
+                to_sample.append(name)
+            else:
+                to_report.append(name)
+        if event_names:
+            for name in event_names:
+                if name not in to_sample:
+                    to_sample.append(name)
+                # an aggregate is still sent once per window
+                if name not in self.aggregators and name not in to_report:
+                    to_report.append(name)
+
+        # Don't read anything till we get our cloud attributes, keep raw values for later if spooling
+        if self.read_plan is None:
+            if self.spool is not None and to_report:
+                self.spool_raw_states(to_report)
+            return None
+        self.replay_spool()
+
+        samples = self.read_plan.execute(to_sample)
+        self.sampled_values.update(samples)
+        for name, value in samples.items():
+            if (aggregator := self.aggregators.get(name)) is not None:
+                aggregator.add(value)
+        if not to_report:
+            return None
+
+        if self.metrics is not None:
+            build_start = time.perf_counter()
+        data_obj = {}
+        for name in to_report:
+            if (aggregator := self.aggregators.get(name)) is not None:
+                if (summary := aggregator.take_summary()) is not None:
+                    for stat, value in summary.items():
+                        data_obj[stat_attribute_name(name, stat)] = value
+            elif name in self.sampled_values:
+                data_obj[name] = self.sampled_values[name]
+        data_obj.update(self.get_local_state())
+
+        data = self.generate_d2c_data(data_obj)
+        if self.change_filter is not None:
+            self.change_filter.start_cycle()
+            data = self.change_filter.filter_entries(data)
+        if not data or not data[0]["data"]:
+            return None
+
+        if self.metrics is not None:
+            self.metrics.payload_build.observe(time.perf_counter() - build_start)
+        if self.batcher is not None:
+            # one entry per cycle here, split so the batch_send limits and stats hold as for a gateway
+            for batch in self.batcher.split(data):
+                self.send_d2c(batch)
+        else:
+            self.send_d2c(data)
+        return data
+
+    def spool_states(self, timestamp: str):
+        self.spool_raw_states(None, timestamp)
+
+    def spool_raw_states(self, names=None, timestamp: str = None):
+        '''
+            Spools unconverted values of the named attributes (all if None), they are converted
+            with the cloud metadata when replayed. Aggregated attributes aren't spooled.
+        '''
+        raw = {}
+        records = {}
+        # DynAttr or RecordField
+        for attribute in self.attributes:
+            if (names is not None and attribute.name not in names) or attribute.name in self.aggregators:
+                continue
+            if attribute.read_type == E.ReadTypes.record:
+                if attribute.record not in records:
+                    records[attribute.record] = attribute.record.read()
+                values = records[attribute.record]
+                raw[attribute.name] = None if values is None else values[attribute.index]
+                continue
+            val = attribute.update_value()
+            if isinstance(val, bytes):
+                val = base64.b64encode(val).decode("ascii")
+            raw[attribute.name] = val
+
+        self.spool.append([{
+            "uniqueId": self.unique_id,
+            "time": timestamp if timestamp is not None else timestamps.now(),
+            "data": raw,
+            "local": self.get_local_state()
+        }], SpoolFlags.RAW)
+
+    def prepare_spooled(self, flags: int, message: list) -> list:
+        if not flags & SpoolFlags.RAW:
+            return message
+        binary = [attribute.name for attribute in self.attributes if attribute.read_type == E.ReadTypes.binary]
+        prepared = []
+        for entry in message:
+            data = {}
+            for name, val in entry["data"].items():
+                if name in binary and val is not None:
+                    val = base64.b64decode(val)
+                try:
+                    data[name] = self.read_plan.convert(name, val)
+                except KeyError:
+                    # no metadata in the cloud template, see compile_read_plan
+                    continue
+            data.update(entry["local"])
+            prepared.append({"uniqueId": entry["uniqueId"], "time": entry["time"], "data": data})
+        return prepared
 
-        return data_obj
-    
     def get_local_state(self) -> dict:
         '''Overrideable - return dictionary of local data to send to the cloud'''
         #print("no class-defined object properties")
@@ -161,11 +723,34 @@ class JsonDevice(ConnectedDevice):
     def get_all_scripts(self):
         if not self.SCRIPTS_PATH.endswith('/'):
             self.SCRIPTS_PATH += '/'
-        self.scripts: list = [f for f in os.listdir(self.SCRIPTS_PATH) if os.path.isfile(os.path.join(self.SCRIPTS_PATH, f))]
+        # indexed by script name and kept up to date as scripts are added or removed
+        self.scripts = CommandRegistry(self.SCRIPTS_PATH)
+        self.scripts.watch()
+
+    def load_handlers(self):
+        '''Registers in-process handlers from the json config and the commands folder plugin'''
+        self.handlers = HandlerRegistry()
+        for h in self.commands_conf[ToSDK.Commands.handlers]:
+            self.handlers.add(h[ToSDK.Handlers.name], make_handler(h[ToSDK.Handlers.type], h[ToSDK.Handlers.path], h[ToSDK.Handlers.values]))
+
+        plugin_path = self.SCRIPTS_PATH + PLUGIN_FILE_NAME
+        if os.path.isfile(plugin_path):
+            load_plugin(plugin_path, self.handlers)
+
 
+    def get_script_limits(self, script: str):
+        '''Returns (timeout, max_concurrent) for script, per script settings override the defaults'''
+        limits = self.commands_conf[ToSDK.Commands.scripts].get(script, self.commands_conf)
+        return limits[ToSDK.Commands.timeout], limits[ToSDK.Commands.max_concurrent]
+
+    def get_output_limits(self, script: str):
+        '''Returns (max_output, progress_interval) for script, per script settings override the defaults'''
+        limits = self.commands_conf[ToSDK.Commands.scripts].get(script, self.commands_conf)
+        return limits[ToSDK.Commands.max_output], limits[ToSDK.Commands.progress_interval]
 
     def device_cb(self,msg):
         # Only handles messages with E.Values.Commands.DEVICE_COMMAND (also known as CMDTYPE["DCOMM"])
+        # Called from the SDK's MQTT thread, so scripts are only queued here and run by self.command_pool
         command: list = E.get_value(msg, E.Keys.device_command).split(' ')
         
         # If you need to implement other hardcoded commands
@@ -176,18 +761,65 @@ class JsonDevice(ConnectedDevice):
         # if enum_command == self.DeviceCommands.EXAMPLE:
         #     do something
 
-        # if command exists in scripts folder append the folder path
-        if command[0] in self.scripts:
-            command[0] = self.SCRIPTS_PATH + command[0]
+        # python handlers run in-process, scripts in the scripts folder are the fallback
+        if command[0] in self.handlers:
+            run = self.run_handler
+        elif (script := self.scripts.get(command[0])) is not None:
+            if not script.executable:
+                self.send_ack(msg,E.Values.AckStat.FAIL, f"Command {command[0]} is not executable")
+                return
+            run = self.run_script
+        else:
+            self.send_ack(msg,E.Values.AckStat.FAIL, f"Command {command[0]} does not exist")
+            return
 
-            process = subprocess.run(command, check=False, capture_output=True)
-            process_success:bool = (process.returncode == 0)
+        timeout, max_concurrent = self.get_script_limits(command[0])
+        job = lambda: run(msg, command, timeout)
+        if self.metrics is not None:
+            job = self.metrics.timed_command(command[0], job)
+        if not self.command_pool.submit(command[0], job, max_concurrent):
+            self.send_ack(msg,E.Values.AckStat.FAIL, f"Command {command[0]} rejected, too many commands queued")
 
-            ack = E.Values.AckStat.SUCCESS if process_success else E.Values.AckStat.FAIL
-            process_output: bytes = process.stdout if process_success else process.stderr
-        
-            ack_message = str(process_output, 'UTF-8')
-            self.send_ack(msg,ack, ack_message)
+    def run_handler(self, msg, command: list, timeout: float):
+        '''Runs an in-process handler on a command_pool worker and acks the result, handlers can't be killed so timeout is unused'''
+        handler = self.handlers.get(command[0])
+        try:
+            success, message = handler(command[1:])
+        except Exception as exception:
+            success, message = False, f"Command {command[0]} failed: {exception}"
 
-        self.send_ack(msg,E.Values.AckStat.FAIL, f"Command {command[0]} does not exist")
+        ack = E.Values.AckStat.SUCCESS if success else E.Values.AckStat.FAIL
+        max_output, _ = self.get_output_limits(command[0])
+        self.send_ack(msg,ack, excerpt_text(str(message), max_output))
 
+    def run_script(self, msg, command: list, timeout: float):
+        '''Runs a script from the scripts folder on a command_pool worker and acks the result'''
+        script = command[0]
+        entry = self.scripts.get(script)
+        if entry is None:
+            self.send_ack(msg,E.Values.AckStat.FAIL, f"Command {script} was removed before it could run")
+            return
+        command = [entry.path] + command[1:]
+
+        max_output, progress_interval = self.get_output_limits(script)
+        def progress(elapsed, stdout):
+            self.send_ack(msg,E.Values.AckStat.EXECUTED, f"Command {script} running for {elapsed:.1f}s: " + stdout.tail_text())
+
+        # output is read as it comes and capped at max_output per stream, the script is killed if it times out
+        try:
+            result = run_command(command, timeout, max_output, progress_interval, progress)
+        except OSError as exception:
+            # e.g. a bad shebang or a script that isn't executable
+            self.send_ack(msg,E.Values.AckStat.FAIL, excerpt_text(f"Command {script} could not be run: {exception}", max_output))
+            return
+        if result.timed_out:
+            self.send_ack(msg,E.Values.AckStat.FAIL, f"Command {script} timed out after {timeout:g}s and was killed")
+            return
+
+        process_success:bool = (result.returncode == 0)
+
+        ack = E.Values.AckStat.SUCCESS if process_success else E.Values.AckStat.FAIL
+        process_output = result.stdout if process_success else result.stderr
+    
+        ack_message = process_output.text()
+        self.send_ack(msg,ack, ack_message)
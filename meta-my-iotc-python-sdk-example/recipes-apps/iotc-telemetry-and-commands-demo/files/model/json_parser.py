@@ -2,6 +2,8 @@
 import json
 from enum import Enum, auto
 import os
+from model.system_sources import check_spec
+from model.record_source import compile_layout
 
 
 class ToSDK:
@@ -22,11 +24,95 @@ class ToSDK:
         attributes = auto()
         iotc_server_cert = auto()
         commands_list_path = auto()
+        attribute_reader = auto()
+        batch_send = auto()
+        commands = auto()
+        report_on_change = auto()
+        spool = auto()
+        metrics = auto()
+        send_rate = auto()
+        ota = auto()
+        twin = auto()
 
     class Attributes(Enum):
         name = auto()
         private_data = auto()
         private_data_type = auto()
+        sample_interval = auto()
+        report_interval = auto()
+        deadband = auto()
+        deadband_percent = auto()
+        aggregate = auto()
+        fields = auto()
+        mmap = auto()
+        events = auto()
+
+    class Aggregate(Enum):
+        window = auto()
+        stats = auto()
+
+    class Events(Enum):
+        debounce = auto()
+        min_interval = auto()
+
+    class AttributeReader(Enum):
+        mode = auto()
+        max_open_files = auto()
+
+    class ReportOnChange(Enum):
+        max_silence = auto()
+
+    class BatchSend(Enum):
+        max_payload_bytes = auto()
+        max_entries = auto()
+
+    class Spool(Enum):
+        path = auto()
+        max_bytes = auto()
+        replay_rate = auto()
+        replay_batch = auto()
+
+    class Metrics(Enum):
+        textfile = auto()
+        socket = auto()
+        interval = auto()
+        buckets = auto()
+
+    class SendRate(Enum):
+        latency_threshold = auto()
+        queue_threshold = auto()
+        max_backoff = auto()
+        recover_step = auto()
+        check_interval = auto()
+
+    class Ota(Enum):
+        download_dir = auto()
+        chunk_size = auto()
+        retries = auto()
+        timeout = auto()
+        progress_interval = auto()
+        install_command = auto()
+        install_timeout = auto()
+
+    class Twin(Enum):
+        cache = auto()
+        flush_interval = auto()
+
+    class Commands(Enum):
+        workers = auto()
+        queue_depth = auto()
+        timeout = auto()
+        max_concurrent = auto()
+        max_output = auto()
+        progress_interval = auto()
+        scripts = auto()
+        handlers = auto()
+
+    class Handlers(Enum):
+        name = auto()
+        type = auto()
+        path = auto()
+        values = auto()
 
     class SdkOptions:
         """Human readable Enum for to mapping SDK's sdkOptions format"""
@@ -100,6 +186,188 @@ class FromJSON:
                 name = "name"
                 private_data = "private_data"
                 private_data_type = "private_data_type"
+                sample_interval = "sample_interval"
+                report_interval = "report_interval"
+                # only used with report_on_change, for numeric attributes
+                deadband = "deadband"
+                deadband_percent = "deadband_percent"
+                # send min/max/avg/count of a window of samples instead of the latest value
+                aggregate = "aggregate"
+                # report as soon as the file changes, true or an object of Events keys
+                events = "events"
+
+            class Aggregate:
+                window = "window"
+                stats = "stats"
+
+            class Events:
+                """Only ascii and binary attributes, see model/event_watcher.py"""
+                debounce = "debounce"
+                min_interval = "min_interval"
+
+                class Defaults:
+                    # seconds
+                    debounce = 0.05
+                    min_interval = 1.0
+
+            class Record:
+                """Extra keys of attributes with private_data_type record"""
+                type_name = "record"
+                fields = "fields"
+                mmap = "mmap"
+                class Fields:
+                    name = "name"
+                    offset = "offset"
+                    type = "type"
+                    endianness = "endianness"
+
+                class Defaults:
+                    endianness = "little"
+
+            class System:
+                """Attributes with private_data_type system name a /proc or /sys value in private_data"""
+                type_name = "system"
+
+            class Defaults:
+                # seconds, sample_interval defaults to the report_interval
+                report_interval = 10
+
+        class AttributeReader:
+            """Human readable Enum for to mapping credential's attribute_reader object json format"""
+            name = "attribute_reader"
+            class Children:
+                mode = "mode"
+                max_open_files = "max_open_files"
+
+            class Defaults:
+                mode = "open"
+                max_open_files = 64
+
+        class ReportOnChange:
+            """Human readable Enum for to mapping credential's report_on_change object json format"""
+            name = "report_on_change"
+            class Children:
+                max_silence = "max_silence"
+
+            class Defaults:
+                max_silence = 300
+
+        class BatchSend:
+            """Human readable Enum for to mapping credential's batch_send object json format"""
+            name = "batch_send"
+            class Children:
+                max_payload_bytes = "max_payload_bytes"
+                max_entries = "max_entries"
+
+            class Defaults:
+                max_payload_bytes = 131072
+                max_entries = 250
+
+        class Spool:
+            """Human readable Enum for to mapping credential's spool object json format"""
+            name = "spool"
+            class Children:
+                path = "path"
+                max_bytes = "max_bytes"
+                replay_rate = "replay_rate"
+                replay_batch = "replay_batch"
+
+            class Defaults:
+                max_bytes = 1048576
+                replay_rate = 5
+                replay_batch = 20
+
+        class Metrics:
+            """Human readable Enum for to mapping credential's metrics object json format"""
+            name = "metrics"
+            class Children:
+                textfile = "textfile"
+                socket = "socket"
+                interval = "interval"
+                buckets = "buckets"
+
+            class Defaults:
+                interval = 15
+
+        class SendRate:
+            """Human readable Enum for to mapping credential's send_rate object json format"""
+            name = "send_rate"
+            class Children:
+                # seconds, moving average of SendData
+                latency_threshold = "latency_threshold"
+                # messages waiting in the spool
+                queue_threshold = "queue_threshold"
+                max_backoff = "max_backoff"
+                recover_step = "recover_step"
+                check_interval = "check_interval"
+
+            class Defaults:
+                max_backoff = 8
+                recover_step = 0.25
+                check_interval = 10
+
+        class Ota:
+            """Human readable Enum for to mapping credential's ota object json format"""
+            name = "ota"
+            class Children:
+                download_dir = "download_dir"
+                # bytes per read, the most of an image held in memory
+                chunk_size = "chunk_size"
+                retries = "retries"
+                timeout = "timeout"
+                progress_interval = "progress_interval"
+                # run with the downloaded files as arguments, its exit code decides the final ack
+                install_command = "install_command"
+                install_timeout = "install_timeout"
+
+            class Defaults:
+                chunk_size = 65536
+                retries = 5
+                timeout = 30
+                progress_interval = 10
+                install_timeout = 600
+
+        class Twin:
+            """Human readable Enum for to mapping credential's twin object json format"""
+            name = "twin"
+            class Children:
+                # json file the shadow is kept in
+                cache = "cache"
+                # seconds reported property updates are held to be sent together
+                flush_interval = "flush_interval"
+
+            class Defaults:
+                flush_interval = 1
+
+        class Commands:
+            """Human readable Enum for to mapping credential's commands object json format"""
+            name = "commands"
+            class Children:
+                workers = "workers"
+                queue_depth = "queue_depth"
+                timeout = "timeout"
+                max_concurrent = "max_concurrent"
+                # bytes of stdout or stderr kept for the ack, the start and the end if there is more
+                max_output = "max_output"
+                # seconds between EXECUTED acks while a script runs, none if not set
+                progress_interval = "progress_interval"
+                # object of script name -> {timeout, max_concurrent, max_output, progress_interval} overriding the defaults
+                scripts = "scripts"
+                # array of built in command handlers, see model.command_handlers
+                handlers = "handlers"
+
+            class Handlers:
+                name = "name"
+                type = "type"
+                path = "path"
+                values = "values"
+
+            class Defaults:
+                workers = 2
+                queue_depth = 16
+                timeout = 30
+                max_concurrent = 1
+                max_output = 4096
 
 def get(j: json, key):
     """Get value from key, return None if it doesn't exist"""
@@ -126,6 +394,15 @@ def parse_json_for_config(path_to_json) -> dict:
 
     c[ToSDK.Credentials.sdk_options] = get_sdk_options(j)
     c[ToSDK.Credentials.attributes] = parse_device_attributes(j)
+    c[ToSDK.Credentials.attribute_reader] = parse_device_attribute_reader(j)
+    c[ToSDK.Credentials.batch_send] = parse_device_batch_send(j)
+    c[ToSDK.Credentials.commands] = parse_device_commands(j)
+    c[ToSDK.Credentials.report_on_change] = parse_device_report_on_change(j)
+    c[ToSDK.Credentials.spool] = parse_device_spool(j)
+    c[ToSDK.Credentials.metrics] = parse_device_metrics(j)
+    c[ToSDK.Credentials.send_rate] = parse_device_send_rate(j)
+    c[ToSDK.Credentials.ota] = parse_device_ota(j)
+    c[ToSDK.Credentials.twin] = parse_device_twin(j)
 
     return c
 
@@ -171,13 +448,317 @@ def parse_device_attributes(j:json):
             a[ToSDK.Attributes.private_data] = get(attribute, FromJSON.Device.Attributes.Children.private_data)
 
             path = a[ToSDK.Attributes.private_data]
-            if os.path.isfile(path) is False:
+            if a[ToSDK.Attributes.private_data_type] == FromJSON.Device.Attributes.System.type_name:
+                # not a path but the name of a /proc or /sys value
+                check_spec(path)
+            elif os.path.isfile(path) is False:
                 raise FileNotFoundError("PATH: " + path + " Does not exist, check path")
 
+            a.update(parse_attribute_intervals(attribute))
+            a.update(parse_attribute_deadband(attribute))
+            a[ToSDK.Attributes.aggregate] = parse_attribute_aggregate(attribute, a[ToSDK.Attributes.report_interval])
+            a[ToSDK.Attributes.fields] = None
+            a[ToSDK.Attributes.mmap] = False
+            if a[ToSDK.Attributes.private_data_type] == FromJSON.Device.Attributes.Record.type_name:
+                a.update(parse_attribute_record(attribute))
+            a[ToSDK.Attributes.events] = parse_attribute_events(attribute)
             all_attributes.append(a)
 
     return all_attributes
 
+def parse_attribute_intervals(attribute:json):
+    '''Parse how often an attribute is read (sample_interval) and sent (report_interval), in seconds'''
+    report_interval = get(attribute, FromJSON.Device.Attributes.Children.report_interval)
+    if report_interval is None:
+        report_interval = FromJSON.Device.Attributes.Defaults.report_interval
+    sample_interval = get(attribute, FromJSON.Device.Attributes.Children.sample_interval)
+    if sample_interval is None:
+        sample_interval = report_interval
+
+    name = get(attribute, FromJSON.Device.Attributes.Children.name)
+    report_interval = float(report_interval)
+    sample_interval = float(sample_interval)
+    if report_interval <= 0 or sample_interval <= 0:
+        raise ValueError("Attribute " + str(name) + ": sample_interval and report_interval must be positive")
+    if sample_interval > report_interval:
+        raise ValueError("Attribute " + str(name) + ": sample_interval must not be longer than report_interval")
+
+    a = {}
+    a[ToSDK.Attributes.sample_interval] = sample_interval
+    a[ToSDK.Attributes.report_interval] = report_interval
+    return a
+
+def parse_attribute_deadband(attribute:json):
+    '''Parse the absolute and percent deadbands of a numeric attribute, None where not set'''
+    deadband = _optional_float(get(attribute, FromJSON.Device.Attributes.Children.deadband))
+    deadband_percent = _optional_float(get(attribute, FromJSON.Device.Attributes.Children.deadband_percent))
+    if (deadband is not None and deadband < 0) or (deadband_percent is not None and deadband_percent < 0):
+        raise ValueError("Attribute " + str(get(attribute, FromJSON.Device.Attributes.Children.name)) + ": deadband and deadband_percent must not be negative")
+
+    a = {}
+    a[ToSDK.Attributes.deadband] = deadband
+    a[ToSDK.Attributes.deadband_percent] = deadband_percent
+    return a
+
+def parse_attribute_record(attribute:json):
+    '''Parse the field layout of a packed binary record attribute'''
+    keys = FromJSON.Device.Attributes.Record
+    fields_o = get(attribute, keys.fields)
+    if not fields_o:
+        raise ValueError("Record " + str(get(attribute, FromJSON.Device.Attributes.Children.name)) + " needs a list of fields")
+
+    fields = []
+    for field_o in fields_o:
+        fields.append({
+            "name": get(field_o, keys.Fields.name),
+            "offset": int(get(field_o, keys.Fields.offset)),
+            "type": get(field_o, keys.Fields.type),
+            "endianness": field_o.get(keys.Fields.endianness, keys.Defaults.endianness)
+        })
+    # raises on an unknown type or endianness now rather than when the attribute is made
+    compile_layout(fields)
+
+    a = {}
+    a[ToSDK.Attributes.fields] = fields
+    a[ToSDK.Attributes.mmap] = bool(attribute.get(keys.mmap, False))
+    return a
+
+def parse_attribute_aggregate(attribute:json, report_interval: float):
+    '''Parse an attribute's edge aggregation window, the window defaults to the report_interval'''
+    aggregate_o = get(attribute, FromJSON.Device.Attributes.Children.aggregate)
+    if aggregate_o is None:
+        return None
+
+    window = float(aggregate_o.get(FromJSON.Device.Attributes.Aggregate.window, report_interval))
+    if window <= 0:
+        raise ValueError("Attribute " + str(get(attribute, FromJSON.Device.Attributes.Children.name)) + ": aggregate window must be positive")
+
+    a = {}
+    a[ToSDK.Aggregate.window] = window
+    a[ToSDK.Aggregate.stats] = aggregate_o.get(FromJSON.Device.Attributes.Aggregate.stats)
+    return a
+
+def parse_attribute_events(attribute:json):
+    '''Parse the debounce and min_interval of an attribute reported when its file changes, None if it's only polled'''
+    events_o = get(attribute, FromJSON.Device.Attributes.Children.events)
+    if events_o is None or events_o is False:
+        return None
+    if events_o is True:
+        events_o = {}
+
+    name = get(attribute, FromJSON.Device.Attributes.Children.name)
+    if get(attribute, FromJSON.Device.Attributes.Children.private_data_type) not in ("ascii", "binary"):
+        raise ValueError("Attribute " + str(name) + ": events are only supported for ascii and binary attributes")
+
+    keys = FromJSON.Device.Attributes.Events
+    debounce = float(events_o.get(keys.debounce, keys.Defaults.debounce))
+    min_interval = float(events_o.get(keys.min_interval, keys.Defaults.min_interval))
+    if debounce < 0 or min_interval < 0:
+        raise ValueError("Attribute " + str(name) + ": events debounce and min_interval must not be negative")
+
+    a = {}
+    a[ToSDK.Events.debounce] = debounce
+    a[ToSDK.Events.min_interval] = min_interval
+    return a
+
+def parse_device_attribute_reader(j:json):
+    '''Parse attribute_reader parameters, falling back to open/read/close per poll'''
+    device_o = get(j, FromJSON.Keys.device)
+    reader_o = get(device_o, FromJSON.Device.AttributeReader.name)
+    if reader_o is None:
+        reader_o = {}
+
+    defaults = FromJSON.Device.AttributeReader.Defaults
+    r = {}
+    r[ToSDK.AttributeReader.mode] = reader_o.get(FromJSON.Device.AttributeReader.Children.mode, defaults.mode)
+    r[ToSDK.AttributeReader.max_open_files] = int(reader_o.get(FromJSON.Device.AttributeReader.Children.max_open_files, defaults.max_open_files))
+    return r
+
+def parse_device_report_on_change(j:json):
+    '''Parse report_on_change parameters, None if every value is sent every time'''
+    device_o = get(j, FromJSON.Keys.device)
+    report_o = get(device_o, FromJSON.Device.ReportOnChange.name)
+    if report_o is None:
+        return None
+
+    r = {}
+    r[ToSDK.ReportOnChange.max_silence] = float(report_o.get(FromJSON.Device.ReportOnChange.Children.max_silence, FromJSON.Device.ReportOnChange.Defaults.max_silence))
+    return r
+
+def parse_device_batch_send(j:json):
+    '''Parse batch_send parameters, None if the device sends one message per device'''
+    device_o = get(j, FromJSON.Keys.device)
+    batch_o = get(device_o, FromJSON.Device.BatchSend.name)
+    if batch_o is None:
+        return None
+
+    defaults = FromJSON.Device.BatchSend.Defaults
+    b = {}
+    b[ToSDK.BatchSend.max_payload_bytes] = int(batch_o.get(FromJSON.Device.BatchSend.Children.max_payload_bytes, defaults.max_payload_bytes))
+    b[ToSDK.BatchSend.max_entries] = int(batch_o.get(FromJSON.Device.BatchSend.Children.max_entries, defaults.max_entries))
+    return b
+
+def parse_device_spool(j:json):
+    '''Parse spool parameters, None if samples taken while offline are dropped'''
+    device_o = get(j, FromJSON.Keys.device)
+    spool_o = get(device_o, FromJSON.Device.Spool.name)
+    if spool_o is None:
+        return None
+
+    keys = FromJSON.Device.Spool.Children
+    defaults = FromJSON.Device.Spool.Defaults
+    if (path := spool_o.get(keys.path)) is None:
+        raise KeyError("spool needs a " + keys.path)
+    s = {}
+    s[ToSDK.Spool.path] = path
+    s[ToSDK.Spool.max_bytes] = int(spool_o.get(keys.max_bytes, defaults.max_bytes))
+    s[ToSDK.Spool.replay_rate] = float(spool_o.get(keys.replay_rate, defaults.replay_rate))
+    s[ToSDK.Spool.replay_batch] = int(spool_o.get(keys.replay_batch, defaults.replay_batch))
+    if s[ToSDK.Spool.max_bytes] < 1 or s[ToSDK.Spool.replay_rate] <= 0 or s[ToSDK.Spool.replay_batch] < 1:
+        raise ValueError("spool max_bytes, replay_rate and replay_batch must be positive")
+    return s
+
+def parse_device_metrics(j:json):
+    '''Parse metrics parameters, None if nothing is timed'''
+    device_o = get(j, FromJSON.Keys.device)
+    metrics_o = get(device_o, FromJSON.Device.Metrics.name)
+    if metrics_o is None:
+        return None
+
+    keys = FromJSON.Device.Metrics.Children
+    m = {}
+    m[ToSDK.Metrics.textfile] = metrics_o.get(keys.textfile)
+    m[ToSDK.Metrics.socket] = metrics_o.get(keys.socket)
+    if m[ToSDK.Metrics.textfile] is None and m[ToSDK.Metrics.socket] is None:
+        raise KeyError("metrics needs a " + keys.textfile + " or a " + keys.socket)
+    m[ToSDK.Metrics.interval] = float(metrics_o.get(keys.interval, FromJSON.Device.Metrics.Defaults.interval))
+    m[ToSDK.Metrics.buckets] = None
+    if (buckets := metrics_o.get(keys.buckets)) is not None:
+        m[ToSDK.Metrics.buckets] = sorted(float(bucket) for bucket in buckets)
+    return m
+
+def parse_device_send_rate(j:json):
+    '''Parse backpressure thresholds, None if only the cloud's data frequency changes the report rate'''
+    device_o = get(j, FromJSON.Keys.device)
+    rate_o = get(device_o, FromJSON.Device.SendRate.name)
+    if rate_o is None:
+        return None
+
+    keys = FromJSON.Device.SendRate.Children
+    defaults = FromJSON.Device.SendRate.Defaults
+    r = {}
+    r[ToSDK.SendRate.latency_threshold] = rate_o.get(keys.latency_threshold)
+    r[ToSDK.SendRate.queue_threshold] = rate_o.get(keys.queue_threshold)
+    if r[ToSDK.SendRate.latency_threshold] is None and r[ToSDK.SendRate.queue_threshold] is None:
+        raise KeyError("send_rate needs a " + keys.latency_threshold + " or a " + keys.queue_threshold)
+    if r[ToSDK.SendRate.latency_threshold] is not None:
+        r[ToSDK.SendRate.latency_threshold] = float(r[ToSDK.SendRate.latency_threshold])
+    if r[ToSDK.SendRate.queue_threshold] is not None:
+        r[ToSDK.SendRate.queue_threshold] = int(r[ToSDK.SendRate.queue_threshold])
+    r[ToSDK.SendRate.max_backoff] = float(rate_o.get(keys.max_backoff, defaults.max_backoff))
+    r[ToSDK.SendRate.recover_step] = float(rate_o.get(keys.recover_step, defaults.recover_step))
+    r[ToSDK.SendRate.check_interval] = float(rate_o.get(keys.check_interval, defaults.check_interval))
+    if r[ToSDK.SendRate.max_backoff] < 1 or r[ToSDK.SendRate.recover_step] <= 0 or r[ToSDK.SendRate.check_interval] <= 0:
+        raise ValueError("send_rate max_backoff must be at least 1, recover_step and check_interval positive")
+    return r
+
+def parse_device_ota(j:json):
+    '''Parse firmware download parameters, None if firmware commands aren't handled'''
+    device_o = get(j, FromJSON.Keys.device)
+    ota_o = get(device_o, FromJSON.Device.Ota.name)
+    if ota_o is None:
+        return None
+
+    keys = FromJSON.Device.Ota.Children
+    defaults = FromJSON.Device.Ota.Defaults
+    if (download_dir := ota_o.get(keys.download_dir)) is None:
+        raise KeyError("ota needs a " + keys.download_dir)
+    if os.path.isdir(download_dir) is False:
+        raise FileNotFoundError("PATH: " + download_dir + " Does not exist, check ota download_dir")
+    install_command = ota_o.get(keys.install_command)
+    if install_command is not None and os.path.isfile(install_command) is False:
+        raise FileNotFoundError("PATH: " + install_command + " Does not exist, check ota install_command")
+
+    o = {}
+    o[ToSDK.Ota.download_dir] = download_dir
+    o[ToSDK.Ota.chunk_size] = int(ota_o.get(keys.chunk_size, defaults.chunk_size))
+    o[ToSDK.Ota.retries] = int(ota_o.get(keys.retries, defaults.retries))
+    o[ToSDK.Ota.timeout] = float(ota_o.get(keys.timeout, defaults.timeout))
+    o[ToSDK.Ota.progress_interval] = float(ota_o.get(keys.progress_interval, defaults.progress_interval))
+    o[ToSDK.Ota.install_command] = install_command
+    o[ToSDK.Ota.install_timeout] = float(ota_o.get(keys.install_timeout, defaults.install_timeout))
+    if o[ToSDK.Ota.chunk_size] < 1 or o[ToSDK.Ota.retries] < 0 or o[ToSDK.Ota.timeout] <= 0 or o[ToSDK.Ota.install_timeout] <= 0:
+        raise ValueError("ota chunk_size, timeout and install_timeout must be positive and retries not negative")
+    return o
+
+def parse_device_twin(j:json):
+    '''Parse twin shadow parameters, None if twin messages aren't handled'''
+    device_o = get(j, FromJSON.Keys.device)
+    twin_o = get(device_o, FromJSON.Device.Twin.name)
+    if twin_o is None:
+        return None
+
+    keys = FromJSON.Device.Twin.Children
+    t = {}
+    t[ToSDK.Twin.cache] = twin_o.get(keys.cache)
+    if t[ToSDK.Twin.cache] is not None and os.path.isdir(os.path.dirname(os.path.abspath(t[ToSDK.Twin.cache]))) is False:
+        raise FileNotFoundError("PATH: " + t[ToSDK.Twin.cache] + " Does not exist, check twin cache folder")
+    t[ToSDK.Twin.flush_interval] = float(twin_o.get(keys.flush_interval, FromJSON.Device.Twin.Defaults.flush_interval))
+    if t[ToSDK.Twin.flush_interval] < 0:
+        raise ValueError("twin flush_interval must not be negative")
+    return t
+
+def _optional_float(value):
+    return float(value) if value is not None else None
+
+def parse_device_commands(j:json):
+    '''Parse how commands are executed: worker count, queue depth and per script limits'''
+    device_o = get(j, FromJSON.Keys.device)
+    commands_o = get(device_o, FromJSON.Device.Commands.name)
+    if commands_o is None:
+        commands_o = {}
+
+    keys = FromJSON.Device.Commands.Children
+    defaults = FromJSON.Device.Commands.Defaults
+    c = {}
+    c[ToSDK.Commands.workers] = int(commands_o.get(keys.workers, defaults.workers))
+    c[ToSDK.Commands.queue_depth] = int(commands_o.get(keys.queue_depth, defaults.queue_depth))
+    c[ToSDK.Commands.timeout] = float(commands_o.get(keys.timeout, defaults.timeout))
+    c[ToSDK.Commands.max_concurrent] = int(commands_o.get(keys.max_concurrent, defaults.max_concurrent))
+    c[ToSDK.Commands.max_output] = int(commands_o.get(keys.max_output, defaults.max_output))
+    c[ToSDK.Commands.progress_interval] = _optional_float(commands_o.get(keys.progress_interval))
+
+    scripts = {}
+    for script_name, script_o in commands_o.get(keys.scripts, {}).items():
+        scripts[script_name] = {
+            ToSDK.Commands.timeout: float(script_o.get(keys.timeout, c[ToSDK.Commands.timeout])),
+            ToSDK.Commands.max_concurrent: int(script_o.get(keys.max_concurrent, c[ToSDK.Commands.max_concurrent])),
+            ToSDK.Commands.max_output: int(script_o.get(keys.max_output, c[ToSDK.Commands.max_output])),
+            ToSDK.Commands.progress_interval: _optional_float(script_o.get(keys.progress_interval, c[ToSDK.Commands.progress_interval]))
+        }
+    c[ToSDK.Commands.scripts] = scripts
+    for limits in [c] + list(scripts.values()):
+        if limits[ToSDK.Commands.max_output] < 2:
+            raise ValueError("commands max_output must be at least 2 bytes")
+        if limits[ToSDK.Commands.progress_interval] is not None and limits[ToSDK.Commands.progress_interval] <= 0:
+            raise ValueError("commands progress_interval must be positive")
+
+    handlers = []
+    handler_keys = FromJSON.Device.Commands.Handlers
+    for handler_o in commands_o.get(keys.handlers, []):
+        h = {}
+        h[ToSDK.Handlers.name] = get(handler_o, handler_keys.name)
+        h[ToSDK.Handlers.type] = get(handler_o, handler_keys.type)
+        h[ToSDK.Handlers.path] = get(handler_o, handler_keys.path)
+        h[ToSDK.Handlers.values] = get(handler_o, handler_keys.values)
+
+        path = h[ToSDK.Handlers.path]
+        if os.path.isdir(os.path.dirname(path)) is False:
+            raise FileNotFoundError("PATH: " + path + " Does not exist, check command handler path")
+        handlers.append(h)
+    c[ToSDK.Commands.handlers] = handlers
+    return c
+
 def parse_auth(j: json):
     """Parse auth object from credential json, generate format needed for SDK"""
     temp: dict[str] = {}
@@ -210,6 +791,25 @@ def parse_auth(j: json):
 
     return temp
 
+def get_referenced_paths(c: dict) -> list:
+    """Every file or folder path the parsed config was validated against"""
+    paths = [c[ToSDK.Credentials.commands_list_path]]
+    for attribute in c[ToSDK.Credentials.attributes]:
+        if attribute[ToSDK.Attributes.private_data_type] != FromJSON.Device.Attributes.System.type_name:
+            paths.append(attribute[ToSDK.Attributes.private_data])
+    certificate = c[ToSDK.Credentials.sdk_options].get(ToSDK.SdkOptions.Certificate.name, {})
+    paths.extend(certificate.values())
+    for handler in c[ToSDK.Credentials.commands][ToSDK.Commands.handlers]:
+        paths.append(handler[ToSDK.Handlers.path])
+    if (ota := c[ToSDK.Credentials.ota]) is not None:
+        paths.append(ota[ToSDK.Ota.download_dir])
+        if ota[ToSDK.Ota.install_command] is not None:
+            paths.append(ota[ToSDK.Ota.install_command])
+    if (twin := c[ToSDK.Credentials.twin]) is not None and twin[ToSDK.Twin.cache] is not None:
+        # only its folder is validated, and the file itself is replaced on every twin change
+        paths.append(os.path.dirname(os.path.abspath(twin[ToSDK.Twin.cache])))
+    return paths
+
 def get_json_from_file(path):
     """Load Json from file and return json object"""
     j: json = None
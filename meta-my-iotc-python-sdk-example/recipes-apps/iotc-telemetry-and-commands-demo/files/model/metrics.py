@@ -0,0 +1,264 @@
+'''
+    Hot path timings in Prometheus text format
+
+    Fixed bucket histograms and counters, exported to a node-exporter textfile and/or
+    served over a local Unix socket. Nothing is timed unless metrics are enabled in
+    the device json: readers and converters are only wrapped in timers when they are,
+    so a device without metrics runs exactly the code it did before.
+    Updates aren't locked, a rare lost increment between threads is accepted.
+'''
+import os
+import stat
+import time
+import socket
+import threading
+from bisect import bisect_left
+
+# seconds, from a cached file read up to a slow SendData
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def device_path(path: str, unique_id: str) -> str:
+    '''path with the device's uniqueId before its extension, so devices sharing a config template don't share files'''
+    if path is None:
+        return None
+    root, extension = os.path.splitext(path)
+    return root + "." + str(unique_id).replace(os.sep, "_") + extension
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(name + '="' + _escape(value) + '"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # counts[i] is observations <= buckets[i] and > buckets[i - 1], the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels, lines):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(name + "_bucket" + _labels(labels + [("le", "{:g}".format(bound))]) + " " + str(cumulative))
+        lines.append(name + "_bucket" + _labels(labels + [("le", "+Inf")]) + " " + str(self.count))
+        lines.append(name + "_sum" + _labels(labels) + " " + repr(self.sum))
+        lines.append(name + "_count" + _labels(labels) + " " + str(self.count))
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self, name, labels, lines):
+        lines.append(name + "_total" + _labels(labels) + " " + str(self.value))
+
+
+class Family:
+    '''One metric name, with a child per value of its label (or a single child if it has none)'''
+    def __init__(self, kind: str, name: str, help_text: str, label: str = None, buckets=None):
+        self.kind = kind
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self.children: dict = {}
+
+    def labels(self, value=None):
+        child = self.children.get(value)
+        if child is None:
+            child = Histogram(self.buckets) if self.kind == "histogram" else Counter()
+            self.children[value] = child
+        return child
+
+    def render(self, const_labels: list, lines: list):
+        name = self.name if self.kind == "histogram" else self.name + "_total"
+        lines.append("# HELP " + name + " " + self.help_text)
+        lines.append("# TYPE " + name + " " + self.kind)
+        for value, child in list(self.children.items()):
+            labels = const_labels + ([(self.label, value)] if self.label is not None else [])
+            child.render(self.name, labels, lines)
+
+
+class Gauge:
+    '''Reads its value from fn when rendered, for state other classes already count'''
+    def __init__(self, name: str, help_text: str, fn, kind: str = "gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+        self.kind = kind
+
+    def render(self, const_labels: list, lines: list):
+        lines.append("# HELP " + self.name + " " + self.help_text)
+        lines.append("# TYPE " + self.name + " " + self.kind)
+        lines.append(self.name + _labels(const_labels) + " " + repr(self.fn()))
+
+
+class Registry:
+    def __init__(self, const_labels: dict = None):
+        self.const_labels = list(const_labels.items()) if const_labels else []
+        self.metrics = []
+
+    def histogram(self, name, help_text, label=None, buckets=DEFAULT_BUCKETS) -> Family:
+        family = Family("histogram", name, help_text, label, tuple(buckets))
+        self.metrics.append(family)
+        return family
+
+    def counter(self, name, help_text, label=None) -> Family:
+        family = Family("counter", name, help_text, label)
+        self.metrics.append(family)
+        return family
+
+    def gauge(self, name, help_text, fn, kind="gauge"):
+        self.metrics.append(Gauge(name, help_text, fn, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            metric.render(self.const_labels, lines)
+        return "\n".join(lines) + "\n"
+
+
+def timed(fn, histogram: Histogram):
+    '''fn wrapped to observe its run time in histogram'''
+    clock = time.perf_counter
+    observe = histogram.observe
+
+    def call(*args):
+        start = clock()
+        try:
+            return fn(*args)
+        finally:
+            observe(clock() - start)
+    return call
+
+
+class DeviceMetrics:
+    '''The metrics a device records, see ConnectedDevice.enable_metrics'''
+    def __init__(self, unique_id, buckets=DEFAULT_BUCKETS):
+        self.registry = Registry({"device": unique_id})
+        r = self.registry
+        self.attribute_read = r.histogram("iotc_attribute_read_seconds", "Time to read an attribute's raw value", "attribute", buckets)
+        self.attribute_convert = r.histogram("iotc_attribute_convert_seconds", "Time to convert an attribute to its cloud data type", "attribute", buckets)
+        self.payload_build = r.histogram("iotc_payload_build_seconds", "Time to read, filter and batch one message cycle, SendData excluded", None, buckets).labels()
+        self.send_data = r.histogram("iotc_send_data_seconds", "SdkClient.SendData latency", None, buckets).labels()
+        self.send_errors = r.counter("iotc_send_data_errors", "SendData calls that raised").labels()
+        self.command_wait = r.histogram("iotc_command_queue_wait_seconds", "Time a cloud command waited for a worker", "command", buckets)
+        self.command_run = r.histogram("iotc_command_run_seconds", "Time a cloud command ran for, ack included", "command", buckets)
+
+    def timed_command(self, command: str, fn):
+        '''fn wrapped to observe how long it queued from now and then ran'''
+        submitted = time.perf_counter()
+        wait = self.command_wait.labels(command)
+        run = self.command_run.labels(command)
+
+        def call():
+            start = time.perf_counter()
+            wait.observe(start - submitted)
+            try:
+                return fn()
+            finally:
+                run.observe(time.perf_counter() - start)
+        return call
+
+
+def _scrape_handler():
+    '''HTTP handler class serving server.registry, http.server is only imported when a socket is configured'''
+    from http.server import BaseHTTPRequestHandler
+
+    class ScrapeHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = self.server.registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def address_string(self):
+            # Unix socket peers have no address
+            return "unix"
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScrapeHandler
+
+
+class MetricsExporter:
+    '''Writes registry to textfile every interval seconds and/or answers HTTP GETs on the Unix socket socket_path'''
+    def __init__(self, registry: Registry, textfile: str = None, socket_path: str = None, interval: float = 15):
+        self.registry = registry
+        self.textfile = textfile
+        self.socket_path = socket_path
+        self.interval = interval
+        self.server = None
+
+    def start(self):
+        if self.textfile is not None:
+            thread = threading.Thread(target=self._textfile_loop, name="metrics-textfile", daemon=True)
+            thread.start()
+        if self.socket_path is not None and self._clear_socket_path():
+            import socketserver
+            self.server = socketserver.UnixStreamServer(self.socket_path, _scrape_handler())
+            self.server.registry = self.registry
+            thread = threading.Thread(target=self.server.serve_forever, name="metrics-socket", daemon=True)
+            thread.start()
+
+    def _clear_socket_path(self) -> bool:
+        '''Removes a socket left over from a previous run, False if socket_path is a file or still served'''
+        try:
+            mode = os.lstat(self.socket_path).st_mode
+        except FileNotFoundError:
+            return True
+        if not stat.S_ISSOCK(mode):
+            print("Not serving metrics:", self.socket_path, "exists and isn't a socket")
+            return False
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.socket_path)
+                print("Not serving metrics:", self.socket_path, "is in use by another process or device")
+                return False
+            except ConnectionRefusedError:
+                # nobody listening, bind would fail on the stale file
+                pass
+        os.remove(self.socket_path)
+        return True
+
+    def write_textfile(self):
+        # node-exporter must never see a half written file
+        temp_path = self.textfile + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(self.registry.render())
+            os.replace(temp_path, self.textfile)
+        except OSError as exception:
+            print("Could not write metrics to", self.textfile, exception)
+
+    def _textfile_loop(self):
+        while True:
+            self.write_textfile()
+            time.sleep(self.interval)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,216 @@
+'''
+    Firmware (OTA) downloads
+
+    The image is streamed to <download_dir>/<fileName>.part in chunk_size reads into one
+    reused buffer, and hashed as it is written, so memory use doesn't depend on the image
+    size. A dropped connection is resumed with an HTTP Range request from the bytes
+    already on disk, also after a restart. If-Range is sent with the ETag (or Last-Modified)
+    seen first, so a file that changed on the server is downloaded again from the start.
+    The finished file is renamed to <fileName>.
+'''
+import os
+import json
+import time
+import hashlib
+import http.client
+import urllib.error
+import urllib.request
+
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".json"
+
+
+class OtaError(Exception):
+    '''A download that failed for good, retrying won't help'''
+    pass
+
+
+class OtaStats:
+    def __init__(self):
+        self.downloads = 0
+        self.resumed = 0
+        self.failed = 0
+        self.bytes_downloaded = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "downloads": self.downloads,
+            "resumed": self.resumed,
+            "failed": self.failed,
+            "bytes_downloaded": self.bytes_downloaded,
+        }
+
+
+class _Download:
+    '''One file being downloaded: its partial file, hash so far and size'''
+    def __init__(self, url: str, path: str, hash_algorithm: str):
+        self.url = url
+        self.part = path + PART_SUFFIX
+        self.state_path = self.part + STATE_SUFFIX
+        self.hash_algorithm = hash_algorithm
+        self.hasher = hashlib.new(hash_algorithm)
+        self.size = 0
+        self.total = None
+        # ETag or Last-Modified of the file the partial bytes came from
+        self.validator = None
+
+    def restart(self):
+        with open(self.part, "wb"):
+            pass
+        self.hasher = hashlib.new(self.hash_algorithm)
+        self.size = 0
+        self.total = None
+        self.validator = None
+
+    def save_state(self):
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump({"url": self.url, "validator": self.validator}, f)
+
+    def remove(self):
+        for path in (self.part, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class OtaDownloader:
+    def __init__(self, download_dir: str, chunk_size: int = 65536, retries: int = 5, retry_delay: float = 2.0,
+                 timeout: float = 30.0, progress_interval: float = 10.0, hash_algorithm: str = "sha256",
+                 clock=time.monotonic, sleep=time.sleep):
+        if chunk_size < 1 or retries < 0 or timeout <= 0:
+            raise ValueError("chunk_size must be positive, retries not negative and timeout positive")
+        hashlib.new(hash_algorithm)
+        self.download_dir = download_dir
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.progress_interval = progress_interval
+        self.hash_algorithm = hash_algorithm
+        self.clock = clock
+        self.sleep = sleep
+        self.stats = OtaStats()
+
+    def download(self, url: str, file_name: str, expected_hash: str = None, on_progress=None):
+        '''
+            Downloads url to download_dir, returns (path, hex digest). on_progress(bytes, total or None)
+            is called every progress_interval seconds. Raises OtaError if it fails or the hash doesn't match.
+        '''
+        path = os.path.join(self.download_dir, os.path.basename(file_name))
+        download = _Download(url, path, self.hash_algorithm)
+        self._resume(download)
+
+        attempts = 0
+        while True:
+            try:
+                self._fetch(download, on_progress)
+                break
+            except OtaError:
+                # the server refused it, nothing to resume
+                download.remove()
+                self.stats.failed += 1
+                raise
+            except (OSError, http.client.HTTPException) as exception:
+                attempts += 1
+                if attempts > self.retries:
+                    self.stats.failed += 1
+                    raise OtaError(f"Download of {file_name} failed after {attempts} attempts: {exception}") from exception
+                print("Download of", file_name, "interrupted at", download.size, "bytes, resuming:", exception)
+                self.stats.resumed += 1
+                self.sleep(self.retry_delay * attempts)
+
+        digest = download.hasher.hexdigest()
+        if expected_hash is not None and digest != expected_hash.lower():
+            download.remove()
+            self.stats.failed += 1
+            raise OtaError(f"{file_name} {self.hash_algorithm} is {digest}, expected {expected_hash}")
+        os.replace(download.part, path)
+        os.remove(download.state_path)
+        self.stats.downloads += 1
+        return path, digest
+
+    def _resume(self, download: _Download):
+        '''Picks up the partial file of an earlier attempt at the same url, hashing what it holds'''
+        state = None
+        try:
+            with open(download.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if state is None or state.get("url") != download.url or not os.path.exists(download.part):
+            download.restart()
+            download.save_state()
+            return
+
+        download.validator = state.get("validator")
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        with open(download.part, "rb") as f:
+            while (n := f.readinto(buffer)):
+                download.hasher.update(view[:n])
+                download.size += n
+        if download.size:
+            print("Resuming download of", download.url, "from", download.size, "bytes")
+            self.stats.resumed += 1
+
+    def _open(self, download: _Download):
+        '''The response to the next request for the file, None if the partial file already holds all of it'''
+        request = urllib.request.Request(download.url)
+        if download.size:
+            request.add_header("Range", f"bytes={download.size}-")
+            if download.validator is not None:
+                request.add_header("If-Range", download.validator)
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as error:
+            error.close()
+            content_range = error.headers.get("Content-Range") if error.headers is not None else None
+            if error.code == 416 and download.size and content_range == f"bytes */{download.size}":
+                # complete already, e.g. the demo stopped between the last write and the rename
+                download.total = download.size
+                return None
+            if error.code == 416 and download.size:
+                # the partial file is no longer a prefix of what the server has
+                download.restart()
+                download.save_state()
+                return self._open(download)
+            if 400 <= error.code < 500:
+                raise OtaError(f"{download.url} answered {error.code} {error.reason}") from error
+            raise
+
+    def _fetch(self, download: _Download, on_progress):
+        response = self._open(download)
+        if response is None:
+            return
+        with response:
+            content_range = response.headers.get("Content-Range")
+            if download.size and (response.status != 206 or content_range is None
+                                  or not content_range.startswith(f"bytes {download.size}-")):
+                # whole file sent, the server ignored the range or the file changed
+                download.restart()
+            if content_range is not None and "/" in content_range and not content_range.endswith("/*"):
+                download.total = int(content_range.rsplit("/", 1)[1])
+            elif (length := response.headers.get("Content-Length")) is not None:
+                download.total = download.size + int(length)
+
+            validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+            if validator != download.validator:
+                download.validator = validator
+                download.save_state()
+
+            buffer = bytearray(self.chunk_size)
+            view = memoryview(buffer)
+            next_progress = self.clock() + self.progress_interval
+            with open(download.part, "ab") as f:
+                while (n := response.readinto(buffer)):
+                    f.write(view[:n])
+                    download.hasher.update(view[:n])
+                    download.size += n
+                    self.stats.bytes_downloaded += n
+                    if on_progress is not None and self.clock() >= next_progress:
+                        on_progress(download.size, download.total)
+                        next_progress += self.progress_interval
+                f.flush()
+                os.fsync(f.fileno())
+
+        if download.total is not None and download.size < download.total:
+            raise http.client.IncompleteRead(b"", download.total - download.size)
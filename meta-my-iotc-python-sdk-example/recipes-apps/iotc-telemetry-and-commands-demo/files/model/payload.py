@@ -0,0 +1,31 @@
+'''
+    D2C payload timestamps
+
+    Timestamps come from a formatter that only calls strftime when the second changes.
+    Messages themselves are built new each cycle, the SDK, the spool and the child
+    collector keep them after they are returned.
+'''
+import time
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+
+
+class TimestampCache:
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.second = None
+        self.text = None
+
+    def now(self) -> str:
+        '''UTC time of the current second in the SDK's format'''
+        second = int(self.clock())
+        if second != self.second:
+            # text first, a thread seeing the new second must see its text
+            self.text = time.strftime(TIME_FORMAT, time.gmtime(second))
+            self.second = second
+        return self.text
+
+
+# shared by all devices so a gateway and its children format each second once
+timestamps = TimestampCache()
+
@@ -0,0 +1,61 @@
+'''
+    Precompiled attribute reads
+
+    Built from the cloud attribute metadata whenever it arrives, so a poll is a
+    straight walk over (reader, converter) pairs with no lookups or type dispatch.
+'''
+from model.metrics import timed
+
+
+class ReadPlan:
+    def __init__(self):
+        # name -> (reader, converter), readers return the raw value or None if unavailable
+        self.entries: dict = {}
+        # name -> (record, index, converter) for fields decoded from a shared record read
+        self.record_fields: dict = {}
+
+    def add(self, name, reader, converter):
+        self.entries[name] = (reader, converter)
+
+    def add_record_field(self, name, record, index, converter):
+        self.record_fields[name] = (record, index, converter)
+
+    def execute(self, names=None) -> dict:
+        '''Reads and converts the named attributes, or all of them if names is None'''
+        if names is None:
+            names = list(self.entries) + list(self.record_fields)
+        data_obj = {}
+        # each record is read once per execute, however many of its fields are wanted
+        records = {}
+        for name in names:
+            entry = self.entries.get(name)
+            if entry is not None:
+                reader, converter = entry
+                val = reader()
+                data_obj[name] = None if val is None else converter(val)
+                continue
+
+            field = self.record_fields.get(name)
+            if field is not None:
+                record, index, converter = field
+                if record not in records:
+                    records[record] = record.read()
+                values = records[record]
+                data_obj[name] = None if values is None else converter(values[index])
+        return data_obj
+
+    def convert(self, name, val):
+        '''Converts a raw value read earlier, e.g. from the spool, KeyError if name isn't in the plan'''
+        entry = self.entries.get(name)
+        converter = entry[1] if entry is not None else self.record_fields[name][2]
+        return None if val is None else converter(val)
+
+    def instrument(self, read_seconds, convert_seconds):
+        '''Wraps every reader and converter in a timer, see model.metrics. Uninstrumented plans pay nothing.'''
+        for name, (reader, converter) in self.entries.items():
+            self.entries[name] = (timed(reader, read_seconds.labels(name)), timed(converter, convert_seconds.labels(name)))
+        for name, (record, index, converter) in self.record_fields.items():
+            self.record_fields[name] = (record, index, timed(converter, convert_seconds.labels(name)))
+
+    def __len__(self):
+        return len(self.entries) + len(self.record_fields)
@@ -0,0 +1,165 @@
+'''
+    Packed binary records
+
+    A record is one file (or shared memory region) holding many fields at fixed
+    offsets. The field layout from the device json is compiled into struct.Struct
+    objects once, then every field is decoded from a single read of the record,
+    or straight out of an mmap for large regions.
+'''
+import os
+import mmap
+import struct
+from model.enums import Enums as E
+from model.file_reader import PSEUDO_FS_PREFIXES
+
+FIELD_TYPES = {
+    "i8": "b", "u8": "B",
+    "i16": "h", "u16": "H",
+    "i32": "i", "u32": "I",
+    "i64": "q", "u64": "Q",
+    "f32": "f", "f64": "d",
+    "bool": "?",
+}
+
+BYTE_ORDERS = {
+    "little": "<",
+    "big": ">",
+}
+
+
+def _to_bit(val):
+    return 1 if val else 0
+
+
+# cloud data type -> converter for already decoded field values
+CONVERTERS: dict = {
+    E.SendDataTypes.INT: int,
+    E.SendDataTypes.LONG: int,
+    E.SendDataTypes.FLOAT: float,
+    E.SendDataTypes.STRING: str,
+    E.SendDataTypes.Boolean: bool,
+    E.SendDataTypes.BIT: _to_bit,
+}
+
+
+class RecordField:
+    '''One field of a record, used like a DynAttr by JsonDevice'''
+    read_type = E.ReadTypes.record
+
+    def __init__(self, name, record, index, sample_interval=None, report_interval=None):
+        self.name = name
+        self.record = record
+        self.index = index
+        self.sample_interval = sample_interval
+        self.report_interval = report_interval
+
+    def get_converter(self, to_type):
+        return CONVERTERS.get(to_type)
+
+    def add_to_plan(self, plan, converter):
+        plan.add_record_field(self.name, self.record, self.index, converter)
+
+
+def compile_layout(fields: list) -> list:
+    '''
+        Returns [(struct.Struct, offset)] decoding fields in the given order.
+        Each run of same endianness, ascending, non overlapping fields is packed into one Struct.
+    '''
+    layout = []
+    current = None
+    for field in fields:
+        type_name, offset, endianness = field["type"], field["offset"], field["endianness"]
+        if type_name not in FIELD_TYPES:
+            raise ValueError("Unknown record field type: " + str(type_name))
+        if endianness not in BYTE_ORDERS:
+            raise ValueError("Unknown record field endianness: " + str(endianness))
+        if offset < 0:
+            raise ValueError("Record field offset must not be negative")
+
+        order = BYTE_ORDERS[endianness]
+        if current is None or current["order"] != order or offset < current["end"]:
+            current = {"order": order, "start": offset, "end": offset, "format": ""}
+            layout.append(current)
+        if offset > current["end"]:
+            current["format"] += str(offset - current["end"]) + "x"
+        current["format"] += FIELD_TYPES[type_name]
+        current["end"] = offset + struct.calcsize(order + FIELD_TYPES[type_name])
+
+    return [(struct.Struct(part["order"] + part["format"]), part["start"]) for part in layout]
+
+
+class RecordSource:
+    def __init__(self, name, path, fields: list, reader, use_mmap: bool = False):
+        '''fields is a list of dicts with name, offset, type and endianness'''
+        self.name = name
+        self.path = path
+        self.reader = reader
+        self.use_mmap = use_mmap
+        # grouping by endianness and offset lets most records compile to a single Struct
+        fields = sorted(fields, key=lambda field: (field["endianness"], field["offset"]))
+        self.field_names = [field["name"] for field in fields]
+        self.layout = compile_layout(fields)
+        self.size = max(s.size + offset for s, offset in self.layout)
+        self.map = None
+        # kept open with the mapping to check the file's size and links before each read
+        self.fd = None
+        self.check_replaced = not path.startswith(PSEUDO_FS_PREFIXES)
+
+    def _mapped(self) -> mmap.mmap:
+        '''
+            The record's mapping, checked against the file's current size: reading a page past
+            the end of a file that was truncated raises SIGBUS, which kills the process.
+            A writer truncating between the check and the read can still cause it, writers
+            of mapped records should rewrite them in place or replace them by rename.
+            A record replaced by rename is mapped again, like model.file_reader reopens files.
+        '''
+        if self.map is not None:
+            stat = os.fstat(self.fd)
+            if self.check_replaced and stat.st_nlink == 0:
+                self.close()
+        if self.map is None:
+            fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+            try:
+                self.map = mmap.mmap(fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ)
+            except BaseException:
+                os.close(fd)
+                raise
+            self.fd = fd
+            stat = os.fstat(fd)
+        size = stat.st_size
+        if size < self.size:
+            raise ValueError(f"record is {size} bytes, shorter than its fields ({self.size} bytes)")
+        return self.map
+
+    def decode(self, buffer) -> tuple:
+        if len(self.layout) == 1:
+            s, offset = self.layout[0]
+            return s.unpack_from(buffer, offset)
+        values = ()
+        for s, offset in self.layout:
+            values += s.unpack_from(buffer, offset)
+        return values
+
+    def read(self):
+        '''All field values in field order, None if the record can't be read'''
+        try:
+            if self.use_mmap:
+                return self.decode(self._mapped())
+            return self.decode(self.reader.read(self.path, binary=True))
+        except FileNotFoundError:
+            print("File not found at", self.path)
+        except (OSError, ValueError, struct.error) as exception:
+            print("Could not read record", self.name, "at", self.path, exception)
+        self.close()
+        return None
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def make_fields(self, sample_interval=None, report_interval=None) -> list:
+        return [RecordField(name, self, index, sample_interval, report_interval) for index, name in enumerate(self.field_names)]
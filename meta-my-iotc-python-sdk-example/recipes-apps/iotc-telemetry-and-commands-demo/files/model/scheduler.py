@@ -0,0 +1,101 @@
+'''
+    Monotonic, drift-free interval scheduler
+
+    Each key is due at start + n * interval. Deadlines are advanced from the previous
+    deadline rather than from when the work finished, so the period does not drift,
+    and missed periods are skipped rather than replayed in a burst.
+'''
+import time
+import heapq
+
+# how long wait_due sleeps when nothing is scheduled, the demo's period before schedules
+IDLE_WAIT = 10.0
+
+
+class IntervalScheduler:
+    def __init__(self, coalesce_window: float = 0.05, clock=time.monotonic, sleep=time.sleep):
+        # Keys due within coalesce_window of the earliest one are returned together
+        self.coalesce_window = coalesce_window
+        self.clock = clock
+        self.sleep = sleep
+        self.heap: list = []
+        self.entries: dict = {}
+        self.counter = 0
+
+    def add(self, key, interval: float, start: float = None):
+        '''Schedules key every interval seconds, first due at start (default now)'''
+        if interval <= 0:
+            raise ValueError("interval must be positive, got " + str(interval))
+        self.remove(key)
+        if start is None:
+            start = self.clock()
+        # [due, tie breaker, key, interval, active]
+        entry = [start, self.counter, key, interval, True]
+        self.counter += 1
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            # Left in the heap and dropped when it reaches the top
+            entry[4] = False
+
+    def set_interval(self, key, interval: float):
+        '''Changes the interval of key, the next deadline counts from its last one'''
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        self.add(key, interval, entry[0] - entry[3] + interval)
+
+    def _discard_removed(self):
+        while self.heap and not self.heap[0][4]:
+            heapq.heappop(self.heap)
+
+    def next_due(self):
+        '''Monotonic time the next key is due, None if nothing is scheduled'''
+        self._discard_removed()
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def pop_due(self, now: float = None) -> list:
+        '''Returns all keys due by now and reschedules them'''
+        if now is None:
+            now = self.clock()
+        limit = now + self.coalesce_window
+
+        due_keys = []
+        while True:
+            self._discard_removed()
+            if not self.heap or self.heap[0][0] > limit:
+                break
+            entry = heapq.heappop(self.heap)
+            due, _, key, interval, _ = entry
+            due_keys.append(key)
+
+            next_due = due + interval
+            if next_due <= limit:
+                # Overran one or more periods, skip to the next deadline in the future
+                next_due += interval * ((limit - next_due) // interval + 1)
+            entry[0] = next_due
+            entry[1] = self.counter
+            self.counter += 1
+            heapq.heappush(self.heap, entry)
+
+        return due_keys
+
+    def wait_due(self, idle_wait: float = IDLE_WAIT) -> list:
+        '''Sleeps until the next deadline then returns the due keys, or idle_wait seconds if nothing is scheduled'''
+        due = self.next_due()
+        if due is None:
+            # still sleeps, so a caller looping on this doesn't spin
+            self.sleep(idle_wait)
+            return self.pop_due()
+        delay = due - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+        return self.pop_due()
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,105 @@
+'''
+    Adaptive report rate
+
+    Report intervals are stretched to the data frequency the cloud pushes (DATA_FRQ,
+    the shortest time between messages it accepts) and multiplied by a backoff factor.
+    When backpressure is enabled the factor doubles whenever the smoothed SendData
+    latency or the number of messages waiting in the spool crosses its threshold, and
+    comes back down by recover_step per healthy check. Checks are at most one per
+    check_interval, so a burst of slow sends only backs off once.
+'''
+import time
+
+# weight of the newest SendData latency in the moving average
+LATENCY_WEIGHT = 0.5
+
+
+class SendRateStats:
+    def __init__(self, rate):
+        self.rate = rate
+        self.backoffs = 0
+        self.recoveries = 0
+        self.data_frequency_changes = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "factor": self.rate.factor,
+            "data_frequency": self.rate.data_frequency,
+            "latency": self.rate.latency,
+            "backoffs": self.backoffs,
+            "recoveries": self.recoveries,
+            "data_frequency_changes": self.data_frequency_changes,
+        }
+
+
+class SendRate:
+    def __init__(self, latency_threshold: float = None, queue_threshold: int = None, max_backoff: float = 8.0,
+                 recover_step: float = 0.25, check_interval: float = 10.0, clock=time.monotonic):
+        '''Without thresholds only the cloud's data frequency applies'''
+        if max_backoff < 1 or recover_step <= 0 or check_interval <= 0:
+            raise ValueError("max_backoff must be at least 1, recover_step and check_interval positive")
+        self.latency_threshold = latency_threshold
+        self.queue_threshold = queue_threshold
+        self.max_backoff = max_backoff
+        self.recover_step = recover_step
+        self.check_interval = check_interval
+        self.clock = clock
+        # seconds, None till the cloud sends one
+        self.data_frequency = None
+        self.factor = 1.0
+        # moving average of SendData seconds, None till the first send
+        self.latency = None
+        self.last_check = clock()
+        self.stats = SendRateStats(self)
+
+    @property
+    def adaptive(self) -> bool:
+        return self.latency_threshold is not None or self.queue_threshold is not None
+
+    def interval(self, configured: float) -> float:
+        '''The interval to use for one configured in the json'''
+        if self.data_frequency is not None and self.data_frequency > configured:
+            configured = self.data_frequency
+        return configured * self.factor
+
+    def set_data_frequency(self, seconds) -> bool:
+        '''Returns True if intervals changed'''
+        seconds = float(seconds) if seconds else None
+        if seconds == self.data_frequency:
+            return False
+        print("Cloud data frequency is now", seconds, "seconds")
+        self.data_frequency = seconds
+        self.stats.data_frequency_changes += 1
+        return True
+
+    def observe_latency(self, seconds: float):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += (seconds - self.latency) * LATENCY_WEIGHT
+
+    def check(self, queue_depth: int = 0) -> bool:
+        '''Backs off or recovers if a check is due, returns True if intervals changed'''
+        now = self.clock()
+        if not self.adaptive or now - self.last_check < self.check_interval:
+            return False
+        self.last_check = now
+
+        slow = self.latency_threshold is not None and self.latency is not None and self.latency > self.latency_threshold
+        queued = self.queue_threshold is not None and queue_depth > self.queue_threshold
+        if slow or queued:
+            factor = min(self.factor * 2, self.max_backoff)
+            if factor == self.factor:
+                return False
+            print("Backing off the report rate to 1/{:g}, SendData latency {:.3f}s, {} queued".format(factor, self.latency or 0, queue_depth))
+            self.factor = factor
+            self.stats.backoffs += 1
+            return True
+
+        if self.factor > 1:
+            self.factor = max(1.0, self.factor - self.recover_step)
+            self.stats.recoveries += 1
+            if self.factor == 1:
+                print("Report rate recovered")
+            return True
+        return False
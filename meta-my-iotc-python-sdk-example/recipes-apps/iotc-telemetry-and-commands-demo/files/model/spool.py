@@ -0,0 +1,213 @@
+'''
+    Disk backed telemetry spool
+
+    A fixed size, memory mapped ring file of length prefixed records. Messages that
+    can't be sent (no cloud metadata yet, no client, SendData failing) are appended
+    and replayed oldest first once the device is back online. When the ring is full
+    the oldest records are dropped to make room and counted.
+
+    File layout: header, then max_bytes of ring. A record is its length (u32) and
+    flags (u8) followed by the payload. A record never wraps, the space left at the
+    end of the ring is skipped, marked with WRAP when there is room for a marker.
+'''
+import os
+import mmap
+import json
+import time
+import struct
+
+MAGIC = b"ISPL"
+VERSION = 1
+# magic, version, capacity, head, tail, used bytes, record count, dropped records
+HEADER = struct.Struct("<4sIQQQQQQ")
+RECORD = struct.Struct("<IB")
+WRAP = 0xFFFFFFFF
+
+
+class SpoolFlags:
+    # values still have to be converted with the cloud metadata before sending
+    RAW = 1
+
+
+class SpoolStats:
+    def __init__(self, spool):
+        self.spool = spool
+        self.appended = 0
+        self.replayed = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "records": self.spool.count,
+            "fill_level": self.spool.fill_level(),
+            "used_bytes": self.spool.used,
+            "capacity_bytes": self.spool.capacity,
+            "dropped": self.spool.dropped,
+            "appended": self.appended,
+            "replayed": self.replayed,
+        }
+
+
+class Spool:
+    def __init__(self, path: str, max_bytes: int = 1048576):
+        if max_bytes <= RECORD.size:
+            raise ValueError("max_bytes too small for a spool")
+        self.path = path
+        self.capacity = max_bytes
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+        try:
+            size = os.fstat(fd).st_size
+            if size != HEADER.size + max_bytes:
+                os.ftruncate(fd, HEADER.size + max_bytes)
+            self.map = mmap.mmap(fd, HEADER.size + max_bytes, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            # the mapping keeps its own reference to the file
+            os.close(fd)
+        self.stats = SpoolStats(self)
+        self._load_header(size)
+
+    def _load_header(self, size: int):
+        magic, version, capacity, head, tail, used, count, dropped = HEADER.unpack_from(self.map, 0)
+        if magic == MAGIC and version == VERSION and capacity == self.capacity and size == HEADER.size + capacity \
+                and head <= capacity and tail < capacity and used <= capacity:
+            # spools written before head wrapped like tail can hold head == capacity
+            head %= capacity
+            self.head, self.tail, self.used, self.count, self.dropped = head, tail, used, count, dropped
+            if count:
+                print("Spool", self.path, "holds", count, "records from a previous run")
+            return
+        if magic == MAGIC:
+            print("Spool", self.path, "has a different size or format, starting empty")
+        self.head = self.tail = self.used = self.count = self.dropped = 0
+        self._store_header()
+
+    def _store_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.capacity, self.head, self.tail, self.used, self.count, self.dropped)
+
+    def fill_level(self) -> float:
+        '''Used fraction of the ring, 0.0 to 1.0'''
+        return self.used / self.capacity
+
+    def _drop_oldest(self):
+        self._advance_head()
+        self.dropped += 1
+
+    def _advance_head(self):
+        '''Removes the record at head, skipping the unused end of the ring'''
+        while True:
+            room = self.capacity - self.head
+            if room < RECORD.size:
+                self.used -= room
+                self.head = 0
+                continue
+            length, _ = RECORD.unpack_from(self.map, HEADER.size + self.head)
+            if length == WRAP:
+                self.used -= room
+                self.head = 0
+                continue
+            size = RECORD.size + length
+            # like tail, head wraps when the record ends exactly at the end of the ring
+            self.head = (self.head + size) % self.capacity
+            self.used -= size
+            self.count -= 1
+            if self.count == 0:
+                # empty, start over at the beginning so records rarely wrap
+                self.head = self.tail = self.used = 0
+            return
+
+    def append(self, data, flags: int = 0) -> bool:
+        '''Spools a json serializable message, dropping the oldest records if full'''
+        payload = json.dumps(data, separators=(',', ':')).encode("utf-8")
+        size = RECORD.size + len(payload)
+        if size > self.capacity:
+            self.dropped += 1
+            self._store_header()
+            return False
+
+        while True:
+            # bytes skipped at the end of the ring when the record doesn't fit before it
+            skip = self.capacity - self.tail if self.tail + size > self.capacity else 0
+            if self.capacity - self.used >= skip + size:
+                break
+            self._drop_oldest()
+
+        if skip:
+            if skip >= RECORD.size:
+                RECORD.pack_into(self.map, HEADER.size + self.tail, WRAP, 0)
+            self.used += skip
+            self.tail = 0
+
+        offset = HEADER.size + self.tail
+        RECORD.pack_into(self.map, offset, len(payload), flags)
+        self.map[offset + RECORD.size:offset + size] = payload
+        self.tail = (self.tail + size) % self.capacity
+        self.used += size
+        self.count += 1
+        self.stats.appended += 1
+        # header last, a crash mid-write loses the new record, not the ring
+        self._store_header()
+        return True
+
+    def peek(self, max_records: int) -> list:
+        '''Up to max_records (flags, message) pairs, oldest first, without removing them'''
+        records = []
+        head = self.head
+        for _ in range(min(max_records, self.count)):
+            while True:
+                room = self.capacity - head
+                if room >= RECORD.size:
+                    length, flags = RECORD.unpack_from(self.map, HEADER.size + head)
+                    if length != WRAP:
+                        break
+                head = 0
+            start = HEADER.size + head + RECORD.size
+            records.append((flags, json.loads(self.map[start:start + length])))
+            head += RECORD.size + length
+        return records
+
+    def consume(self, count: int):
+        '''Removes the count oldest records, after they were sent'''
+        for _ in range(min(count, self.count)):
+            self._advance_head()
+        self.stats.replayed += count
+        self._store_header()
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+
+    def __len__(self):
+        return self.count
+
+
+class SpoolReplayer:
+    '''Token bucket over a Spool, at most rate records per second in batches of up to batch'''
+    def __init__(self, spool: Spool, rate: float, batch: int, clock=time.monotonic):
+        self.spool = spool
+        self.rate = rate
+        self.batch = batch
+        self.clock = clock
+        self.tokens = float(batch)
+        self.last = clock()
+
+    def due(self) -> int:
+        '''How many records may be replayed now'''
+        now = self.clock()
+        self.tokens = min(float(self.batch), self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        return min(int(self.tokens), len(self.spool))
+
+    def replay(self, send) -> int:
+        '''
+            Calls send(records) with the oldest due (flags, message) records. Records are removed
+            only if send returns without raising, so a failed replay is retried later in order.
+        '''
+        count = self.due()
+        if count == 0:
+            return 0
+        records = self.spool.peek(count)
+        send(records)
+        self.spool.consume(len(records))
+        self.tokens -= len(records)
+        return len(records)
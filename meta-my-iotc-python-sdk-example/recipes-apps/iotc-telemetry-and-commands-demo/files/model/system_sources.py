@@ -0,0 +1,247 @@
+'''
+    Built-in system metric attributes
+
+    Attributes with private_data_type "system" read /proc and /sys directly instead of
+    a file written by a script. private_data names the value:
+
+        memory:<total_kb|free_kb|available_kb|used_kb|used_percent>
+        cpu:<usage_percent|load1|load5|load15>
+        user_memory:<user name or uid>          % of RAM resident in the user's processes
+        thermal:<zone number or type>            degrees C
+        net:<interface>:<counter>[_per_s]        e.g. net:eth0:rx_bytes_per_s
+
+    Files are kept open in a PersistentReader and each is parsed at most once per
+    cycle however many attributes use it. Rates (cpu usage, *_per_s) are the change
+    since the attribute's previous sample.
+'''
+import os
+import pwd
+import time
+from model.enums import Enums as E
+from model.file_reader import PersistentReader
+
+PROC_MEMINFO = "/proc/meminfo"
+PROC_STAT = "/proc/stat"
+PROC_LOADAVG = "/proc/loadavg"
+THERMAL_DIR = "/sys/class/thermal"
+NET_STATISTIC = "/sys/class/net/{}/statistics/{}"
+PAGE_KB = os.sysconf("SC_PAGE_SIZE") // 1024
+
+MEMORY_FIELDS = {
+    "total_kb": lambda m: m["MemTotal"],
+    "free_kb": lambda m: m["MemFree"],
+    "available_kb": lambda m: m["MemAvailable"],
+    "used_kb": lambda m: m["MemTotal"] - m["MemAvailable"],
+    "used_percent": lambda m: (m["MemTotal"] - m["MemAvailable"]) * 100 / m["MemTotal"],
+}
+LOAD_FIELDS = {"load1": 0, "load5": 1, "load15": 2}
+RATE_SUFFIX = "_per_s"
+
+
+def _to_int(val):
+    return int(round(val))
+
+
+# cloud data type -> converter, values are already numbers
+CONVERTERS: dict = {
+    E.SendDataTypes.INT: _to_int,
+    E.SendDataTypes.LONG: _to_int,
+    E.SendDataTypes.FLOAT: float,
+    E.SendDataTypes.STRING: str,
+}
+
+
+def check_spec(spec: str):
+    '''Raises ValueError if spec isn't a system attribute name, without touching the system'''
+    parts = spec.split(":") if isinstance(spec, str) else []
+    source = parts[0] if parts else None
+    if source == "memory" and len(parts) == 2 and parts[1] in MEMORY_FIELDS:
+        return
+    if source == "cpu" and len(parts) == 2 and (parts[1] == "usage_percent" or parts[1] in LOAD_FIELDS):
+        return
+    if source in ("user_memory", "thermal") and len(parts) == 2 and parts[1]:
+        return
+    if source == "net" and len(parts) == 3 and parts[1] and parts[2]:
+        return
+    raise ValueError("Unknown system attribute " + str(spec) + ", see model/system_sources.py")
+
+
+class SystemReader:
+    '''Parses /proc and /sys through cached descriptors, each file at most once per max_age seconds'''
+    def __init__(self, max_age: float = 0.05, clock=time.monotonic):
+        self.reader = PersistentReader()
+        self.max_age = max_age
+        self.clock = clock
+        # key -> (time, parsed value)
+        self.cache: dict = {}
+
+    def _cached(self, key, parse):
+        now = self.clock()
+        entry = self.cache.get(key)
+        if entry is not None and now - entry[0] < self.max_age:
+            return entry[1]
+        value = parse()
+        self.cache[key] = (now, value)
+        return value
+
+    def meminfo(self) -> dict:
+        '''/proc/meminfo in kB'''
+        def parse():
+            info = {}
+            for line in self.reader.read(PROC_MEMINFO).splitlines():
+                name, _, rest = line.partition(":")
+                info[name] = int(rest.split()[0])
+            # kernels before 3.14 have no MemAvailable
+            info.setdefault("MemAvailable", info["MemFree"] + info.get("Buffers", 0) + info.get("Cached", 0))
+            return info
+        return self._cached(PROC_MEMINFO, parse)
+
+    def cpu_times(self) -> tuple:
+        '''(busy, total) jiffies of all CPUs since boot'''
+        def parse():
+            stat = self.reader.read(PROC_STAT)
+            times = [int(t) for t in stat[:stat.index("\n")].split()[1:]]
+            # idle and iowait
+            idle = times[3] + (times[4] if len(times) > 4 else 0)
+            # guest time is already counted in user and nice
+            total = sum(times[:8])
+            return total - idle, total
+        return self._cached(PROC_STAT, parse)
+
+    def loadavg(self) -> list:
+        return self._cached(PROC_LOADAVG, lambda: [float(v) for v in self.reader.read(PROC_LOADAVG).split()[:3]])
+
+    def read_int(self, path: str) -> int:
+        return self._cached(path, lambda: int(self.reader.read(path)))
+
+    def user_rss_kb(self) -> dict:
+        '''uid -> resident kB of all its processes. Processes come and go so these files aren't kept open'''
+        def scan():
+            rss = {}
+            for pid in os.listdir("/proc"):
+                if not pid.isdigit():
+                    continue
+                try:
+                    uid = os.stat("/proc/" + pid).st_uid
+                    with open("/proc/" + pid + "/statm", "rb") as f:
+                        resident = int(f.read().split()[1])
+                except (OSError, IndexError, ValueError):
+                    # exited while we looked
+                    continue
+                rss[uid] = rss.get(uid, 0) + resident * PAGE_KB
+            return rss
+        return self._cached("user_rss", scan)
+
+    def close(self):
+        self.reader.close()
+
+
+def _thermal_path(zone: str) -> str:
+    if zone.isdigit():
+        return os.path.join(THERMAL_DIR, "thermal_zone" + zone, "temp")
+    for name in sorted(os.listdir(THERMAL_DIR)):
+        type_path = os.path.join(THERMAL_DIR, name, "type")
+        if name.startswith("thermal_zone") and os.path.isfile(type_path):
+            with open(type_path, encoding="utf-8") as f:
+                if f.read().strip() == zone:
+                    return os.path.join(THERMAL_DIR, name, "temp")
+    raise ValueError("No thermal zone of type " + zone)
+
+
+def _uid(user: str) -> int:
+    if user.isdigit():
+        return int(user)
+    try:
+        return pwd.getpwnam(user).pw_uid
+    except KeyError:
+        raise ValueError("Unknown user " + user) from None
+
+
+def _rate(read, clock=time.monotonic):
+    '''Per second change of the counter read() since the previous call, the first call counts from now'''
+    last = [read(), clock()]
+
+    def sample():
+        value, now = read(), clock()
+        delta = value - last[0]
+        if delta < 0:
+            # counter reset, e.g. the interface went down and up
+            delta = value
+        elapsed = now - last[1]
+        last[0], last[1] = value, now
+        return delta / elapsed if elapsed > 0 else 0.0
+    return sample
+
+
+def _cpu_usage(system: SystemReader):
+    last = [system.cpu_times()]
+
+    def sample():
+        busy, total = system.cpu_times()
+        prev_busy, prev_total = last[0]
+        last[0] = (busy, total)
+        if total == prev_total:
+            return 0.0
+        return (busy - prev_busy) * 100 / (total - prev_total)
+    return sample
+
+
+def make_sampler(spec: str, system: SystemReader):
+    '''Returns a function reading the value spec names, raises ValueError if it doesn't exist here'''
+    check_spec(spec)
+    parts = spec.split(":")
+    source = parts[0]
+    if source == "memory":
+        field = MEMORY_FIELDS[parts[1]]
+        return lambda: field(system.meminfo())
+
+    if source == "cpu":
+        if parts[1] == "usage_percent":
+            return _cpu_usage(system)
+        index = LOAD_FIELDS[parts[1]]
+        return lambda: system.loadavg()[index]
+
+    if source == "user_memory":
+        uid = _uid(parts[1])
+        return lambda: system.user_rss_kb().get(uid, 0) * 100 / system.meminfo()["MemTotal"]
+
+    if source == "thermal":
+        path = _thermal_path(parts[1])
+        return lambda: system.read_int(path) / 1000
+
+    # net
+    interface, counter = parts[1], parts[2]
+    rate = counter.endswith(RATE_SUFFIX)
+    if rate:
+        counter = counter[:-len(RATE_SUFFIX)]
+    path = NET_STATISTIC.format(interface, counter)
+    if not os.path.isfile(path):
+        raise ValueError("No counter " + counter + " for interface " + interface)
+    if rate:
+        return _rate(lambda: system.read_int(path))
+    return lambda: system.read_int(path)
+
+
+class SystemAttr:
+    '''A system metric, used like a DynAttr by JsonDevice'''
+    read_type = E.ReadTypes.system
+
+    def __init__(self, name, spec: str, system: SystemReader, sample_interval=None, report_interval=None):
+        self.name = name
+        self.path = spec
+        self.sample = make_sampler(spec, system)
+        self.sample_interval = sample_interval
+        self.report_interval = report_interval
+
+    def update_value(self):
+        try:
+            return self.sample()
+        except (OSError, ValueError, KeyError, IndexError) as exception:
+            print("Could not read", self.path, "for", self.name, exception)
+        return None
+
+    def get_converter(self, to_type):
+        return CONVERTERS.get(to_type)
+
+    def add_to_plan(self, plan, converter):
+        plan.add(self.name, self.update_value, converter)
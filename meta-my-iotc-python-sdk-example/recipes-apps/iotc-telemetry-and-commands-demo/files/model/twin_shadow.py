@@ -0,0 +1,242 @@
+'''
+    Local device twin shadow
+
+    TwinShadow holds the last known desired and reported properties. Twin messages are
+    applied in place: a full twin (desired and reported, the answer to GetAllTwins)
+    replaces the shadow, a delta (desired properties only) is merged into it, a null
+    value deleting its property. Deltas older than the shadow's $version are ignored,
+    a gap in versions asks for a resync. The shadow is saved to a json file after every
+    change, written to a temporary file and renamed so a crash never leaves half a file,
+    and loaded at start so desired properties are known before the cloud answers.
+
+    ReportedBatcher coalesces reported property updates: updates within flush_interval
+    seconds are merged per property and published once.
+'''
+import os
+import json
+import copy
+import threading
+
+VERSION_KEY = "$version"
+DESIRED_KEY = "desired"
+REPORTED_KEY = "reported"
+
+
+def _merge(target: dict, patch: dict):
+    '''Applies patch to target in place, None deletes'''
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            _merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+def _combine(target: dict, patch: dict):
+    '''Like _merge but keeps None, for updates still to be sent'''
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _combine(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+def _without_metadata(properties: dict) -> dict:
+    return {key: value for key, value in properties.items() if not key.startswith("$")}
+
+
+class TwinShadow:
+    def __init__(self, path: str = None):
+        '''path is the json file the shadow is kept in, None to keep it in memory only'''
+        self.path = path
+        self.desired: dict = {}
+        self.reported: dict = {}
+        # $version of the desired properties, None till a twin or delta with one is applied
+        self.version = None
+        self.lock = threading.Lock()
+        # property name -> callbacks, None for every property
+        self.subscribers: dict = {}
+        self.synced = False
+        if path is not None:
+            self.load()
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as exception:
+            print("Twin cache", self.path, "can't be read, waiting for the cloud:", exception)
+            return False
+        self.desired = saved.get(DESIRED_KEY, {})
+        self.reported = saved.get(REPORTED_KEY, {})
+        self.version = saved.get(VERSION_KEY)
+        return True
+
+    def save(self):
+        '''Replaces the cache file in one rename, called with the lock held'''
+        if self.path is None:
+            return
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({VERSION_KEY: self.version, DESIRED_KEY: self.desired, REPORTED_KEY: self.reported}, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except OSError as exception:
+            print("Could not save the twin to", self.path, exception)
+
+    def get(self, name: str, default=None):
+        '''A desired property'''
+        return self.desired.get(name, default)
+
+    def get_reported(self, name: str, default=None):
+        return self.reported.get(name, default)
+
+    def subscribe(self, name, callback):
+        '''callback(name, value) when desired property name changes, every property if name is None. value is None if deleted'''
+        with self.lock:
+            self.subscribers.setdefault(name, []).append(callback)
+
+    def unsubscribe(self, name, callback):
+        with self.lock:
+            callbacks = self.subscribers.get(name, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def apply(self, msg: dict) -> bool:
+        '''Applies a twin message from the cloud, returns False if it showed the shadow missed an update'''
+        if not isinstance(msg, dict) or not isinstance(msg.get(DESIRED_KEY), dict):
+            # envelope keys such as uniqueId must not become desired properties
+            print("Ignoring twin message without desired properties:", msg)
+            return True
+        if isinstance(msg.get(REPORTED_KEY), dict):
+            self.apply_full(msg[DESIRED_KEY], msg[REPORTED_KEY])
+            return True
+        return self.apply_delta(msg[DESIRED_KEY])
+
+    def apply_full(self, desired: dict, reported: dict):
+        with self.lock:
+            old = self.desired
+            self.desired = copy.deepcopy(_without_metadata(desired))
+            self.reported = copy.deepcopy(_without_metadata(reported))
+            self.version = desired.get(VERSION_KEY, self.version)
+            self.synced = True
+            changed = [name for name in old.keys() | self.desired.keys() if old.get(name) != self.desired.get(name)]
+            self.save()
+            notifications = self._notifications(changed)
+        self._notify(notifications)
+
+    def apply_delta(self, delta: dict) -> bool:
+        version = delta.get(VERSION_KEY)
+        with self.lock:
+            if version is not None and self.version is not None and version <= self.version:
+                # already applied, e.g. included in a full twin that arrived first
+                return True
+            in_sequence = version is None or self.version is None or version == self.version + 1
+            patch = _without_metadata(delta)
+            changed = []
+            for name, value in patch.items():
+                before = copy.deepcopy(self.desired.get(name))
+                _merge(self.desired, {name: value})
+                if self.desired.get(name) != before:
+                    changed.append(name)
+            if version is not None:
+                self.version = version
+            self.save()
+            notifications = self._notifications(changed)
+        self._notify(notifications)
+        return in_sequence
+
+    def set_reported(self, values: dict):
+        '''Records reported properties once they were published, saving the shadow once'''
+        if not values:
+            return
+        with self.lock:
+            _merge(self.reported, values)
+            self.save()
+
+    def _notifications(self, changed: list) -> list:
+        '''(callback, name, value) to call once the lock is released'''
+        notifications = []
+        for name in changed:
+            value = copy.deepcopy(self.desired.get(name))
+            for callback in self.subscribers.get(name, []) + self.subscribers.get(None, []):
+                notifications.append((callback, name, value))
+        return notifications
+
+    def _notify(self, notifications: list):
+        for callback, name, value in notifications:
+            try:
+                callback(name, value)
+            except Exception as exception:
+                print("Twin subscriber for", name, "raised", repr(exception))
+
+
+class ReportedBatcherStats:
+    def __init__(self):
+        self.updates = 0
+        self.published = 0
+
+    def as_dict(self) -> dict:
+        return {"updates": self.updates, "published": self.published}
+
+
+class ReportedBatcher:
+    def __init__(self, publish, flush_interval: float = 1.0, on_flushed=None):
+        '''
+            publish(name, value) sends one reported property, e.g. SdkClient.UpdateTwin.
+            on_flushed(values) is called once per flush with the properties that were sent.
+        '''
+        if flush_interval < 0:
+            raise ValueError("flush_interval must not be negative")
+        self.publish = publish
+        self.on_flushed = on_flushed
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending: dict = {}
+        self.timer = None
+        self.stats = ReportedBatcherStats()
+
+    def update(self, name: str, value):
+        '''Queues a reported property, objects updated twice before a flush are merged'''
+        with self.lock:
+            self.stats.updates += 1
+            _combine(self.pending, {name: value})
+            self._schedule()
+
+    def _schedule(self):
+        if self.timer is None:
+            self.timer = threading.Timer(self.flush_interval, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        failed = {}
+        published = {}
+        for name, value in pending.items():
+            try:
+                self.publish(name, value)
+                self.stats.published += 1
+                published[name] = value
+            except Exception as exception:
+                print("Reported property", name, "could not be sent, retrying:", exception)
+                failed[name] = value
+        if published and self.on_flushed is not None:
+            self.on_flushed(published)
+        if failed:
+            with self.lock:
+                # updates queued since go on top of the ones that failed
+                _combine(failed, self.pending)
+                self.pending = failed
+                self._schedule()
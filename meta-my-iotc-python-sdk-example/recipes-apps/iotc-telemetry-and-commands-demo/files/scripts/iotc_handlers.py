@@ -0,0 +1,27 @@
+'''
+    Example in-process command handlers
+
+    This module is imported once at startup instead of being run as a script.
+    Each handler receives the command's arguments and returns (success, message),
+    commands handled here don't fork a shell so they respond much faster.
+'''
+
+LED_PATH = "/tmp/fake-led"
+
+
+def control_led(args: list):
+    '''Same as control_led.sh without starting bash'''
+    if len(args) != 1:
+        return False, "Usage: control_led <0 or 1>"
+
+    value = args[0]
+    if value not in ["0", "1"]:
+        return False, "Error: Input must be either 0 or 1."
+
+    with open(LED_PATH, "w", encoding="utf-8") as f:
+        f.write(value + "\n")
+    return True, f"Value '{value}' written to '{LED_PATH}' successfully."
+
+
+def register(registry):
+    registry.add("control_led", control_led)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+'''
+    Import time of the model package, guards against startup regressions
+
+    Imports each model module in a fresh `python -X importtime` interpreter, reports
+    the cumulative import time and fails if the SDK, paho-mqtt or ntplib get loaded
+    or if --max-ms is given and exceeded.
+    Run from the files directory: python3 tools/bench_import.py [--max-ms 50]
+'''
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+FILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MODULES = [
+    "model.enums",
+    "model.json_parser",
+    "model.device_model",
+    "model.json_device",
+]
+
+# Only ConnectedDevice.connect() may import these
+FORBIDDEN_PREFIXES = ("iotconnect", "paho", "ntplib")
+
+# import time: self [us] | cumulative | imported package
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+RUNS = 5
+
+
+def import_profile(module: str) -> dict:
+    '''Cumulative microseconds per module imported by `import module` in a fresh interpreter'''
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=FILES_DIR, check=True, capture_output=True, text=True)
+    profile = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            profile[match.group(4)] = int(match.group(2))
+    return profile
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if any module takes longer to import")
+    args = parser.parse_args(argv[1:])
+
+    results = []
+    failed = False
+    for module in MODULES:
+        # best of a few runs, the first may be skewed by cold caches
+        profiles = [import_profile(module) for _ in range(RUNS)]
+        cumulative_ms = min(profile[module] for profile in profiles) / 1000
+        forbidden = sorted(name for name in profiles[0] if name.startswith(FORBIDDEN_PREFIXES))
+
+        results.append({"module": module, "cumulative_ms": cumulative_ms, "forbidden_imports": forbidden})
+        if forbidden or (args.max_ms is not None and cumulative_ms > args.max_ms):
+            failed = True
+
+    print(json.dumps(results, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+'''
+    Time and allocations per send_device_states cycle for a gateway with 500 children
+
+    Compares the cached timestamp against calling datetime.utcnow().strftime() per device.
+    Run from the files directory: python3 tools/bench_payload.py
+'''
+import os
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from model.device_model import GenericDevice, Gateway
+
+CHILDREN = 500
+CYCLES = 200
+
+
+class Child(GenericDevice):
+    def __init__(self, unique_id):
+        super().__init__(unique_id)
+        self.state = {"temperature": 21.5, "humidity": 40}
+
+    def get_state(self):
+        return self.state
+
+
+class BenchGateway(Gateway):
+    def get_state(self):
+        return {"uptime": 1}
+
+
+class NullClient:
+    def SendData(self, data):
+        pass
+
+
+def old_get_d2c_data(device):
+    '''The previous GenericDevice.get_d2c_data'''
+    return [{
+        "uniqueId": device.unique_id,
+        "time": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        "data": device.get_state()
+    }]
+
+
+def old_cycle(gateway):
+    data_array = [old_get_d2c_data(gateway)]
+    for child in gateway.children:
+        data_array.append(old_get_d2c_data(child))
+    for data in data_array:
+        gateway.send_d2c(data)
+    return data_array
+
+
+def measure(fn) -> dict:
+    fn()  # warm up caches
+    seconds = timeit.timeit(fn, number=CYCLES) / CYCLES
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = fn()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del result
+
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    size = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    return {"ms": seconds * 1000, "blocks": blocks, "bytes": size}
+
+
+def main():
+    gateway = BenchGateway("bench", "gateway", "bench", "bench")
+    for i in range(CHILDREN):
+        gateway.add_child(Child("child-" + str(i)))
+    gateway.attribute_metadata = []
+    gateway.SdkClient = NullClient()
+
+    print("gateway with", CHILDREN, "children, per cycle:")
+    print("{:>10} {:>10} {:>16} {:>16}".format("", "ms", "live blocks", "live bytes"))
+    for name, fn in [("before", lambda: old_cycle(gateway)), ("after", gateway.send_device_states)]:
+        result = measure(fn)
+        print("{:>10} {:>10.3f} {:>16} {:>16}".format(name, result["ms"], result["blocks"], result["bytes"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+'''
+    Microbenchmark of JsonDevice.get_state per poll at 10/100/1000 attributes
+
+    Compares the compiled read plan against the previous nested metadata loop.
+    Run from the files directory: python3 tools/bench_read_plan.py
+'''
+import os
+import sys
+import json
+import timeit
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SIZES = [10, 100, 1000]
+POLLS = 20
+
+
+def write_device(tmp, count) -> str:
+    attributes = []
+    for i in range(count):
+        path = os.path.join(tmp, "attr_" + str(i))
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(str(i * 1.5))
+        attributes.append({"name": "attr_" + str(i), "private_data": path, "private_data_type": "ascii"})
+
+    config = {
+        "sdk_ver": "2.1", "duid": "bench", "cpid": "bench", "env": "bench", "sdk_id": "bench",
+        "auth": {"auth_type": "IOTC_AT_SYMMETRIC_KEY", "params": {"primary_key": "bench"}},
+        "device": {"commands_list_path": tmp, "attributes": attributes}
+    }
+    conf_path = os.path.join(tmp, "config.json")
+    with open(conf_path, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    return conf_path
+
+
+def nested_loop_state(device) -> dict:
+    '''The pre read plan implementation of get_attributes_state'''
+    from model.enums import Enums as E
+    data_obj = {}
+    for attribute in device.attributes:
+        for metadata in device.attribute_metadata:
+            if attribute.name == metadata[E.MetadataKeys.name]:
+                data_obj[attribute.name] = attribute.get_value(metadata[E.MetadataKeys.data_type])
+                break
+    return data_obj
+
+
+def run_size(count):
+    from model.json_device import JsonDevice
+    from model.enums import Enums as E
+
+    with tempfile.TemporaryDirectory() as tmp:
+        device = JsonDevice(write_device(tmp, count))
+        # Cloud metadata usually arrives in a different order from the local json
+        metadata = [{E.MetadataKeys.name: "attr_" + str(i), E.MetadataKeys.data_type: E.SendDataTypes.FLOAT} for i in reversed(range(count))]
+        device.get_attribute_metadata_from_cloud([{E.Keys.data: metadata}])
+
+        plan = timeit.timeit(device.get_attributes_state, number=POLLS) / POLLS
+        nested = timeit.timeit(lambda: nested_loop_state(device), number=POLLS) / POLLS
+        compile_time = timeit.timeit(device.compile_read_plan, number=POLLS) / POLLS
+
+    print(json.dumps({"attributes": count, "plan_ms": plan * 1000, "nested_loop_ms": nested * 1000, "compile_ms": compile_time * 1000}))
+
+
+def main(argv):
+    if len(argv) > 1:
+        run_size(int(argv[1]))
+        return
+
+    # Each size in a fresh interpreter so devices don't share state
+    print("{:>10} {:>12} {:>16} {:>12}".format("attributes", "plan ms", "nested loop ms", "compile ms"))
+    for count in SIZES:
+        out = subprocess.run([sys.executable, __file__, str(count)], check=True, capture_output=True, text=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print("{:>10} {:>12.3f} {:>16.3f} {:>12.3f}".format(count, result["plan_ms"], result["nested_loop_ms"], result["compile_ms"]))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+'''
+    Config load time with and without the compiled config cache
+
+    Run from the files directory: python3 tools/bench_startup.py [attribute count]
+'''
+import os
+import sys
+import json
+import timeit
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from model.json_parser import parse_json_for_config
+from model.config_cache import load_config, CACHE_SUFFIX
+
+RUNS = 20
+
+
+def write_config(tmp, count) -> str:
+    attributes = []
+    for i in range(count):
+        # spread over a few folders like sysfs attributes usually are
+        folder = os.path.join(tmp, "sensor" + str(i % 8))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, "attr_" + str(i))
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("1")
+        attributes.append({"name": "attr_" + str(i), "private_data": path, "private_data_type": "ascii"})
+
+    config = {
+        "sdk_ver": "2.1", "duid": "bench", "cpid": "bench", "env": "bench", "sdk_id": "bench",
+        "auth": {"auth_type": "IOTC_AT_SYMMETRIC_KEY", "params": {"primary_key": "bench"}},
+        "device": {"commands_list_path": tmp, "attributes": attributes}
+    }
+    conf_path = os.path.join(tmp, "config.json")
+    with open(conf_path, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    return conf_path
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as tmp:
+        conf_path = write_config(tmp, count)
+
+        parse = timeit.timeit(lambda: parse_json_for_config(conf_path), number=RUNS) / RUNS
+        if os.path.exists(conf_path + CACHE_SUFFIX):
+            os.remove(conf_path + CACHE_SUFFIX)
+        load_config(conf_path)
+        cached = timeit.timeit(lambda: load_config(conf_path), number=RUNS) / RUNS
+
+    print(json.dumps({"attributes": count, "parse_ms": parse * 1000, "cached_ms": cached * 1000}))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
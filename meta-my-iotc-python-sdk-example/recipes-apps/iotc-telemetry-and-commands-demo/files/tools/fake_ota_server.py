@@ -0,0 +1,117 @@
+'''
+    Local stand-in for a firmware download server
+
+    Serves one file over HTTP on 127.0.0.1 with ETag, Range and If-Range support, and can
+    drop the connection part way through a response to exercise resuming.
+    Usage:
+        server = FakeOtaServer("image.bin", drop_after=1048576, drops=2)
+        server.start()
+        device.SdkClient.inject_ota([{"url": server.url, "fileName": "image.bin"}])
+    or from a shell: python3 tools/fake_ota_server.py image.bin [--port 8000] [--drop-after BYTES --drops N]
+'''
+import os
+import re
+import sys
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RANGE = re.compile(r"bytes=(\d+)-(\d*)$")
+CHUNK = 65536
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server: FakeOtaServer = self.server.fake
+        if self.path.split("?", 1)[0] != "/" + os.path.basename(server.path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(server.path)
+        start, end = 0, size - 1
+        status = 200
+
+        requested = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if requested is not None and (if_range is None or if_range == server.etag):
+            match = RANGE.match(requested)
+            if match is None or int(match.group(1)) >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), size - 1)
+            status = 206
+
+        server.requests.append((self.headers.get("Range"), status))
+        self.send_response(status)
+        self.send_header("ETag", server.etag)
+        self.send_header("Content-Length", str(end - start + 1))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+
+        drop_at = None
+        if server.drops > 0 and server.drop_after is not None:
+            server.drops -= 1
+            drop_at = server.drop_after
+        sent = 0
+        with open(server.path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                data = f.read(min(CHUNK, remaining))
+                if drop_at is not None and sent + len(data) > drop_at:
+                    self.wfile.write(data[:drop_at - sent])
+                    # connection lost mid-body
+                    self.close_connection = True
+                    return
+                self.wfile.write(data)
+                sent += len(data)
+                remaining -= len(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOtaServer:
+    def __init__(self, path: str, port: int = 0, drop_after: int = None, drops: int = 0):
+        '''The first drops responses are cut off after drop_after bytes'''
+        self.path = path
+        self.drop_after = drop_after
+        self.drops = drops
+        self.requests = []
+        stat = os.stat(path)
+        self.etag = '"{:x}-{:x}"'.format(stat.st_size, stat.st_mtime_ns)
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self.server.fake = self
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:{}/{}".format(self.server.server_address[1], os.path.basename(self.path))
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-ota-server", daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Serve a firmware image for OTA tests")
+    parser.add_argument("path")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--drop-after", type=int, default=None, help="cut responses off after this many bytes")
+    parser.add_argument("--drops", type=int, default=0, help="how many responses to cut off")
+    args = parser.parse_args(argv[1:])
+
+    server = FakeOtaServer(args.path, args.port, args.drop_after, args.drops)
+    print("Serving", server.url)
+    server.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
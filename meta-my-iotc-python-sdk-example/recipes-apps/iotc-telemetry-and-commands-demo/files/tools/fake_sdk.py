@@ -0,0 +1,144 @@
+'''
+    Offline stand-in for IoTConnectSDK
+
+    Accepts the same constructor arguments and callback registrations as the real SDK,
+    records SendData and sendAckCmd calls instead of publishing them, and lets a test
+    or benchmark inject the messages the cloud would send.
+    Usage: device.connect(sdk_class=FakeIoTConnectSDK)
+'''
+import os
+import sys
+import json
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from model.enums import Enums as E
+
+
+class FakeIoTConnectSDK:
+    # metadata handed to GetAttributes callbacks, set before connect() to answer immediately
+    attributes: list = None
+
+    def __init__(self, uniqueId=None, sId=None, sdkOptions=None, initCallback=None, cpid=None, env=None):
+        self.unique_id = uniqueId
+        self.sdk_options = sdkOptions
+        self.init_callback = initCallback
+        self.callbacks: dict = {}
+        self.attribute_callback = None
+
+        self.lock = threading.Lock()
+        self.ack_event = threading.Condition(self.lock)
+        # SendData payloads are serialized like the real SDK does, keep_messages of them are kept
+        self.keep_messages = 100
+        self.messages = []
+        self.send_count = 0
+        self.bytes_sent = 0
+        self.acks = []
+        self.disposed = False
+        # answer to GetAllTwins, {"desired": {...}, "reported": {...}}
+        self.twin = None
+        self.twin_updates = []
+
+    # SDK API used by the model
+
+    def SendData(self, data):
+        payload = json.dumps(data)
+        with self.lock:
+            self.send_count += 1
+            self.bytes_sent += len(payload)
+            if len(self.messages) < self.keep_messages:
+                self.messages.append(payload)
+
+    def sendAckCmd(self, ack_id, status, message, id_to_send=None):
+        with self.lock:
+            self.acks.append((ack_id, status, message, id_to_send))
+            self.ack_event.notify_all()
+
+    def sendOTAAckCmd(self, ack_id, status, message):
+        self.sendAckCmd(ack_id, status, message)
+
+    def UpdateTwin(self, key, value):
+        with self.lock:
+            self.twin_updates.append((key, value))
+
+    def GetAllTwins(self):
+        if self.twin is not None and "twin" in self.callbacks:
+            self.callbacks["twin"](self.twin)
+
+    def Dispose(self):
+        self.disposed = True
+
+    def GetAttributes(self, callback):
+        self.attribute_callback = callback
+        if self.attributes is not None:
+            self.inject_attributes(self.attributes)
+
+    def onOTACommand(self, callback):
+        self.callbacks["ota"] = callback
+
+    def onModuleCommand(self, callback):
+        self.callbacks["module"] = callback
+
+    def onTwinChangeCommand(self, callback):
+        self.callbacks["twin"] = callback
+
+    def onAttrChangeCommand(self, callback):
+        self.callbacks["attribute_change"] = callback
+
+    def onDeviceChangeCommand(self, callback):
+        self.callbacks["device_change"] = callback
+
+    def onRuleChangeCommand(self, callback):
+        self.callbacks["rule_change"] = callback
+
+    def onDeviceCommand(self, callback):
+        self.callbacks["device"] = callback
+
+    # Injecting cloud messages
+
+    def inject_attributes(self, metadata: list):
+        '''Answers GetAttributes with metadata, a list of {"ln": name, "dt": data type} dicts'''
+        self.attributes = metadata
+        if self.attribute_callback is not None:
+            self.attribute_callback([{E.Keys.data: metadata}])
+
+    def inject_device_command(self, command: str, ack_id: str = "ack", msg_id: str = None):
+        msg = {
+            E.Keys.command_type: E.Values.Commands.DEVICE_COMMAND,
+            E.Keys.device_command: command,
+            E.Keys.ack: ack_id,
+            E.Keys.id: msg_id if msg_id is not None else self.unique_id
+        }
+        self.callbacks["device"](msg)
+
+    def inject_attribute_change(self, msg: dict = None):
+        if msg is None:
+            msg = {E.Keys.command_type: E.Values.Commands.U_ATTRIBUTE}
+        self.callbacks["attribute_change"](msg)
+
+    def inject_ota(self, urls: list, ack_id: str = "ota"):
+        '''Firmware command, urls is a list of {"url": ..., "fileName": ...} objects'''
+        msg = {
+            E.Keys.command_type: E.Values.Commands.FIRMWARE,
+            E.Keys.ota_urls: urls,
+            E.Keys.ack: ack_id,
+            E.Keys.id: self.unique_id
+        }
+        self.callbacks["ota"](msg)
+
+    def inject_connection_status(self, connected: bool):
+        '''INIT_CONNECT, what the SDK reports when its MQTT link goes up or down'''
+        self.init_callback({E.Keys.command_type: E.Values.Commands.INIT_CONNECT, "command": connected})
+
+    def inject_data_frequency(self, seconds):
+        '''DATA_FRQ, delivered to the init callback with the other platform commands'''
+        self.init_callback({E.Keys.command_type: E.Values.Commands.DATA_FRQ, "df": seconds})
+
+    def inject(self, callback_name: str, msg: dict):
+        '''Delivers msg to any registered callback: ota, module, twin, attribute_change, device_change, rule_change, device'''
+        self.callbacks[callback_name](msg)
+
+    def wait_for_acks(self, count: int, timeout: float = None) -> bool:
+        with self.lock:
+            return self.ack_event.wait_for(lambda: len(self.acks) >= count, timeout)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+'''
+    Offline benchmark suite for the model layer
+
+    Uses tools/fake_sdk.py instead of a live IoTConnect account and prints the results
+    as JSON, one object per case, so runs can be compared for regressions.
+    Run from the files directory: python3 tools/run_benchmarks.py [--output results.json] [--quick]
+'''
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fake_sdk import FakeIoTConnectSDK
+
+ATTRIBUTE_COUNTS = [10, 100, 1000]
+CHILD_COUNTS = [0, 100, 500]
+COMMAND_COUNT = 500
+SCRIPT_COMMAND_COUNT = 50
+
+
+def write_config(tmp, attribute_count, device_extra=None) -> str:
+    attributes = []
+    for i in range(attribute_count):
+        path = os.path.join(tmp, "attr_" + str(i))
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(str(i * 1.5))
+        attributes.append({"name": "attr_" + str(i), "private_data": path, "private_data_type": "ascii"})
+
+    scripts = os.path.join(tmp, "scripts")
+    os.makedirs(scripts, exist_ok=True)
+    with open(os.path.join(scripts, "noop.sh"), "w", encoding="utf-8") as f:
+        f.write("#!/bin/sh\necho ok\n")
+    os.chmod(os.path.join(scripts, "noop.sh"), 0o755)
+
+    device = {"commands_list_path": scripts, "attributes": attributes}
+    if device_extra is not None:
+        device.update(device_extra)
+    config = {
+        "sdk_ver": "2.1", "duid": "bench", "cpid": "bench", "env": "bench", "sdk_id": "bench",
+        "auth": {"auth_type": "IOTC_AT_SYMMETRIC_KEY", "params": {"primary_key": "bench"}},
+        "device": device
+    }
+    conf_path = os.path.join(tmp, "config.json")
+    with open(conf_path, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    return conf_path
+
+
+def metadata_for(count) -> list:
+    from model.enums import Enums as E
+    return [{E.MetadataKeys.name: "attr_" + str(i), E.MetadataKeys.data_type: E.SendDataTypes.FLOAT} for i in range(count)]
+
+
+def connected_device(conf_path, attribute_count):
+    from model.json_device import JsonDevice
+    FakeIoTConnectSDK.attributes = metadata_for(attribute_count)
+    device = JsonDevice(conf_path)
+    device.connect(sdk_class=FakeIoTConnectSDK)
+    return device
+
+
+def per_call_ms(fn, runs) -> float:
+    fn()
+    return timeit.timeit(fn, number=runs) / runs * 1000
+
+
+# Cases, each returns a dict of metrics
+
+def bench_get_state(tmp, count):
+    device = connected_device(write_config(tmp, count), count)
+    return {"ms_per_call": per_call_ms(device.get_state, 20)}
+
+
+def bench_send_device_states(tmp, count):
+    device = connected_device(write_config(tmp, count), count)
+    ms = per_call_ms(device.send_device_states, 20)
+    return {"ms_per_call": ms, "bytes_per_call": device.SdkClient.bytes_sent / device.SdkClient.send_count}
+
+
+def bench_gateway_send(tmp, children):
+    from model.device_model import Gateway, GenericDevice
+
+    class Child(GenericDevice):
+        def get_state(self):
+            return {"temperature": 21.5, "humidity": 40}
+
+    class BenchGateway(Gateway):
+        def get_state(self):
+            return {"uptime": 1}
+
+    gateway = BenchGateway("bench", "gateway", "bench", "bench")
+    for i in range(children):
+        gateway.add_child(Child("child-" + str(i)))
+    gateway.connect(sdk_class=FakeIoTConnectSDK)
+    gateway.get_attribute_metadata_from_cloud([{}])
+    ms = per_call_ms(gateway.send_device_states, 20)
+    return {"ms_per_call": ms, "messages_per_call": gateway.SdkClient.send_count / 21}
+
+
+def bench_device_cb(tmp, count, command, device_extra=None):
+    device = connected_device(write_config(tmp, 1, device_extra), 1)
+    sdk = device.SdkClient
+    start = time.perf_counter()
+    callback_s = 0.0
+    for i in range(count):
+        t = time.perf_counter()
+        sdk.inject_device_command(command, msg_id=str(i))
+        callback_s += time.perf_counter() - t
+        # stay inside the queue depth, commands beyond it are rejected by design
+        while len(sdk.acks) < i + 1 - device.command_pool.queue_depth // 2:
+            time.sleep(0.0001)
+    if not sdk.wait_for_acks(count, timeout=60):
+        raise TimeoutError("commands did not complete")
+    total_s = time.perf_counter() - start
+    failed = sum(1 for ack in sdk.acks if ack[1] != 7)
+    return {"commands": count, "callback_us": callback_s / count * 1e6, "commands_per_s": count / total_s, "failed": failed}
+
+
+def bench_device_cb_handler(tmp, count):
+    extra = {"commands": {"handlers": [{"name": "set", "type": "write_file", "path": os.path.join(tmp, "out")}], "max_concurrent": 4}}
+    return bench_device_cb(tmp, count, "set 1", extra)
+
+
+def bench_device_cb_script(tmp, count):
+    return bench_device_cb(tmp, count, "noop.sh", {"commands": {"max_concurrent": 4}})
+
+
+def bench_config_parse(tmp, count):
+    from model.json_parser import parse_json_for_config
+    from model.config_cache import load_config
+    conf_path = write_config(tmp, count)
+    parse = per_call_ms(lambda: parse_json_for_config(conf_path), 20)
+    cached = per_call_ms(lambda: load_config(conf_path), 20)
+    return {"parse_ms": parse, "cached_ms": cached}
+
+
+CASES = {
+    "get_state": (bench_get_state, ATTRIBUTE_COUNTS),
+    "send_device_states": (bench_send_device_states, ATTRIBUTE_COUNTS),
+    "gateway_send_device_states": (bench_gateway_send, CHILD_COUNTS),
+    "device_cb_handler": (bench_device_cb_handler, [COMMAND_COUNT]),
+    "device_cb_script": (bench_device_cb_script, [SCRIPT_COMMAND_COUNT]),
+    "config_parse": (bench_config_parse, ATTRIBUTE_COUNTS),
+}
+
+
+def run_case(name, size) -> dict:
+    fn, _ = CASES[name]
+    with tempfile.TemporaryDirectory() as tmp:
+        metrics = fn(tmp, size)
+    return {"benchmark": name, "size": size, **metrics}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--quick", action="store_true", help="only the smallest size of each case")
+    parser.add_argument("--case", nargs=2, metavar=("NAME", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv[1:])
+
+    if args.case is not None:
+        print(json.dumps(run_case(args.case[0], int(args.case[1]))))
+        return 0
+
+    results = []
+    for name, (_, sizes) in CASES.items():
+        for size in sizes[:1] if args.quick else sizes:
+            # a fresh interpreter per case keeps devices and caches from skewing each other
+            out = subprocess.run([sys.executable, __file__, "--case", name, str(size)], check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(out.strip().splitlines()[-1]))
+
+    report = {"python": sys.version.split()[0], "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "results": results}
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))